@@ -11,8 +11,12 @@
 ##############################################################################
 
 import os, glob
+import json
 
 from Analyzer import Analyzer
+from MultiAnalyzer import MultiAnalyzer
+from ZZAnalyzer.utils.profiling import mergeReports
+from ZZAnalyzer.utils.resultCache import ResultCache
 
 
 # temporary hack: samples with one of these in the name will not have trigger
@@ -44,16 +48,22 @@ def parseInputs(inputs):
 
 
 def runAnAnalyzer(channels, baseCuts, infile, outdir,
-                  maxEvents, intLumi, cleanRows, cutModifiers):
+                  maxEvents, intLumi, cleanRows, cutModifiers, columnar=False,
+                  profile=False, selectiveRead=False, cache=False):
     '''
     Run an Analyzer.
     Intended for use in threads, such that several processes all do this once.
+    If cache is True, the result is recorded in outdir's ResultCache.
+    Exceptions are printed (they won't print from threads without help), then
+    raised again so whoever is waiting for the result knows it failed.
     '''
     outfile = outdir+'/'+(infile.split('/')[-1])
     try:
         analyzer = Analyzer(channels, baseCuts, infile, outfile,
                             maxEvents, intLumi,
-                            cleanRows, cutModifiers=cutModifiers)
+                            cleanRows, cutModifiers=cutModifiers,
+                            columnar=columnar, profile=profile,
+                            selectiveRead=selectiveRead)
     # Exceptions won't print from threads without help
     except Exception as e:
         print "**********************************************************************"
@@ -63,7 +73,7 @@ def runAnAnalyzer(channels, baseCuts, infile, outdir,
         print "While initializing analyzer for {} with base cuts {} and modifiers [{}]".format(infile, baseCuts, ', '.join(m for m in cutModifiers))
         print "Killing task"
         print "**********************************************************************"
-        return
+        raise
 
     try:
         analyzer.analyze()
@@ -75,12 +85,79 @@ def runAnAnalyzer(channels, baseCuts, infile, outdir,
         print "While running analyzer for {} with base cuts {} and modifiers [{}]".format(infile, baseCuts, ', '.join(m for m in cutModifiers))
         print "Killing task"
         print "**********************************************************************"
-        return
+        raise
+
+    if cache:
+        ResultCache(outdir).store({'inFile' : infile, 'outDir' : outdir,
+                                   'channels' : channels, 'baseCuts' : baseCuts,
+                                   'cutModifiers' : cutModifiers,
+                                   'cleanRows' : cleanRows,
+                                   'maxEvents' : maxEvents, 'intLumi' : intLumi})
+
+
+def runAMultiAnalyzer(channels, infile, selections, maxEvents, intLumi,
+                      columnar=False, profile=False, selectiveRead=False,
+                      cache=False):
+    '''
+    Run several selections on the same input file with a MultiAnalyzer.
+    selections is a list of (baseCuts, outdir, cleanRows, cutModifiers).
+    Intended for use in threads, like runAnAnalyzer.
+    '''
+    sels = [{'baseCuts' : baseCuts,
+             'outFile' : outdir+'/'+(infile.split('/')[-1]),
+             'cleanRows' : cleanRows,
+             'cutModifiers' : cutModifiers,
+             } for baseCuts, outdir, cleanRows, cutModifiers in selections]
+    description = '; '.join('{} + [{}]'.format(baseCuts, ', '.join(mods)) for baseCuts, o, c, mods in selections)
+
+    try:
+        analyzer = MultiAnalyzer(channels, infile, sels, maxEvents, intLumi,
+                                 columnar=columnar, profile=profile,
+                                 selectiveRead=selectiveRead)
+    # Exceptions won't print from threads without help
+    except Exception as e:
+        print "**********************************************************************"
+        print "EXCEPTION"
+        print "Caught exception:"
+        print e
+        print "While initializing shared-scan analyzer for {} with selections {}".format(infile, description)
+        print "Killing task"
+        print "**********************************************************************"
+        raise
+
+    try:
+        analyzer.analyze()
+    except Exception as e:
+        print "**********************************************************************"
+        print "EXCEPTION"
+        print "Caught exception:"
+        print e
+        print "While running shared-scan analyzer for {} with selections {}".format(infile, description)
+        print "Killing task"
+        print "**********************************************************************"
+        raise
+
+    if cache:
+        for baseCuts, outdir, cleanRows, cutModifiers in selections:
+            ResultCache(outdir).store({'inFile' : infile, 'outDir' : outdir,
+                                       'channels' : channels, 'baseCuts' : baseCuts,
+                                       'cutModifiers' : cutModifiers,
+                                       'cleanRows' : cleanRows,
+                                       'maxEvents' : maxEvents, 'intLumi' : intLumi})
 
 
 class AnalysisManager(object):
     def __init__(self, allAnalyses, inputDir, pool, channels,
-                 assumeInputExists=False, isSpring16=False):
+                 assumeInputExists=False, isSpring16=False, sharedScan=False,
+                 useCache=False):
+        '''
+        If sharedScan is True, analyses that are ready at the same time and
+        read the same input file are run together in one job by a
+        MultiAnalyzer, so the file is only read once for all of them.
+        If useCache is True, analyses whose input file, settings and code
+        haven't changed since they were last run aren't run again (see
+        ZZAnalyzer.utils.resultCache).
+        '''
         self.all = allAnalyses
         self.channels = channels
         self.inputDir = inputDir
@@ -95,6 +172,13 @@ class AnalysisManager(object):
 
         self.isSpring16 = isSpring16
 
+        self.sharedScan = sharedScan
+
+        self.useCache = useCache
+
+        # {resultDir : profile files} for the jobs run this time
+        self.profileFiles = {}
+
     class FakeResult(object):
         '''
         A class that is always ready.
@@ -161,6 +245,7 @@ class AnalysisManager(object):
             return False
 
         subresults = [True]
+        toSubmit = []
         for ana in info:
             if ana == 'result' or ana == 'params':
                 continue
@@ -173,8 +258,19 @@ class AnalysisManager(object):
                 else:
                     inPrereqChain = False
 
+            if self.sharedScan and 'result' not in info[ana]:
+                # submit with everything else that's ready below
+                toSubmit.append(info[ana])
+                subresults.append(False)
+                continue
+
             subresults.append(self.tryToRunAnalyses(info[ana], inPrereqChain))
 
+        if toSubmit:
+            results = self.submitAnalyses([i.pop('params') for i in toSubmit])
+            for i, result in zip(toSubmit, results):
+                i['result'] = result
+
         return all(subresults)
 
     defaultParams = {
@@ -183,19 +279,24 @@ class AnalysisManager(object):
         'intLumi' : 9200.,
         'cleanRows' : '',
         'cutModifiers' : [],
+        'columnar' : False,
+        'profile' : False,
+        'selectiveRead' : False,
         }
     argVars = ['channels', 'baseCuts', 'inFile', 'outDir',
-               'maxEvents', 'intLumi', 'cleanRows', 'cutModifiers']
+               'maxEvents', 'intLumi', 'cleanRows', 'cutModifiers',
+               'columnar', 'profile', 'selectiveRead', 'cache']
 
-    def submitAnalysis(self, params):
+    def getArgs(self, params):
         '''
-        Given some parameters, submit a job running an
-        analyzer with those parameters and return a thread result object.
+        Get the full dict of arguments for an analyzer from the parameters
+        of one analysis, making the output directory if needed.
         '''
         argDict = self.defaultParams.copy()
         argDict['channels'] = self.channels
         argDict['outDir'] = os.path.join(self.inputDir, params['resultDir'])
         argDict.update(params)
+        argDict['cache'] = self.useCache
 
         if self.isSpring16 and any(s in argDict['inFile'] for s in _samplesWithoutTrigger):
             print 'Not applying trigger requirements for {}'.format(argDict['inFile'])
@@ -204,14 +305,126 @@ class AnalysisManager(object):
         if not os.path.isdir(argDict['outDir']):
             os.makedirs(argDict['outDir'])
 
+        return argDict
+
+    def submitAnalysis(self, params):
+        '''
+        Given some parameters, submit a job running an
+        analyzer with those parameters and return a thread result object.
+        '''
+        argDict = self.getArgs(params)
+
+        if self.isCached(argDict):
+            return self.FakeResult()
+
+        self.expectProfile(argDict)
+
         args = tuple(argDict[v] for v in self.argVars)
 
         result = self.pool.apply_async(runAnAnalyzer, args=args)
 
         return result
 
+    def submitAnalyses(self, paramList):
+        '''
+        Given parameters for several analyses, submit one job for each group
+        of them that read the same input file (with the same settings), using
+        a MultiAnalyzer when there's more than one in a group.
+        Returns a list of thread result objects, one for each analysis.
+        '''
+        results = [None] * len(paramList)
+
+        groups = []
+        for i, params in enumerate(paramList):
+            argDict = self.getArgs(params)
+            if self.isCached(argDict):
+                results[i] = self.FakeResult()
+                continue
+            key = (argDict['inFile'], argDict['maxEvents'], argDict['intLumi'],
+                   argDict['columnar'], argDict['profile'], argDict['selectiveRead'])
+            # Analyses writing to the same place can't share a job, because
+            # they'd both have the output file open at once
+            for groupKey, group in groups:
+                if groupKey == key and all(a['outDir'] != argDict['outDir'] for j, a in group):
+                    group.append((i, argDict))
+                    break
+            else:
+                groups.append((key, [(i, argDict)]))
+
+        for key, group in groups:
+            for i, argDict in group:
+                self.expectProfile(argDict)
+
+            if len(group) == 1:
+                i, argDict = group[0]
+                results[i] = self.pool.apply_async(runAnAnalyzer,
+                                                   args=tuple(argDict[v] for v in self.argVars))
+                continue
+
+            inFile, maxEvents, intLumi, columnar, profile, selectiveRead = key
+            selections = [(a['baseCuts'], a['outDir'], a['cleanRows'], a['cutModifiers']) for i, a in group]
+            result = self.pool.apply_async(runAMultiAnalyzer,
+                                           args=(self.channels, inFile, selections,
+                                                 maxEvents, intLumi, columnar, profile,
+                                                 selectiveRead, self.useCache))
+            for i, argDict in group:
+                results[i] = result
+
+        return results
 
+    def isCached(self, argDict):
+        '''
+        If using the cache, check whether the analysis with these arguments
+        (from getArgs) has already been done with the same input and code.
+        '''
+        if not self.useCache:
+            return False
+        try:
+            cached = ResultCache(argDict['outDir']).lookup(argDict)
+        except (OSError, IOError):
+            # e.g. input doesn't exist yet; let the job deal with it
+            return False
+        if cached:
+            print 'Reusing cached results for {} in {}'.format(argDict['inFile'], argDict['outDir'])
+        return cached
 
 
+    def expectProfile(self, argDict):
+        '''
+        If the analysis with these arguments (from getArgs) is profiled,
+        remember where its profile will be for writeProfileSummary(). Call
+        when the job is submitted. An old profile left there by an earlier
+        run is removed, so it can't be mistaken for this run's if the job
+        fails.
+        '''
+        if not argDict['profile']:
+            return
+
+        # same name the Analyzer gives it
+        outFile = argDict['outDir']+'/'+(argDict['inFile'].split('/')[-1])
+        profileFile = outFile.replace('.root','_profile.json')
+        if os.path.exists(profileFile):
+            os.remove(profileFile)
+
+        self.profileFiles.setdefault(argDict['resultDir'], set()).add(profileFile)
+
+
+    def writeProfileSummary(self, fileName='profileSummary.json'):
+        '''
+        Add up the profiles (see ZZAnalyzer.utils.profiling) written by the
+        jobs run by this manager for each analysis, and save them in one file
+        in the input directory, as {resultDir : merged profile}. Profiles of
+        jobs that failed or weren't run (cached, or from other runs) are
+        left out. Returns the merged profiles.
+        '''
+        summary = {}
+        for resultDir, profileFiles in self.profileFiles.iteritems():
+            reports = sorted(f for f in profileFiles if os.path.exists(f))
+            if reports:
+                summary[resultDir] = mergeReports(reports)
 
+        if summary:
+            with open(os.path.join(self.inputDir, fileName), 'w') as f:
+                json.dump(summary, f, indent=2, sort_keys=True)
 
+        return summary
@@ -0,0 +1,321 @@
+##############################################################################
+#                                                                            #
+#    AnalysisScheduler.py                                                    #
+#                                                                            #
+#    Runs the analyses set up by one or more AnalysisManagers as a task      #
+#    graph: every (sample, analysis) is a task that depends on the task      #
+#    making its input (its prereq). Tasks are sent to the worker pool as     #
+#    soon as their prereq finishes, biggest input first, with failures       #
+#    retried and reported at the end. A task whose worker process dies       #
+#    (see ZZAnalyzer.utils.poolWatcher) counts as failed.                    #
+#                                                                            #
+#    Nate Woods, U. Wisconsin                                                #
+#                                                                            #
+##############################################################################
+
+import os
+import time
+import heapq
+import traceback
+from Queue import Queue, Empty
+
+from AnalysisManager import runAnAnalyzer, runAMultiAnalyzer
+from ZZAnalyzer.utils.poolWatcher import PoolWatcher, runWatched
+
+
+def _runTask(fun, args):
+    '''
+    Run fun(*args) in a worker process. Returns (True, '') if it worked, or
+    (False, traceback) if it didn't, so the result callback (which Python 2
+    pools only call for jobs that work) always gets called, unless the
+    worker dies.
+    '''
+    try:
+        fun(*args)
+    except Exception:
+        return False, traceback.format_exc()
+    return True, ''
+
+
+class AnalysisTask(object):
+    '''
+    One analysis of one sample.
+    '''
+    def __init__(self, manager, sample, analysis, params, prereq=None):
+        self.manager = manager
+        self.sample = sample
+        self.analysis = analysis
+        self.params = params
+        self.prereq = prereq
+        self.dependents = []
+
+        self.status = 'waiting' # -> 'ready' -> 'running' -> 'done'/'failed'/'skipped'
+        self.attempts = 0
+        self.errors = []
+        self.runTime = 0.
+        self.argDict = None
+
+        # Inputs made by other tasks don't exist yet, but they'll be about
+        # as big as the original sample
+        inFile = params['inFile']
+        if os.path.exists(inFile):
+            self.expectedSize = os.path.getsize(inFile)
+        elif prereq is not None:
+            self.expectedSize = prereq.expectedSize
+        else:
+            self.expectedSize = 0
+
+    def name(self):
+        return '{}: {}'.format(self.analysis, self.sample)
+
+    def groupKey(self):
+        '''
+        Tasks with the same key can be run together by a MultiAnalyzer.
+        '''
+        a = self.argDict
+        return (id(self.manager), a['inFile'], a['maxEvents'], a['intLumi'],
+                a['columnar'], a['profile'], a['selectiveRead'])
+
+
+class AnalysisScheduler(object):
+    # seconds between checks for dead worker processes
+    checkInterval = 10
+
+    def __init__(self, pool, nSlots, maxRetries=1):
+        '''
+        pool:        multiprocessing pool to run analyses in
+        nSlots:      number of analyses to have in the pool at once (usually
+                         the number of worker processes). Tasks wait here,
+                         rather than in the pool's queue, so the biggest
+                         ready task always starts next.
+        maxRetries:  number of times to try again if an analysis fails
+        '''
+        self.pool = pool
+        self.nSlots = nSlots
+        self.maxRetries = maxRetries
+
+        self.tasks = []
+        self._ready = []
+        self._nPushed = 0
+        self._running = 0
+        # {job number : (tasks, start time)} for jobs in the pool
+        self._jobs = {}
+        self._nJobs = 0
+        self._watcher = None
+        # If a worker died, the pool still waits for its job, so it has to be
+        # terminated rather than closed when we're done with it
+        self.workersDied = False
+        # Results come back in the pool's result thread; they go through this
+        # so all the bookkeeping happens in the main thread
+        self._finished = Queue()
+
+
+    def addManager(self, manager):
+        '''
+        Make tasks for all the analyses of all the samples in an
+        AnalysisManager (after its addAnalyses() has been called).
+        '''
+        for sample in manager.samples:
+            self._addTasks(manager, sample, manager.analyses[sample], None, False)
+
+
+    def _addTasks(self, manager, sample, info, prereq, afterEndResult):
+        for ana, subInfo in info.iteritems():
+            if ana in ('params', 'result'):
+                continue
+
+            task = AnalysisTask(manager, sample, ana, subInfo['params'], prereq)
+            self.tasks.append(task)
+            if prereq is not None:
+                prereq.dependents.append(task)
+
+            isEnd = afterEndResult or ana in manager.endResults
+            if manager.assumeInputExists and not isEnd:
+                # only here to make inputs for later steps, which we assume exist
+                task.status = 'skipped'
+            elif prereq is None or prereq.status == 'skipped':
+                self._makeReady(task)
+
+            self._addTasks(manager, sample, subInfo, task, isEnd)
+
+
+    def _makeReady(self, task):
+        task.status = 'ready'
+        # biggest first, then in the order they became ready
+        heapq.heappush(self._ready, (-task.expectedSize, self._nPushed, task))
+        self._nPushed += 1
+
+
+    def run(self):
+        '''
+        Run everything. Returns True if all the tasks worked.
+        '''
+        start = time.time()
+        self._watcher = PoolWatcher(self.pool)
+        try:
+            self._dispatch()
+            while self._running:
+                try:
+                    # timeout so KeyboardInterrupt gets through, and to check
+                    # on the workers
+                    jobID, (worked, error), runTime = self._finished.get(True, self.checkInterval)
+                except Empty:
+                    for jobID, pid in self._watcher.lost():
+                        self.workersDied = True
+                        self._jobFinished(jobID, False,
+                                          'Worker process {} died while running this'.format(pid),
+                                          time.time() - self._jobs[jobID][1])
+                    continue
+                self._jobFinished(jobID, worked, error, runTime)
+        finally:
+            self._watcher.shutdown()
+            self._watcher = None
+
+        self.report(time.time() - start)
+
+        return not any(t.status == 'failed' or (t.status == 'skipped' and t.errors)
+                       for t in self.tasks)
+
+
+    def _dispatch(self):
+        '''
+        Start as many ready tasks as there are free slots.
+        '''
+        while self._running < self.nSlots and self._ready:
+            task = heapq.heappop(self._ready)[2]
+
+            if task.argDict is None:
+                task.argDict = task.manager.getArgs(task.params)
+            if task.manager.isCached(task.argDict):
+                self._taskFinished(task, True, '', 0.)
+                continue
+
+            group = [task]
+            if task.manager.sharedScan:
+                group += self._takeSameInput(task)
+
+            self._submit(group)
+
+
+    def _takeSameInput(self, task):
+        '''
+        Take all ready tasks that can share a MultiAnalyzer with task out of
+        the queue (and return them).
+        '''
+        key = task.groupKey()
+        outDirs = set([task.argDict['outDir']])
+
+        group = []
+        keep = []
+        for item in self._ready:
+            other = item[2]
+            if other.manager is task.manager and other.params['inFile'] == task.params['inFile']:
+                if other.argDict is None:
+                    other.argDict = other.manager.getArgs(other.params)
+                # tasks writing to the same place can't share a job
+                if other.groupKey() == key and other.argDict['outDir'] not in outDirs \
+                        and not other.manager.isCached(other.argDict):
+                    group.append(other)
+                    outDirs.add(other.argDict['outDir'])
+                    continue
+            keep.append(item)
+
+        if group:
+            heapq.heapify(keep)
+            self._ready = keep
+
+        return group
+
+
+    def _submit(self, group):
+        for task in group:
+            task.status = 'running'
+            task.attempts += 1
+            task.manager.expectProfile(task.argDict)
+
+        first = group[0]
+        if len(group) == 1:
+            args = tuple(first.argDict[v] for v in first.manager.argVars)
+            fun = runAnAnalyzer
+        else:
+            a = first.argDict
+            selections = [(t.argDict['baseCuts'], t.argDict['outDir'],
+                           t.argDict['cleanRows'], t.argDict['cutModifiers'])
+                          for t in group]
+            args = (first.manager.channels, a['inFile'], selections,
+                    a['maxEvents'], a['intLumi'], a['columnar'], a['profile'],
+                    a['selectiveRead'], a['cache'])
+            fun = runAMultiAnalyzer
+
+        jobID = self._nJobs
+        self._nJobs += 1
+        start = time.time()
+        def callback(result):
+            self._finished.put((jobID, result, time.time() - start))
+
+        self._jobs[jobID] = (group, start)
+        self._running += 1
+        self.pool.apply_async(runWatched,
+                              args=(self._watcher.started, jobID, _runTask, fun, args),
+                              callback=callback)
+
+
+    def _jobFinished(self, jobID, worked, error, runTime):
+        if jobID not in self._jobs:
+            # already given up on
+            return
+        group = self._jobs.pop(jobID)[0]
+        self._running -= 1
+        for task in group:
+            self._taskFinished(task, worked, error, runTime)
+        self._dispatch()
+
+
+    def _taskFinished(self, task, worked, error, runTime):
+        task.runTime += runTime
+
+        if worked:
+            task.status = 'done'
+            for dep in task.dependents:
+                if dep.status == 'waiting':
+                    self._makeReady(dep)
+            return
+
+        task.errors.append(error)
+        if task.attempts <= self.maxRetries:
+            print "{} failed (attempt {}), trying again".format(task.name(), task.attempts)
+            self._makeReady(task)
+            return
+
+        print "{} failed (attempt {}), giving up".format(task.name(), task.attempts)
+        task.status = 'failed'
+        self._skipDependents(task)
+
+
+    def _skipDependents(self, task):
+        for dep in task.dependents:
+            if dep.status == 'waiting':
+                dep.status = 'skipped'
+                dep.errors.append('Not run because {} failed'.format(task.name()))
+                self._skipDependents(dep)
+
+
+    def report(self, totalTime):
+        '''
+        Print what happened to every task that was run or failed.
+        '''
+        print ""
+        print "Ran {} analyses in {:.0f}s".format(sum(t.status == 'done' for t in self.tasks), totalTime)
+        for task in sorted(self.tasks, key=lambda t: (t.analysis, t.sample)):
+            if task.status == 'skipped' and not task.errors:
+                continue
+            print "    {:60} {:8} attempts: {}  time: {:.0f}s".format(task.name(), task.status,
+                                                                      task.attempts, task.runTime)
+
+        failed = [t for t in self.tasks if t.status == 'failed']
+        if failed:
+            print ""
+            print "FAILURES:"
+            for task in failed:
+                print "{} failed {} time(s). Last error:".format(task.name(), len(task.errors))
+                print task.errors[-1]
@@ -24,29 +24,114 @@ from rootpy import ROOTError
 import os
 from itertools import combinations
 import math
+import multiprocessing
+
+import numpy as np
 
 from ZZAnalyzer.metadata import sampleInfo
 from ZZAnalyzer.utils.helpers import * # evVar, objVar, nObjVar, parseChannels, mapObjects, Z_MASS
 from ZZAnalyzer.cuts import getCutClass
 from ZZAnalyzer.results import NtupleCopier
 from ZZAnalyzer.cleaning import getCleanerClass
+from ZZAnalyzer.utils.profiling import Profiler
 
 assert os.environ["zza"], "Run setup.sh before running analysis"
 
+
+def enableOnlyBranches(ntuple, patterns):
+    '''
+    Turn off every branch in ntuple except those matching one of the
+    compiled regular expressions in patterns.
+    '''
+    ntuple.SetBranchStatus('*', 0)
+    for branch in ntuple.iterbranchnames():
+        for pattern in patterns:
+            if pattern.match(branch):
+                ntuple.SetBranchStatus(branch, 1)
+                break
+
+
+def readFullEntry(ntuple, iRow):
+    '''
+    Read every branch of entry iRow of ntuple into its buffer, including
+    branches that are turned off. (rootpy's GetEntry doesn't take the
+    getall argument, so use ROOT's directly.)
+    '''
+    ROOT.TTree.GetEntry(ntuple, iRow, 1)
+
+
+def _cutChunk(args):
+    '''
+    Do the cuts on one chunk of an ntuple, for Analyzer.analyzeChannelParallel.
+    Runs in a worker process, so it makes its own Analyzer (which doesn't
+    save anything). Returns the cut flow for the chunk and the entries of 
+    the rows that pass.
+    '''
+    (baseCutSet, cutModifiers, inFile, ntupleDir, channel, start, stop,
+     entries, columnar, chunkSize) = args
+
+    analyzer = Analyzer(channel, baseCutSet, inFile, None,
+                        cutModifiers=cutModifiers, ntupleDir=ntupleDir,
+                        columnar=columnar, chunkSize=chunkSize)
+    passing = analyzer.cutChunk(channel, start, stop, entries)
+    analyzer.inFile.close()
+
+    return analyzer.cutsPassed[channel], passing
+
+
 class Analyzer(object):
     def __init__(self, channels, baseCutSet, inFile, outfile='./results/output.root',
                  maxEvents=float("inf"), intLumi=10000, rowCleaner='',
-                 cutModifiers=[], ntupleDir='ntuple'):
+                 cutModifiers=[], ntupleDir='ntuple', columnar=False,
+                 chunkSize=100000, sharedInput=None, nWorkers=1,
+                 profile=False, selectiveRead=False, exportFormat='',
+                 exportBranches=None, rowGroupSize=100000):
         '''
         channels:    list of strings or single string in the format (e.g.) eemm for
                          a 2e2mu final state. '4l', 'zz' and 'ZZ' turn into ['eeee' 'eemm' 'mmmm']
         cutSet:      string with the name of the cut template to use
         infile:      string of an input file name, with path
-        outfile:     string of an output file name, with path
+        outfile:     string of an output file name, with path. If None, nothing
+                         is saved (for Analyzers doing part of another's work)
         maxEvents:   stop after this many events processed
         intLumi:     in output text file, report how many events we would expect for this integrated luminosity
         rowCleaner:  name of a module to clean out redundant rows. If an empty
                          string (or other False boolean), no cleaning is performed.
+        columnar:    if True, read the branches the cuts need chunkSize rows at a
+                         time as NumPy arrays and do each cut on the whole chunk
+                         at once, instead of looping over rows in Python. Gives
+                         the same cut flow and output. Classes that do things
+                         row-by-row in preCut or passCut always use the row loop.
+        chunkSize:   number of rows per chunk in columnar mode
+        sharedInput: (file, {channel : ntuple}) for an input file that is already
+                         open and shared with other Analyzers (see MultiAnalyzer).
+                         The ntuples must be the same objects for all of them so
+                         they share one buffer. The file is not closed when the
+                         analysis is done.
+        nWorkers:    if more than 1, each channel's rows are split into chunks
+                         (never splitting an event) and the cuts are done on 
+                         them in this many processes at once. The rows that
+                         pass are then saved in order by this process, so the
+                         output is the same as with one process. Same
+                         restrictions as columnar mode.
+        profile:     if True, time every cut and every stage of the analysis
+                         (reading, cuts, cleaning, saving) for each channel,
+                         and save the times in a JSON file with the same name
+                         as outfile but _profile.json instead of .root (see
+                         ZZAnalyzer.utils.profiling). In parallel mode, the
+                         cuts done by the workers aren't timed.
+        selectiveRead: if True, only the branches the cuts and row cleaner
+                         need are read while looping over rows. Rows that 
+                         pass are read in full just before they're saved, so 
+                         the output is the same.
+        exportFormat: 'parquet' or 'arrow' to also write the saved rows of
+                         each channel to a columnar file next to outfile, with
+                         the cut flow as metadata (see 
+                         ZZAnalyzer.results.ColumnarExporter). Empty for no
+                         columnar output.
+        exportBranches: list of regular expressions for the branches to put in
+                         the columnar output (all branches if None)
+        rowGroupSize: rows per row group in the columnar output
         '''
         self.cutSet = [baseCutSet]+cutModifiers
         CutClass = getCutClass(baseCutSet, *cutModifiers)
@@ -58,7 +143,13 @@ class Analyzer(object):
         self.cutOrder = self.cuts.getCutList()
 
         self.sample = inFile.split('/')[-1].replace('.root','')
-        self.inFile = root_open(inFile)
+        self.inFileName = inFile
+        self.ownInput = sharedInput is None
+        if self.ownInput:
+            self.inFile = root_open(inFile)
+            sharedNtuples = {}
+        else:
+            self.inFile, sharedNtuples = sharedInput
         assert bool(inFile), 'No file %s'%self.inFile
 
         self.maxEvents = maxEvents
@@ -68,14 +159,19 @@ class Analyzer(object):
 
         self.channels = parseChannels(channels)
 
+        self.ntupleDir = ntupleDir
         self.ntuples = {}
         for channel in parseChannels(channels):
             try:
-                nt = self.inFile.Get('/'.join([channel,ntupleDir]))
+                if channel in sharedNtuples:
+                    nt = sharedNtuples[channel]
+                else:
+                    nt = self.inFile.Get('/'.join([channel,ntupleDir]))
                 # if not nt.GetEntries():
                 #     raise DoesNotExist('')
                 self.ntuples[channel] = nt
-                nt.create_buffer()
+                if not nt._buffer:
+                    nt.create_buffer()
             except DoesNotExist:
                 print "Ntuple for channel %s is empty or not found! Skipping."%channel
                 self.channels.remove(channel)
@@ -84,7 +180,14 @@ class Analyzer(object):
             if self.maxEvents < float('inf'):
                 self.ntupleSize[channel] = self.ntuples[channel].GetEntries()
 
-        self.results = NtupleCopier(self.outFile, **self.ntuples)
+        if self.outFile is not None:
+            self.results = NtupleCopier(self.outFile, **self.ntuples)
+            if exportFormat:
+                # only needs root_numpy (and pyarrow, for Parquet) when used
+                from ZZAnalyzer.results.ColumnarExporter import ColumnarExporter
+                self.results.addExporter(ColumnarExporter(self.outFile, exportFormat,
+                                                          exportBranches, rowGroupSize))
+        self.exportColumns = bool(exportFormat) and self.outFile is not None
 
         self.prepareCutSummary()
 
@@ -94,6 +197,32 @@ class Analyzer(object):
         if self.cleanRows:
             self.CleanerClass = getCleanerClass(rowCleaner)
 
+        self.chunkSize = chunkSize
+        self.columnar = columnar
+        self.nWorkers = nWorkers
+        self.selectiveRead = selectiveRead
+        # True while the ntuple being looped over only reads some branches
+        self.partialRows = False
+        if (self.columnar or self.nWorkers > 1) and \
+                (self.__class__.preCut.im_func is not Analyzer.preCut.im_func or
+                 self.__class__.passCut.im_func is not Analyzer.passCut.im_func):
+            print "%s does things for every row in preCut or passCut, so it can't run in columnar or parallel mode. Looping over rows in one process instead."%self.__class__.__name__
+            self.columnar = False
+            self.nWorkers = 1
+        if self.nWorkers > 1 and multiprocessing.current_process().daemon:
+            print "%s: Already running in a worker process, which can't start more. Running in one process."%self.sample
+            self.nWorkers = 1
+
+        # Only wrap things in timers if we're profiling, so it's free if not
+        self.profiler = None
+        if profile:
+            self.profiler = Profiler()
+            self.cuts.profileCuts(self.profiler)
+            self.passesCuts = self.profiler.timeStage(self.passesCuts, 'cuts')
+            self.cutBlock = self.profiler.timeStage(self.cutBlock, 'cuts')
+            if self.outFile is not None:
+                self.results.saveRow = self.profiler.timeStage(self.results.saveRow, 'saveRow')
+                self.results.save = self.profiler.timeStage(self.results.save, 'save')
 
 
     def prepareCutSummary(self):
@@ -113,111 +242,428 @@ class Analyzer(object):
         For a given file, do the whole analysis and output the results to
         self.outFile
         '''
-        if self.cleanRows:
-            # For events with more than 4 leptons, FSA Ntuples just have one
-            #     row for each possible combination of objects. We have to know
-            #     which one is the right one. Can do this before or after other cuts
-            rowCleaner = self.CleanerClass(self.cuts)
-            cleanAfter = rowCleaner.cleanAfter()
+        self.setupCleaner()
 
-            if not cleanAfter:
+        if self.rowCleaner is not None and not self.cleanAfter:
+            for channel in self.channels:
+                self.startCleaning(channel)
+                if self.selectiveRead:
+                    enableOnlyBranches(self.ntuples[channel], self.cuts.branchesNeeded)
+                for iRow, row in enumerate(self.timedRead(self.ntuples[channel])):
+                    if iRow == self.maxEvents:
+                        break
+                    if (iRow % 5000) == 0:
+                        print "%s: Finding redundant rows for %s row %d"%(self.sample, channel, iRow)
+                    self.rowCleaner.bookRow(row, iRow)
+                if self.selectiveRead:
+                    self.ntuples[channel].SetBranchStatus('*', 1)
+                self.rowCleaner.finalize()
+
+        if self.nWorkers > 1:
+            pool = multiprocessing.Pool(self.nWorkers)
+            try:
                 for channel in self.channels:
-                    self.cutsPassed[channel]["TotalRows"] = 0 # hold number of rows pre-cleaning
-                    rowCleaner.setChannel(channel)
-                    for iRow, row in enumerate(self.ntuples[channel]):
-                        if iRow == self.maxEvents:
-                            break
-                        if (iRow % 5000) == 0:
-                            print "%s: Finding redundant rows for %s row %d"%(self.sample, channel, iRow)
-                        rowCleaner.bookRow(row, iRow)
-                    rowCleaner.finalize()
+                    self.analyzeChannelParallel(channel, pool)
+            finally:
+                pool.close()
+                pool.join()
         else:
-            cleanAfter = False
+            for channel in self.channels:
+                if self.columnar:
+                    self.analyzeChannelColumnar(channel)
+                else:
+                    self.analyzeChannel(channel)
 
+        if self.cleanAfter:
+            self.setProfiledChannel('all') # cleaning looks at all channels at once
+            self.rowCleaner.finalize()
+            for channel in self.channels:
+                self.saveBest(channel)
 
-        for channel in self.channels:
+        self.finish()
 
-            objectTemplate = mapObjects(channel)
-            objects = objectTemplate
-            needReorder = self.cuts.needReorder(channel)
-
-            if cleanAfter:
-                rowCleaner.setChannel(channel)
-                self.cutsPassed[channel]["SelectBest"] = 0
-
-                self.ntuples[channel].SetBranchStatus('*', 0)
-                for branch in self.ntuples[channel].iterbranchnames():
-                    for pattern in self.cuts.branchesNeeded:
-                        if pattern.match(branch):
-                            self.ntuples[channel].SetBranchStatus(branch, 1)
-                            break
-
-
-            iRow = -1 # in case of empty ntuple
-            # Loop through and do the cuts
-            for iRow, row in enumerate(self.ntuples[channel]):
-                # If we've hit maxEvents, we're done
-                if iRow == self.maxEvents:
-                    print "%s: Reached %d %s rows, ending"%(self.sample, self.maxEvents, channel)
-                    break
-
-                if self.cleanRows:
-                    if not cleanAfter:
-                        # Always pass "TotalRows" because it's always a new row
-                        self.passCut(row, channel, "TotalRows")
-                        # Ignore wrong version of event (if we're cleaning now)
-                        if rowCleaner.isRedundant(row, channel, iRow):
-                            continue
-
-                # Report progress every 5000 rows
-                if iRow % 5000 == 0:
-                    print "%s: Processing %s row %d"%(self.sample, channel, iRow)
-
-                if needReorder:
-                    objects = self.cuts.orderLeptons(row, channel, objectTemplate)
-
-                evPass = True
-                for cut in self.cutOrder:
-                    self.preCut(row, channel, cut)
-                    if self.cuts.analysisCut(row, cut, *objects):
-                        self.passCut(row, channel, cut)
-                    else:
-                        evPass = False
-                        break
 
-                if evPass:
-                    if cleanAfter: # Don't save yet, still might get cleaned
-                        rowCleaner.bookRow(row, iRow)
-                    else:
-                        self.results.saveRow(row, channel)
-            else:
-                print "%s: Done with %s (%d rows)"%(self.sample, channel, iRow+1)
+    def setupCleaner(self):
+        '''
+        For events with more than 4 leptons, FSA Ntuples just have one row for
+        each possible combination of objects. We have to know which one is the
+        right one. Can do this before or after other cuts.
+        Sets self.rowCleaner (None if there's no cleaning) and self.cleanAfter.
+        '''
+        if self.cleanRows:
+            self.rowCleaner = self.CleanerClass(self.cuts)
+            self.cleanAfter = self.rowCleaner.cleanAfter()
+            if self.profiler is not None:
+                self.rowCleaner.bookRow = self.profiler.timeStage(self.rowCleaner.bookRow, 'cleaning')
+                self.rowCleaner.finalize = self.profiler.timeStage(self.rowCleaner.finalize, 'cleaning')
+        else:
+            self.rowCleaner = None
+            self.cleanAfter = False
 
-            if cleanAfter:
-                self.ntuples[channel].SetBranchStatus('*', 1)
 
-        if cleanAfter:
-            rowCleaner.finalize()
-            for channel in self.channels:
-                for iRow, row in enumerate(self.ntuples[channel]):
-                    if iRow == self.maxEvents:
-                        break
-                    if rowCleaner.isRedundant(row, channel, iRow):
-                        continue
-                    else:
-                        self.passCut(row, channel, "SelectBest")
-                        self.results.saveRow(row, channel)
+    def startCleaning(self, channel):
+        '''
+        Get ready to book all rows in channel with the row cleaner, when
+        cleaning before the cuts.
+        '''
+        self.cutsPassed[channel]["TotalRows"] = 0 # hold number of rows pre-cleaning
+        self.rowCleaner.setChannel(channel)
+        self.setProfiledChannel(channel)
+
+
+    def saveBest(self, channel):
+        '''
+        When cleaning after the cuts, save the best version of each event in
+        channel. Only rows that passed the cuts were booked with the row
+        cleaner, so only the winners among those are read again.
+        '''
+        self.setProfiledChannel(channel)
 
+        ntuple = self.ntuples[channel]
+        getEntry = self.timedGetEntry(ntuple)
+        for iRow in self.rowCleaner.bestRowIndices(channel).tolist():
+            getEntry(iRow)
+            self.saveBestRow(ntuple, channel)
 
 
+    def setProfiledChannel(self, channel):
+        '''
+        If profiling, record times for channel from now on.
+        '''
+        if self.profiler is not None:
+            self.profiler.channel = channel
+
+
+    def timedRead(self, rows):
+        '''
+        Iterable of rows (or blocks), with the time taken to read them
+        recorded if profiling.
+        '''
+        if self.profiler is None:
+            return rows
+        return self.profiler.timeIter(rows, 'read')
+
+
+    def timedGetEntry(self, ntuple):
+        '''
+        ntuple.GetEntry, timed if profiling.
+        '''
+        if self.profiler is None:
+            return ntuple.GetEntry
+        return self.profiler.timeStage(ntuple.GetEntry, 'read')
+
+
+    def saveBestRow(self, row, channel):
+        '''
+        Save a row the row cleaner picked as the best version of its event.
+        '''
+        self.passCut(row, channel, "SelectBest")
+        self.results.saveRow(row, channel)
+
+
+    def finish(self):
+        '''
+        Save the results and the cut report.
+        '''
         print "%s: Done with all channels, saving results as %s"%(self.sample, self.outFile)
 
-        self.results.save()
+        self.setProfiledChannel('all')
 
-        self.inFile.close()
+        if self.exportColumns:
+            self.results.save(exportInfo=self.exportInfo())
+        else:
+            self.results.save()
+
+        if self.ownInput:
+            self.inFile.close()
 
         self.cutReport()
 
+        if self.profiler is not None:
+            self.profiler.write(self.outFile.replace('.root','_profile.json'))
+
+
+    def exportInfo(self):
+        '''
+        Metadata for each channel's columnar output: the selection, the cut
+        flow, and the summed metaInfo values of the input file.
+        '''
+        from ZZAnalyzer.results.ColumnarExporter import summedMetaInfo
+
+        metaInfo = summedMetaInfo(self.inFileName)
+
+        info = {}
+        for channel in self.channels:
+            info[channel] = {
+                'sample' : self.sample,
+                'channel' : channel,
+                'cuts' : self.cutSet,
+                'rowCleaner' : self.CleanerClass.__name__ if self.cleanRows else '',
+                'cutOrder' : self.cutOrder,
+                'cutFlow' : dict(self.cutsPassed[channel]),
+                'maxEvents' : self.maxEvents if self.maxEvents < float('inf') else None,
+                'intLumi' : self.intLumi,
+                'metaInfo' : metaInfo,
+                }
+        return info
+
+
+    def analyzeChannel(self, channel):
+        '''
+        Loop over the rows of one channel's ntuple, doing the cuts and saving
+        (or booking for cleaning) the rows that pass.
+        '''
+        self.startChannel(channel)
+
+        # If rows are only booked for cleaning, we never need the whole row.
+        # Otherwise, passing rows are read in full when they're saved
+        onlyNeeded = self.cleanAfter or self.selectiveRead
+        if onlyNeeded:
+            enableOnlyBranches(self.ntuples[channel], self.cuts.branchesNeeded)
+            self.partialRows = True
+
+        iRow = -1 # in case of empty ntuple
+        # Loop through and do the cuts
+        for iRow, row in enumerate(self.timedRead(self.ntuples[channel])):
+            # If we've hit maxEvents, we're done
+            if iRow == self.maxEvents:
+                print "%s: Reached %d %s rows, ending"%(self.sample, self.maxEvents, channel)
+                break
+
+            # Report progress every 5000 rows
+            if iRow % 5000 == 0:
+                print "%s: Processing %s row %d"%(self.sample, channel, iRow)
+
+            self.processRow(row, channel, iRow)
+        else:
+            print "%s: Done with %s (%d rows)"%(self.sample, channel, iRow+1)
+
+        if onlyNeeded:
+            self.ntuples[channel].SetBranchStatus('*', 1)
+            self.partialRows = False
+
+
+    def startChannel(self, channel):
+        '''
+        Get ready to do the cuts on the rows of a new channel.
+        '''
+        self.setProfiledChannel(channel)
+
+        self.objectTemplate = mapObjects(channel)
+        self.needReorder = self.cuts.needReorder(channel)
+        self.rowCuts = self.cuts.getCutPlan(self.objectTemplate).rowCuts
+
+        if self.cleanAfter:
+            self.rowCleaner.setChannel(channel)
+            self.cutsPassed[channel]["SelectBest"] = 0
+
+
+    def processRow(self, row, channel, iRow):
+        '''
+        Do all the cuts on one row, then save it (or book it for cleaning) if
+        it passes. startChannel(channel) must be called first.
+        '''
+        if self.cleanRows and not self.cleanAfter:
+            # Always pass "TotalRows" because it's always a new row
+            self.passCut(row, channel, "TotalRows")
+            # Ignore wrong version of event (if we're cleaning now)
+            if self.rowCleaner.isRedundant(row, channel, iRow):
+                return
+
+        if self.passesCuts(row, channel):
+            self.keepRow(row, channel, iRow)
+
+
+    def passesCuts(self, row, channel):
+        '''
+        Do all the cuts on one row, updating the cut flow, and return True if
+        it passes all of them.
+        '''
+        rowCuts = self.rowCuts
+        if self.needReorder:
+            objects = self.cuts.orderLeptons(row, channel, self.objectTemplate)
+            rowCuts = self.cuts.getCutPlan(objects).rowCuts
+
+        for cut in self.cutOrder:
+            self.preCut(row, channel, cut)
+            if rowCuts[cut](row):
+                self.passCut(row, channel, cut)
+            else:
+                return False
+
+        return True
+
+
+    def keepRow(self, row, channel, iRow):
+        '''
+        Save a row that passed all cuts, or book it for cleaning if we're
+        cleaning after the cuts.
+        '''
+        if self.cleanAfter: # Don't save yet, still might get cleaned
+            self.rowCleaner.bookRow(row, iRow)
+        else:
+            if self.partialRows and self.results.needsRow(channel):
+                readFullEntry(self.ntuples[channel], iRow)
+            self.results.saveRow(row, channel, iRow)
+
+
+    def analyzeChannelColumnar(self, channel):
+        '''
+        Same as analyzeChannel, but reads the branches the cuts need
+        self.chunkSize rows at a time and does each cut on all of them at 
+        once. Rows that pass every cut are then loaded one at a time to be
+        booked for cleaning or saved, in the same order as analyzeChannel.
+        '''
+        from ZZAnalyzer.utils.columnar import ColumnReader
+
+        self.startChannel(channel)
+
+        ntuple = self.ntuples[channel]
+
+        reader = ColumnReader(self.inFileName, '/'.join([channel, self.ntupleDir]))
+        nRows = int(min(reader.GetEntries(), self.maxEvents))
+        branches = reader.branchesMatching(self.cuts.branchesNeeded)
+        getEntry = self.timedGetEntry(ntuple)
+
+        for block in self.timedRead(reader.blocks(branches, self.chunkSize, 0, nRows)):
+            print "%s: Processing %s rows %d-%d"%(self.sample, channel, block.entries[0], block.entries[-1])
+
+            for iRow in self.passingEntries(block, channel):
+                getEntry(iRow)
+                self.keepRow(ntuple, channel, iRow)
+
+        print "%s: Done with %s (%d rows)"%(self.sample, channel, nRows)
+
+        reader.close()
+
+
+    def passingEntries(self, block, channel):
+        '''
+        Do all the cuts on every row of a ColumnBlock, updating the cut flow.
+        Returns the entry numbers of the rows that pass everything.
+        startChannel(channel) must be called first.
+        '''
+        if self.cleanRows and not self.cleanAfter:
+            # Always pass "TotalRows" because it's always a new row
+            self.cutsPassed[channel]["TotalRows"] += len(block)
+            # Ignore wrong version of event (if we're cleaning now)
+            block = block.take(np.in1d(block.entries,
+                                       self.rowCleaner.bestRowIndices(channel)))
+
+        return self.cutBlock(block, channel)
+
+
+    def cutBlock(self, block, channel):
+        '''
+        Do all the cuts on every row of a ColumnBlock, updating the cut flow.
+        Returns the entry numbers of the rows that pass everything.
+        '''
+        if self.needReorder:
+            orders = self.cuts.orderLeptonsArray(block, channel, self.objectTemplate)
+        else:
+            orders = [(None, self.objectTemplate)]
+
+        for cut in self.cutOrder:
+            if not len(block):
+                break
+
+            passed = self.cuts.cutMaskArray(block, cut, orders)
+            self.cutsPassed[channel][cut] += int(np.count_nonzero(passed))
+
+            # Only keep going with rows that are still alive
+            block = block.take(passed)
+            orders = [(mask if mask is None else mask[passed], objects) for mask, objects in orders]
+
+        return block.entries
+
+
+    def analyzeChannelParallel(self, channel, pool):
+        '''
+        Same as analyzeChannel, but split the rows into chunks that start at
+        the beginning of an event, and do the cuts on the chunks in worker
+        processes from pool. The cut flows from the chunks are added up, and 
+        the rows that pass are saved (or booked for cleaning) here, in order.
+        '''
+        from ZZAnalyzer.utils.columnar import ColumnReader, eventBoundaries
+
+        self.startChannel(channel)
+
+        ntuple = self.ntuples[channel]
+        nRows = int(min(ntuple.GetEntries(), self.maxEvents))
+
+        best = None
+        if self.cleanRows and not self.cleanAfter:
+            # Always pass "TotalRows" because it's always a new row
+            self.cutsPassed[channel]["TotalRows"] += nRows
+            # Workers only look at the best version of each event
+            best = self.rowCleaner.bestRowIndices(channel)
+
+        reader = ColumnReader(self.inFileName, '/'.join([channel, self.ntupleDir]))
+        # a few chunks per worker, so one slow chunk doesn't hold everything up
+        bounds = eventBoundaries(reader, 0, nRows, 4 * self.nWorkers)
+        reader.close()
+
+        jobs = []
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            if best is None:
+                chunkBest = None
+            else:
+                chunkBest = best[np.searchsorted(best, start):np.searchsorted(best, stop)]
+            jobs.append((self.cutSet[0], self.cutSet[1:], self.inFileName,
+                         self.ntupleDir, channel, start, stop, chunkBest,
+                         self.columnar, self.chunkSize))
+
+        print "%s: Processing %d %s rows in %d chunks with %d processes"%(self.sample, nRows, channel, len(jobs), self.nWorkers)
+
+        getEntry = self.timedGetEntry(ntuple)
+
+        # map() keeps the chunks in order
+        for counts, entries in pool.map(_cutChunk, jobs):
+            for cut in self.cutOrder:
+                self.cutsPassed[channel][cut] += counts[cut]
+            for iRow in entries:
+                getEntry(iRow)
+                self.keepRow(ntuple, channel, iRow)
+
+        print "%s: Done with %s (%d rows)"%(self.sample, channel, nRows)
+
+
+    def cutChunk(self, channel, start, stop, entries=None):
+        '''
+        Do the cuts on rows [start, stop) of channel (or only the rows in 
+        the sorted array entries, if it isn't None), without saving or 
+        cleaning anything. Returns a list of the rows that pass all cuts.
+        '''
+        self.setupCleaner()
+        self.startChannel(channel)
+
+        passing = []
+
+        if self.columnar:
+            from ZZAnalyzer.utils.columnar import ColumnReader
+
+            reader = ColumnReader(self.inFileName, '/'.join([channel, self.ntupleDir]))
+            branches = reader.branchesMatching(self.cuts.branchesNeeded)
+            for block in reader.blocks(branches, self.chunkSize, start, stop):
+                if entries is not None:
+                    block = block.take(np.in1d(block.entries, entries))
+                passing.extend(int(i) for i in self.cutBlock(block, channel))
+            reader.close()
+            return passing
+
+        ntuple = self.ntuples[channel]
+        # we never save anything, so we only need what the cuts use
+        enableOnlyBranches(ntuple, self.cuts.branchesNeeded)
+
+        if entries is None:
+            entries = xrange(start, stop)
+        for iRow in entries:
+            ntuple.GetEntry(int(iRow))
+            if self.passesCuts(ntuple, channel):
+                passing.append(int(iRow))
+
+        return passing
+
 
     def passCut(self, row, channel, cut):
         '''
@@ -353,6 +799,22 @@ if __name__ == "__main__":
                         help=("path to the ntuple in the root file, "
                               "relative to the channel. So the "
                               "ntuple will be channel/<this variable>"))
+    parser.add_argument("--columnar", action='store_true',
+                        help="Do cuts on whole chunks of rows at once with NumPy instead of looping over rows.")
+    parser.add_argument("--chunkSize", type=int, default=100000,
+                        help="Number of rows per chunk in columnar mode.")
+    parser.add_argument("--nWorkers", type=int, default=1,
+                        help="Number of processes to split each channel's rows between.")
+    parser.add_argument("--selectiveRead", action='store_true',
+                        help="Only read the branches the cuts need, except for rows that get saved.")
+    parser.add_argument("--profile", action='store_true',
+                        help="Time each cut and each stage of the analysis, save the times as JSON.")
+    parser.add_argument("--exportFormat", type=str, default='', choices=['', 'parquet', 'arrow'],
+                        help="Also save the passing rows of each channel as a Parquet or Arrow file.")
+    parser.add_argument("--exportBranches", type=str, nargs='*',
+                        help="Regular expressions for the branches to put in the Parquet/Arrow output (default all).")
+    parser.add_argument("--rowGroupSize", type=int, default=100000,
+                        help="Rows per row group in the Parquet/Arrow output.")
     args = parser.parse_args()
 
     if args.modifiers:
@@ -362,7 +824,13 @@ if __name__ == "__main__":
 
     a = Analyzer(args.channel, args.cutset, args.infile, args.outfile,
                    args.nEvents, 1000, args.cleanRows,
-                   cutModifiers=mods, ntupleDir=args.ntupleDir)
+                   cutModifiers=mods, ntupleDir=args.ntupleDir,
+                   columnar=args.columnar, chunkSize=args.chunkSize,
+                   nWorkers=args.nWorkers, profile=args.profile,
+                   selectiveRead=args.selectiveRead,
+                   exportFormat=args.exportFormat,
+                   exportBranches=args.exportBranches,
+                   rowGroupSize=args.rowGroupSize)
 
     print "TESTING Analyzer"
     a.analyze()
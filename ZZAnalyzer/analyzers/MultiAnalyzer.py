@@ -0,0 +1,210 @@
+'''
+
+Run several selections on the same input file with one read of each ntuple.
+
+Each selection gets its own Analyzer (so its own cuts, cut flow, row
+cleaner and output file) but they all share the input file and its ntuples,
+and MultiAnalyzer does the loops over rows itself, handing each row (or
+chunk of rows, in columnar mode) to every Analyzer in turn. Because each
+Analyzer sees the same rows in the same order as it would running alone,
+the outputs are the same as running the selections separately.
+
+Author: Nate Woods, U. Wisconsin
+
+'''
+
+import os
+
+from rootpy.io import root_open
+from rootpy.io.file import DoesNotExist
+
+from ZZAnalyzer.utils.helpers import parseChannels
+from Analyzer import Analyzer, enableOnlyBranches
+
+assert os.environ["zza"], "Run setup.sh before running analysis"
+
+
+class MultiAnalyzer(object):
+    def __init__(self, channels, inFile, selections, maxEvents=float("inf"),
+                 intLumi=10000, ntupleDir='ntuple', columnar=False,
+                 chunkSize=100000, profile=False, selectiveRead=False,
+                 exportFormat='', exportBranches=None, rowGroupSize=100000):
+        '''
+        channels:    same as for Analyzer
+        inFile:      string of an input file name, with path
+        selections:  list of dicts with the parameters for each Analyzer:
+                         'baseCuts' (required), 'outFile' (required),
+                         'cutModifiers' and 'cleanRows'
+        maxEvents, intLumi, ntupleDir, columnar, chunkSize, profile,
+        selectiveRead, exportFormat, exportBranches, rowGroupSize: same
+                         as for Analyzer, and the same for all selections.
+                         Reading rows is shared, so it isn't included in
+                         the selections' profiles.
+        '''
+        self.sample = inFile.split('/')[-1].replace('.root','')
+        self.inFileName = inFile
+        self.inFile = root_open(inFile)
+
+        self.maxEvents = maxEvents
+        self.ntupleDir = ntupleDir
+        self.chunkSize = chunkSize
+        self.selectiveRead = selectiveRead
+
+        self.channels = parseChannels(channels)
+        self.ntuples = {}
+        for channel in self.channels[:]:
+            try:
+                nt = self.inFile.Get('/'.join([channel,ntupleDir]))
+                nt.create_buffer()
+                self.ntuples[channel] = nt
+            except DoesNotExist:
+                print "Ntuple for channel %s is empty or not found! Skipping."%channel
+                self.channels.remove(channel)
+
+        self.analyzers = []
+        for sel in selections:
+            self.analyzers.append(Analyzer(self.channels, sel['baseCuts'], inFile,
+                                           sel['outFile'], maxEvents, intLumi,
+                                           sel.get('cleanRows', ''),
+                                           cutModifiers=sel.get('cutModifiers', []),
+                                           ntupleDir=ntupleDir, columnar=columnar,
+                                           chunkSize=chunkSize,
+                                           sharedInput=(self.inFile, self.ntuples),
+                                           profile=profile,
+                                           selectiveRead=selectiveRead,
+                                           exportFormat=exportFormat,
+                                           exportBranches=exportBranches,
+                                           rowGroupSize=rowGroupSize))
+
+        # Everyone has to agree to do columns, otherwise we loop over rows
+        self.columnar = all(a.columnar for a in self.analyzers)
+
+
+    def analyze(self):
+        '''
+        Do all the selections, reading each ntuple at most twice (once to
+        find redundant rows for selections that clean first, once to do the
+        cuts), plus the best rows for selections that clean last, no matter
+        how many selections there are.
+        '''
+        for a in self.analyzers:
+            a.setupCleaner()
+
+        cleanFirst = [a for a in self.analyzers if a.rowCleaner is not None and not a.cleanAfter]
+        if cleanFirst:
+            for channel in self.channels:
+                for a in cleanFirst:
+                    a.startCleaning(channel)
+                if self.selectiveRead:
+                    enableOnlyBranches(self.ntuples[channel],
+                                       [p for a in cleanFirst for p in a.cuts.branchesNeeded])
+                for iRow, row in self.rows(channel):
+                    if (iRow % 5000) == 0:
+                        print "%s: Finding redundant rows for %s row %d"%(self.sample, channel, iRow)
+                    for a in cleanFirst:
+                        a.rowCleaner.bookRow(row, iRow)
+                if self.selectiveRead:
+                    self.ntuples[channel].SetBranchStatus('*', 1)
+                for a in cleanFirst:
+                    a.rowCleaner.finalize()
+
+        for channel in self.channels:
+            if self.columnar:
+                self.analyzeChannelColumnar(channel)
+            else:
+                self.analyzeChannel(channel)
+
+        cleanLast = [a for a in self.analyzers if a.cleanAfter]
+        if cleanLast:
+            for a in cleanLast:
+                a.rowCleaner.finalize()
+            for channel in self.channels:
+                self.saveBest(channel, cleanLast)
+
+        for a in self.analyzers:
+            a.finish()
+
+        self.inFile.close()
+
+
+    def rows(self, channel):
+        '''
+        Generator of (index, row) for the first self.maxEvents rows of channel.
+        '''
+        for iRow, row in enumerate(self.ntuples[channel]):
+            if iRow == self.maxEvents:
+                break
+            yield iRow, row
+
+
+    def saveBest(self, channel, analyzers):
+        '''
+        Save the best rows in channel for analyzers that clean last, reading
+        each row that any of them wants once.
+        '''
+        ntuple = self.ntuples[channel]
+        best = [set(a.rowCleaner.bestRowIndices(channel).tolist()) for a in analyzers]
+        for iRow in sorted(set().union(*best)):
+            ntuple.GetEntry(iRow)
+            for a, entries in zip(analyzers, best):
+                if iRow in entries:
+                    a.saveBestRow(ntuple, channel)
+
+
+    def analyzeChannel(self, channel):
+        for a in self.analyzers:
+            a.startChannel(channel)
+
+        # Rows are only saved directly by selections that don't clean last,
+        # so if they all clean last we only need the branches they cut on.
+        # Otherwise, those selections read rows in full before saving them
+        onlyNeeded = self.selectiveRead or all(a.cleanAfter for a in self.analyzers)
+        if onlyNeeded:
+            enableOnlyBranches(self.ntuples[channel],
+                               [p for a in self.analyzers for p in a.cuts.branchesNeeded])
+            for a in self.analyzers:
+                a.partialRows = True
+
+        iRow = -1 # in case of empty ntuple
+        for iRow, row in self.rows(channel):
+            if iRow % 5000 == 0:
+                print "%s: Processing %s row %d"%(self.sample, channel, iRow)
+
+            for a in self.analyzers:
+                a.processRow(row, channel, iRow)
+
+        print "%s: Done with %s (%d rows)"%(self.sample, channel, iRow+1)
+
+        if onlyNeeded:
+            self.ntuples[channel].SetBranchStatus('*', 1)
+            for a in self.analyzers:
+                a.partialRows = False
+
+
+    def analyzeChannelColumnar(self, channel):
+        from ZZAnalyzer.utils.columnar import ColumnReader
+
+        for a in self.analyzers:
+            a.startChannel(channel)
+
+        ntuple = self.ntuples[channel]
+
+        reader = ColumnReader(self.inFileName, '/'.join([channel, self.ntupleDir]))
+        nRows = int(min(reader.GetEntries(), self.maxEvents))
+        branches = reader.branchesMatching([p for a in self.analyzers for p in a.cuts.branchesNeeded])
+
+        for block in reader.blocks(branches, self.chunkSize, 0, nRows):
+            print "%s: Processing %s rows %d-%d"%(self.sample, channel, block.entries[0], block.entries[-1])
+
+            passing = [set(a.passingEntries(block, channel)) for a in self.analyzers]
+
+            # load each passing row once, give it to everyone who wants it
+            for iRow in sorted(set().union(*passing)):
+                ntuple.GetEntry(iRow)
+                for a, entries in zip(self.analyzers, passing):
+                    if iRow in entries:
+                        a.keepRow(ntuple, channel, iRow)
+
+        print "%s: Done with %s (%d rows)"%(self.sample, channel, nRows)
+
+        reader.close()
@@ -7,6 +7,14 @@ The list of interesting events should be in the format
 run:lumi:event
 
 leading spaces, "<" and ">" are stripped out for use on diff output
+(ZZAnalyzer/utils/scripts/syncDiff.py --eventFile writes it directly)
+
+In targeted mode, only the rows of the interesting events are read. They're
+found with an event index (see ZZAnalyzer.utils.eventIndex, which keeps the
+index in a sidecar file next to the ntuple), and loaded one at a time with
+GetEntry. As well as the usual summary, every row of every interesting event
+is listed with the first cut it failed and what the row cleaner thought of
+it. The cut flow and output only include those rows.
 
 Nate Woods, U. Wisconsin
 
@@ -15,15 +23,22 @@ Nate Woods, U. Wisconsin
 
 from Analyzer import Analyzer
 from ZZAnalyzer.utils.helpers import evVar
+from ZZAnalyzer.utils.eventIndex import EventIndex, loadIndex
 
 
 class SyncAnalyzer(Analyzer):
     def __init__(self, channels, cutSet, infile, outfile='./results/output_cutflow.root',
                  maxEvents=float("inf"), eventFile='failedEvents.txt',
-                 intLumi=10000, cleanRows=True, cutModifiers=[]):
+                 intLumi=10000, cleanRows=True, cutModifiers=[],
+                 ntupleDir='ntuple', targeted=False):
         super(SyncAnalyzer, self).__init__(channels, cutSet, infile, outfile,
                                            maxEvents, intLumi,
-                                           cleanRows, cutModifiers)
+                                           cleanRows, cutModifiers,
+                                           ntupleDir=ntupleDir)
+
+        self.targeted = targeted
+        # in targeted mode, (event, channel, entry, result) for every row looked at
+        self.rowResults = []
 
         # save last attempted cut of each event of interest (or 999 if it passed), keyed to tuple(run,lumi,evt)
         self.interesting = {}
@@ -47,6 +62,8 @@ class SyncAnalyzer(Analyzer):
         '''
         Regular preCut function, but updates the interesting event info for relevant events.
         '''
+        self.rowLastTried = cut
+
         if cut == self.cutOrder[0]:
             self.currentRowInfo = (evVar(row, 'run'), evVar(row, 'lumi'), evVar(row, 'evt'))
             if self.currentRowInfo in self.interesting and self.interesting[self.currentRowInfo] == -999:
@@ -65,6 +82,8 @@ class SyncAnalyzer(Analyzer):
         '''
         Regular passCut function, but if this is an interesting event and the last cut, say it passed.
         '''
+        self.rowLastPassed = cut
+
         if cut == 'SelectBest':
             # Have to get ID again because best cand selection is run separately afterwards
             rowID = (evVar(row, 'run'), evVar(row, 'lumi'), evVar(row, 'evt'))
@@ -75,12 +94,89 @@ class SyncAnalyzer(Analyzer):
         super(SyncAnalyzer, self).passCut(row, channel, cut)
 
 
+    def analyze(self):
+        if self.targeted:
+            self.analyzeTargeted()
+        else:
+            super(SyncAnalyzer, self).analyze()
+
+
+    def analyzeTargeted(self):
+        '''
+        Same as analyze(), but only for the rows of the interesting events.
+        '''
+        self.setupCleaner()
+
+        wanted = EventIndex.fromEvents(self.interesting.keys())
+        entries = {}
+        for channel in self.channels:
+            index = loadIndex(self.inFileName, channel, self.ntupleDir)
+            found = index.entriesOf(wanted)
+            entries[channel] = found[found < self.maxEvents].tolist()
+            print "%s: %d rows of interesting events in %s"%(self.sample, len(entries[channel]), channel)
+
+        if self.rowCleaner is not None and not self.cleanAfter:
+            # every row of an event is here, so the cleaner picks the same ones as usual
+            for channel in self.channels:
+                self.startCleaning(channel)
+                ntuple = self.ntuples[channel]
+                for iRow in entries[channel]:
+                    ntuple.GetEntry(iRow)
+                    self.rowCleaner.bookRow(ntuple, iRow)
+            self.rowCleaner.finalize()
+
+        for channel in self.channels:
+            self.startChannel(channel)
+            ntuple = self.ntuples[channel]
+            for iRow in entries[channel]:
+                ntuple.GetEntry(iRow)
+                self.rowLastTried = None
+                self.rowLastPassed = None
+                self.processRow(ntuple, channel, iRow)
+
+                event = (evVar(ntuple, 'run'), evVar(ntuple, 'lumi'), evVar(ntuple, 'evt'))
+                if self.rowLastTried is None:
+                    result = 'not best row'
+                elif self.rowLastPassed == self.cutOrder[-1]:
+                    result = 'PASS'
+                else:
+                    result = 'failed ' + self.rowLastTried
+                self.rowResults.append((event, channel, iRow, result))
+
+        if self.cleanAfter:
+            self.rowCleaner.finalize()
+            for channel in self.channels:
+                self.saveBest(channel)
+
+        self.finish()
+
+
+    def cleanerResult(self, channel, iRow, result):
+        '''
+        What the row cleaner did with a row (in targeted mode).
+        '''
+        if self.rowCleaner is None:
+            return 'no cleaning'
+        if self.cleanAfter and result != 'PASS':
+            return 'not considered'
+        if self.rowCleaner.isBestCand(None, channel, iRow):
+            return 'best row'
+        return 'not best row'
+
+
     def cutReport(self):
         '''
         Regular cutReport, but also prints (to stdout) the interesting event info.
         '''
         super(SyncAnalyzer, self).cutReport()
 
+        if self.targeted:
+            print "Rows of interesting events:"
+            for event, channel, iRow, result in sorted(self.rowResults):
+                print "%d:%d:%d :: %s row %d :: %s :: cleaning: %s"%(event[0], event[1], event[2],
+                                                                    channel, iRow, result,
+                                                                    self.cleanerResult(channel, iRow, result))
+
         print "Interesting events:"
 
         for evt in sorted(self.interesting.keys()):
@@ -116,6 +212,8 @@ if __name__ == "__main__":
                         help="Name of module to clean extra rows from each event. Without this option, no cleaning is performed.")
     parser.add_argument("--modifiers", nargs='*', type=str,
                         help="Other cut sets that modify the base cuts.")
+    parser.add_argument("--targeted", action='store_true',
+                        help="Only read the rows of the interesting events, using an event index.")
     args = parser.parse_args()
 
     if args.modifiers:
@@ -125,7 +223,8 @@ if __name__ == "__main__":
 
     a = SyncAnalyzer(args.channel, args.cutset, args.infile, args.outfile,
                      args.nEvents, args.eventList, 1000,
-                     args.cleanRows, cutModifiers=mods,)
+                     args.cleanRows, cutModifiers=mods,
+                     targeted=args.targeted)
 
     print "TESTING SyncAnalyzer"
     a.analyze()
@@ -1,3 +1,5 @@
 from Analyzer import Analyzer
+from MultiAnalyzer import MultiAnalyzer
 from SyncAnalyzer import SyncAnalyzer
 from AnalysisManager import AnalysisManager
+from AnalysisScheduler import AnalysisScheduler
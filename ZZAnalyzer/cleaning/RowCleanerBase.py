@@ -2,73 +2,135 @@
 
 Base class for utilities to clean redundant rows out of ntuples.
 
-Analyzer passes in rows and corresponding indices with bookRow(row, iRow). 
-Row Cleaner keeps track of what event it saw last, and the best row for that
-event. When it sees a new row for that same event, it picks which is better. 
-Each time it sees a new event, it places the index of the best row from
-the previous event into a set of good rows. This means that all rows for an 
-event must be booked consecutively! The analyzer can then query the Row Cleaner
-to see if a row is in the set with isRedundant(iRow) or isBestCand(iRow).
+Analyzer passes in rows and corresponding indices with bookRow(row, iRow).
+For each row, Row Cleaner stores the event (run, lumi, evt), the channel, the
+index and the variables used to compare rows in compact arrays. When
+finalize() is called, it picks the best row of every event, looking across
+all channels, as a grouped arg-min over the stored arrays. The analyzer can
+then query the Row Cleaner to see if a row is the best one with
+isRedundant(row, channel, iRow) or isBestCand(row, channel, iRow), or get all
+the best rows in a channel with bestRowIndices(channel).
+
+The best row is the same one the old one-row-at-a-time algorithm would pick:
+the rows of an event are compared in the order they were booked, and the
+winner of each comparison is compared to the next row with betterRow(new,
+old). Events where that can't be done as a simple sort (because of NaNs, or
+because betterRow doesn't define an ordering) are done exactly that way.
 
 Daughter classes must define:
-    - isNewBest(row, newEvent) to determine if this row is better than the last
-      and, if so, to store necessary information about it. newEvent is a boolean
-      that, if True, means this is definitely the new best (presumably because
-      it's the first row from the new event)
-    - Enough data about the previous best row to know
+    - rankVars, a list of the names of the variables used to compare rows
+    - rowVars(row, objects) to calculate them (in the same order) for a row
+    - betterRow(a, b) to pick which of two rows is better, where a and b have
+      the variables in rankVars as attributes and a is the newer row
+    - rankKeys(v) to give, from a dict of arrays of the variables in rankVars,
+      a list of arrays to sort on (most important first, smallest is best),
+      that pick the same row as betterRow, or None if that's not possible
     - self.cleanAtEnd, which should be True if cleaning is to be performed
       after all other cuts, and False if it should be done before.
+Daughter classes may also define:
+    - laterWinsTies, True if betterRow(new, old) picks the new row when
+      they're equally good
+    - needsFold(v, group) if some events can't be done with rankKeys
 
 
 Author: Nate Woods, U. Wisconsin
 
 '''
 
+from array import array
+from collections import namedtuple
+
+import numpy as np
+
 from ZZAnalyzer.utils.helpers import mapObjects
+from ZZAnalyzer.utils.eventIndex import EventIndex
 
 
 class RowCleanerBase(object):
     '''
     Virtual class with methods that will always be needed for a row cleaner.
     '''
+    rankVars = [] # daughter class should override
+    laterWinsTies = False
+
     def __init__(self, cutter, initChannel='eeee'):
         '''
-        Set up most data needed by all cleaners (basic previous event info, 
+        Set up most data needed by all cleaners (storage for booked rows,
         channels, etc.).
         '''
         self.cleanAtEnd = True # Daughter class should overwrite!
-        
-        self.bestRows = {}
 
         self.cuts = cutter
 
         self.cuts.enableBranches(self.branchesToEnable())
-        
+
+        self.channelIndices = {}
+        self.run = array('l')
+        self.lumi = array('l')
+        self.evt = array('l')
+        self.chan = array('b')
+        self.idx = array('l')
+        self.vars = [array('d') for v in self.rankVars]
+
+        self.best = {}
+
+        self.RowInfo = namedtuple('RowInfo', ['channel', 'idx'] + list(self.rankVars))
+
         self.setChannel(initChannel)
 
-        self.prevRun = -1
-        self.prevLumi = -1
-        self.prevEvt = -1
-        self.prevInfo = None
-        
-        
+
     def setChannel(self, channel):
         '''
-        Set the cutter's channel for future rows. 
+        Set the cutter's channel for future rows.
         '''
         self.channel = channel
+        self.iChannel = self.channelIndices.setdefault(channel, len(self.channelIndices))
         self.objectTemplate = mapObjects(channel)
         self.needReorder = self.cuts.needReorder(self.channel)
-                       
-                       
+
+
     def betterRow(self, a, b):
         '''
         Virtual.
 
-        Given two RowInfos a and b, returns the better one.
+        Given two RowInfos a (newer) and b (older), returns the better one.
         '''
         return a # daughter class should override
-                       
+
+
+    def rowVars(self, row, objects):
+        '''
+        Virtual.
+
+        Values of the variables in self.rankVars for this row, in order.
+        '''
+        return () # daughter class should override
+
+
+    def rankKeys(self, v):
+        '''
+        Virtual.
+
+        Given a dict of arrays of the variables in self.rankVars, a list of
+        arrays such that the best row of an event always has the smallest
+        values (compared in order), or None if betterRow can't be done that
+        way. Ties are broken by booking order, according to laterWinsTies.
+        '''
+        return None
+
+
+    def needsFold(self, v, group):
+        '''
+        Boolean array, True for rows in events that must be done with
+        betterRow one row at a time instead of with rankKeys. v is a dict of
+        arrays of the variables in self.rankVars, and group is an array of
+        which event each row belongs to. By default, any event with a NaN.
+        '''
+        out = np.zeros(len(group), dtype=bool)
+        for arr in v.itervalues():
+            out |= np.isnan(arr)
+        return out
+
 
     def cleanAfter(self):
         '''
@@ -78,54 +140,103 @@ class RowCleanerBase(object):
         return self.cleanAtEnd
 
 
-    def finalize(self):
-        '''
-        Save the correct row for the last event, so we don't forget it.
-        '''
-        self.bestRows[(self.prevRun, self.prevLumi, self.prevEvt)] = self.prevInfo
-        
-
     def branchesToEnable(self):
         return ['run','lumi','evt']
 
 
     def bookRow(self, row, idx):
         '''
-        If this row is from the same event as the previous, check 
-        which is better and hang onto its info. If it's from a different event,
-        enshrine the best row of the previous event, then check to make sure we
-        didn't have the new event previously in another channel. If we 
-        did, compare this new row with the info from the other channel. If we 
-        didn't, hang onto this info so we can compare it to the next row.
+        Store this row's event, index and comparison variables for later.
+        All rows must be booked in the order they should be compared, which
+        is the order they appear in the ntuples.
         '''
-        run = row.run
-        lumi = row.lumi
-        evt = row.evt
-        newEvent = (evt != self.prevEvt or lumi != self.prevLumi or run != self.prevRun)
-
         if self.needReorder:
             objects = self.cuts.orderLeptons(row, self.channel, self.objectTemplate)
         else:
             objects = self.objectTemplate
 
-        info = self.__class__.RowInfo(row, self.channel, idx, objects, self.cuts)
+        self.run.append(int(row.run))
+        self.lumi.append(int(row.lumi))
+        self.evt.append(int(row.evt))
+        self.chan.append(self.iChannel)
+        self.idx.append(idx)
+        for store, val in zip(self.vars, self.rowVars(row, objects)):
+            store.append(val)
 
-        if newEvent:
-            self.bestRows[(self.prevRun, self.prevLumi, self.prevEvt)] = self.prevInfo
-            
-            self.prevRun = run
-            self.prevLumi = lumi
-            self.prevEvt = evt
 
-            if (run, lumi, evt) in self.bestRows:
-                # this event existed in another channel
-                self.prevInfo = self.bestRows[(run, lumi, evt)]
-                newEvent = False
-            else:
-                self.prevInfo = info
-                
-        if not newEvent:
-            self.prevInfo = self.betterRow(info, self.prevInfo)
+    def _asArray(self, store, dtype):
+        if not len(store):
+            return np.zeros(0, dtype=dtype)
+        return np.frombuffer(store, dtype=dtype)
+
+
+    def finalize(self):
+        '''
+        Find the best row of every event.
+        '''
+        events = EventIndex.fromArrays(self._asArray(self.run, np.int_),
+                                       self._asArray(self.lumi, np.int_),
+                                       self._asArray(self.evt, np.int_))
+        nRows = len(events)
+
+        # group rows by event, keeping the booking order within each event
+        byEvent, starts = events.eventGroups()
+        newEvent = np.zeros(nRows, dtype=bool)
+        newEvent[starts] = True
+        group = np.empty(nRows, dtype=np.int_)
+        group[byEvent] = np.cumsum(newEvent) - 1
+
+        v = {name : self._asArray(store, np.float64)
+             for name, store in zip(self.rankVars, self.vars)}
+
+        keys = self.rankKeys(v)
+        if keys is None:
+            fold = np.ones(nRows, dtype=bool)
+        else:
+            fold = self.needsFold(v, group)
+        foldGroup = np.zeros(len(starts), dtype=bool)
+        if nRows:
+            foldGroup = np.logical_or.reduceat(fold[byEvent], starts)
+
+        winners = []
+
+        if keys is not None and not foldGroup.all():
+            order = np.arange(nRows)
+            if self.laterWinsTies:
+                order = -order
+            # best row of each event comes first
+            ranked = np.lexsort([order] + keys[::-1] + [group])
+            first = np.ones(nRows, dtype=bool)
+            first[1:] = group[ranked][1:] != group[ranked][:-1]
+            ranked = ranked[first]
+            winners.append(ranked[~foldGroup[group[ranked]]])
+
+        if foldGroup.any():
+            ends = np.append(starts[1:], nRows)
+            folded = []
+            for iGroup in np.nonzero(foldGroup)[0]:
+                rows = byEvent[starts[iGroup]:ends[iGroup]]
+                best = self._info(rows[0], v)
+                for i in rows[1:]:
+                    best = self.betterRow(self._info(i, v), best)
+                folded.append(best.idx)
+            winners.append(np.array(folded, dtype=np.int_))
+
+        winners = np.concatenate(winners) if winners else np.zeros(0, dtype=np.int_)
+
+        chan = self._asArray(self.chan, np.int8)[winners]
+        idx = self._asArray(self.idx, np.int_)[winners]
+        self.best = {}
+        for channel, iChannel in self.channelIndices.iteritems():
+            self.best[channel] = np.sort(idx[chan == iChannel]).astype(np.int64)
+
+
+    def _info(self, i, v):
+        '''
+        RowInfo for booked row i, for betterRow. Its idx is i (not the row's
+        index in the ntuple), so the winner can be found in the arrays.
+        '''
+        return self.RowInfo(self.chan[i], i, *[v[name][i] for name in self.rankVars])
 
 
     def isRedundant(self, row, channel, idx):
@@ -140,34 +251,17 @@ class RowCleanerBase(object):
         '''
         Return True if the row with this index is the best version of its event
         '''
-        info = self.bestRows.get((row.run, row.lumi, row.evt), None)
-        if info is None:
+        best = self.best.get(channel, None)
+        if best is None:
             return False
-        
-        ch = info.channel
-        ind = info.idx
-        return (ind == idx and ch == channel)
+        i = np.searchsorted(best, idx)
+        return i < len(best) and best[i] == idx
 
 
-    class RowInfo(object):
+    def bestRowIndices(self, channel):
         '''
-        Base class for a simple container for variables needed to compare rows.
-        Row cleaner classes should define an inheriting RowInfo class that 
-        knows the right variables and how to calculate them.
+        Sorted array of the indices of all rows in channel that are the best
+        version of their event, i.e. every idx for which isBestCand would be
+        True. Only makes sense after finalize().
         '''
-        def __init__(self, row, channel, idx, objects, cuts):
-            '''
-            Objects should already be sorted
-            '''
-            self.channel = channel
-            self.idx = idx
-            self.storeVars(row, objects, cuts)
-
-        def storeVars(self, row, objects, cuts):
-            '''
-            Virtual.
-            Inheriting classes should calculate needed variables here.
-            '''
-            self.one = 1 # don't do this
-
-
+        return self.best.get(channel, np.zeros(0, dtype=np.int64))
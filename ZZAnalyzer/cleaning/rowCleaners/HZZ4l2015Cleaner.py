@@ -11,6 +11,8 @@ from ZZAnalyzer.utils.helpers import objVar, zCompatibility
 
 
 class HZZ4l2015Cleaner(RowCleanerBase):
+    rankVars = ['dZ', 'ptSum']
+
     def __init__(self, cutter, initChannel='eeee'): # super(self.__class__, ... safe if nothing inherits from this
         super(self.__class__, self).__init__(cutter, initChannel)
         self.cleanAtEnd = True # do cleaning last
@@ -32,16 +34,19 @@ class HZZ4l2015Cleaner(RowCleanerBase):
             return a
         return b
 
-    
-    class RowInfo(RowCleanerBase.RowInfo):
-        def __init__(self, row, channel, idx, objects, cuts):
-            super(self.__class__, self).__init__(row, channel, idx, objects, cuts)
-
-        def storeVars(self, row, objects, cuts):
-            '''
-            Need Z1 distance from nominal mass and scalar sum of pt of Z2 
-            leptons.
-            '''
-            self.dZ = zCompatibility(row, objects[0], objects[1], cuts.fsrVar)
-            self.ptSum = objVar(row, 'Pt', objects[2]) + objVar(row, 'Pt', objects[3])
+
+    def rankKeys(self, v):
+        '''
+        Smallest dZ, then largest ptSum. The first row wins ties.
+        '''
+        return [v['dZ'], -v['ptSum']]
+
+
+    def rowVars(self, row, objects):
+        '''
+        Need Z1 distance from nominal mass and scalar sum of pt of Z2 
+        leptons.
+        '''
+        return (zCompatibility(row, objects[0], objects[1], self.cuts.fsrVar),
+                objVar(row, 'Pt', objects[2]) + objVar(row, 'Pt', objects[3]))
 
@@ -10,11 +10,15 @@ Author: Nate Woods, U. Wisconsin.
 
 '''
 
+import numpy as np
+
 from ZZAnalyzer.cleaning import RowCleanerBase
 from ZZAnalyzer.utils.helpers import evVar, objVar, zCompatibility
 
 
 class HZZ4l2016Cleaner(RowCleanerBase):
+    rankVars = ['dbk', 'dZ', 'm4l']
+
     def __init__(self, cutter, initChannel='eeee'): # super(self.__class__, ... safe if nothing inherits from this
         super(self.__class__, self).__init__(cutter, initChannel)
         self.cleanAtEnd = True # do cleaning last
@@ -42,16 +46,37 @@ class HZZ4l2016Cleaner(RowCleanerBase):
 
         return b
 
+
+    def rankKeys(self, v):
+        '''
+        If no two rows in an event have the same m4l, it's just the largest
+        D_bkg^kin, with the first row winning ties. Otherwise, which row 
+        wins depends on the order they're compared in (see needsFold).
+        '''
+        return [-v['dbk']]
+
+
+    def needsFold(self, v, group):
+        '''
+        Events with NaNs or with two rows with the same m4l have to be done
+        one row at a time.
+        '''
+        out = super(HZZ4l2016Cleaner, self).needsFold(v, group)
+
+        byMass = np.lexsort((v['m4l'], group))
+        sameMass = np.zeros(len(group), dtype=bool)
+        sameMass[1:] = ((group[byMass][1:] == group[byMass][:-1]) &
+                        (v['m4l'][byMass][1:] == v['m4l'][byMass][:-1]))
+        out[byMass[sameMass]] = True
+
+        return out
+
     
-    class RowInfo(RowCleanerBase.RowInfo):
-        def __init__(self, row, channel, idx, objects, cuts):
-            super(self.__class__, self).__init__(row, channel, idx, objects, cuts)
-
-        def storeVars(self, row, objects, cuts):
-            '''
-            Need d_bkg^kin and Z1 distance from nominal mass.
-            '''
-            self.dbk = row.D_bkg_kin #row.D_sel_kin
-            self.dZ = zCompatibility(row, objects[0], objects[1], cuts.fsrVar)
-            self.m4l = evVar(row, 'Mass'+cuts.fsrVar)
+    def rowVars(self, row, objects):
+        '''
+        Need d_bkg^kin, Z1 distance from nominal mass, and m4l.
+        '''
+        return (row.D_bkg_kin, #row.D_sel_kin
+                zCompatibility(row, objects[0], objects[1], self.cuts.fsrVar),
+                evVar(row, 'Mass'+self.cuts.fsrVar))
 
@@ -11,6 +11,9 @@ from ZZAnalyzer.utils.helpers import zMassDist
 
 
 class SingleZCleaner(RowCleanerBase):
+    rankVars = ['dZ']
+    laterWinsTies = True
+
     def __init__(self, cutter, initChannel='ee'): 
         # super(self.__class__, ... safe if nothing inherits from this
         super(self.__class__, self).__init__(cutter, initChannel)
@@ -31,15 +34,16 @@ class SingleZCleaner(RowCleanerBase):
             return a
         return b
 
-    
-    class RowInfo(RowCleanerBase.RowInfo):
-        def __init__(self, row, channel, idx, objects, cuts):
-            super(self.__class__, self).__init__(row, channel, idx, objects, cuts)
 
-        def storeVars(self, row, objects, cuts):
-            '''
-            Need Z1 distance from nominal mass.
-            '''
-            self.dZ = zMassDist(getattr(row, 'Mass'+cuts.fsrVar))
+    def rankKeys(self, v):
+        '''
+        Smallest dZ. The last row wins ties.
+        '''
+        return [v['dZ']]
 
 
+    def rowVars(self, row, objects):
+        '''
+        Need Z1 distance from nominal mass.
+        '''
+        return (zMassDist(getattr(row, 'Mass'+self.cuts.fsrVar)),)
@@ -13,6 +13,9 @@ from ZZAnalyzer.utils.helpers import zCompatibility
 
 
 class ZPlusXCleaner(RowCleanerBase):
+    rankVars = ['dZ']
+    laterWinsTies = True
+
     def __init__(self, cutter, initChannel='eee'): 
         # super(self.__class__, ... safe if nothing inherits from this
         super(self.__class__, self).__init__(cutter, initChannel)
@@ -34,15 +37,16 @@ class ZPlusXCleaner(RowCleanerBase):
             return a
         return b
 
-    
-    class RowInfo(RowCleanerBase.RowInfo):
-        def __init__(self, row, channel, idx, objects, cuts):
-            super(self.__class__, self).__init__(row, channel, idx, objects, cuts)
 
-        def storeVars(self, row, objects, cuts):
-            '''
-            Need Z1 distance from nominal mass.
-            '''
-            self.dZ = zCompatibility(row, objects[0], objects[1], cuts.fsrVar)
+    def rankKeys(self, v):
+        '''
+        Smallest dZ. The last row wins ties.
+        '''
+        return [v['dZ']]
 
 
+    def rowVars(self, row, objects):
+        '''
+        Need Z1 distance from nominal mass.
+        '''
+        return (zCompatibility(row, objects[0], objects[1], self.cuts.fsrVar),)
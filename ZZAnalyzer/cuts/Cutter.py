@@ -86,6 +86,10 @@ Once a set of cuts is entered, the user shouldn't need to know anything.
     just loop through the result of Cutter.setupCutFlow()
     and do Cutter.analysisCut(row, cut, *allObjects) for all cuts. The
     results of these are booleans for whether the cut was passed or not.
+    analysisCut uses a compiled version of the whole cut flow for each
+    ordering of the objects (see ZZAnalyzer.cuts.cutPlan), made the first
+    time that ordering is used; get it with Cutter.getCutPlan(objects) to
+    skip the lookup when doing many cuts on the same objects.
 
 A few simple, common cuts are provided by default. 'true' always returns
     True, 'SameFlavor' returns whether the objects are the same type
@@ -93,6 +97,18 @@ A few simple, common cuts are provided by default. 'true' always returns
     'IsElectron' and 'IsMuon' tell you if the
     object is an electron or a muon, respectively.
 
+Every cut can also be done on many rows at once, for the columnar mode of
+    the analyzer. Use Cutter.analysisCutArray(block, cut, *allObjects), where
+    block is a ZZAnalyzer.utils.columnar.ColumnBlock, to get a boolean array
+    with the result for every row. Cuts built from the template get this for
+    free. Cuts with logic 'other' should also have a vectorized version in
+    the dictionary returned by setupOtherArrayCuts(self), in the same
+    format as setupOtherCuts but taking a block instead of a row; if there
+    isn't one, the row function is called on each row of the block.
+    Similarly, daughter classes that override orderLeptons() should override
+    orderLeptonsArray() (and classes that replace orderLeptons on the
+    instance should replace orderLeptonsArray too).
+
 
 Author: Nate Woods, U. Wisconsin
 
@@ -102,7 +118,12 @@ import itertools
 from collections import OrderedDict
 from re import compile as _compile
 
+import numpy as np
+
 from ZZAnalyzer.utils.helpers import *
+from ZZAnalyzer.utils.columnar import allArrays, anyArrays, asMask, \
+    rowByRow, groupRowsBy
+from ZZAnalyzer.cuts.cutPlan import CutPlan
 
 
 class Cutter(object):
@@ -112,6 +133,8 @@ class Cutter(object):
     derives from this base class and calls super() from the first three
     methods here, to ensure an appropriate MRO.
     '''
+    profiler = None # see profileCuts()
+
     def setupCutFlow(self):
         '''
         This OrderedDict should be filled with cuts by daughter classes,
@@ -134,6 +157,16 @@ class Cutter(object):
             "Cutter class %s does not derive from Cutter!"%super(Cutter,self).__class__.__name__
         return {}
 
+    def setupOtherArrayCuts(self):
+        '''
+        This dict should be filled with vectorized versions of the functions
+        in setupOtherCuts(), in the format otherArrayCuts[cut] =
+        f(block, *objects), returning a boolean array.
+        '''
+        assert not hasattr(super(Cutter, self), 'setupOtherArrayCuts'),\
+            "Cutter class %s does not derive from Cutter!"%super(Cutter,self).__class__.__name__
+        return {}
+
     def getCutTemplate(self, *args):
         '''
         This dict should be filled with cuts in the format specified in the
@@ -156,13 +189,19 @@ class Cutter(object):
 
         self.cuts = self.setupCuts(self.cutSet)
 
+        self.arrayCuts = self.setupArrayCuts(self.cutSet)
+
         # Add a few always-useful cuts
-        if 'true' not in self.cuts:
-            self.cuts['true'] = lambda *args: True
-        self.cuts['SameFlavor'] = lambda row, obj1, obj2: obj1[0]==obj2[0]
-        self.cuts['DifferentFlavor'] = lambda row, obj1, obj2: obj1[0]!=obj2[0]
-        self.cuts['IsElectron'] = lambda row, obj: obj[0]=='e'
-        self.cuts['IsMuon'] = lambda row, obj: obj[0]=='m'
+        for cuts in self.cuts, self.arrayCuts:
+            if 'true' not in cuts:
+                cuts['true'] = lambda *args: True
+            cuts['SameFlavor'] = lambda row, obj1, obj2: obj1[0]==obj2[0]
+            cuts['DifferentFlavor'] = lambda row, obj1, obj2: obj1[0]!=obj2[0]
+            cuts['IsElectron'] = lambda row, obj: obj[0]=='e'
+            cuts['IsMuon'] = lambda row, obj: obj[0]=='m'
+
+        # compiled versions of the cut flow, one per ordering of objects
+        self.cutPlans = {}
 
 
     def getCutList(self):
@@ -177,7 +216,48 @@ class Cutter(object):
         Takes cut name and all leptons, uses self.cutFlow to figure out
         which cut and objects to use, returns the result
         '''
-        return self.cuts[self.cutFlow[cut][0]](row, *[objects[i-1] for i in self.cutFlow[cut][1]])
+        return self.getCutPlan(objects).rowCuts[cut](row)
+
+
+    def analysisCutArray(self, block, cut, *objects):
+        '''
+        As analysisCut, but for every row in a ColumnBlock at once. Returns a
+        boolean array.
+        '''
+        return self.getCutPlan(objects).arrayCut(block, cut)
+
+
+    def getCutPlan(self, objects):
+        '''
+        The whole cut flow compiled for this ordering of objects (see
+        ZZAnalyzer.cuts.cutPlan). Plans are made the first time they're
+        needed and kept.
+        '''
+        objects = tuple(objects)
+        try:
+            return self.cutPlans[objects]
+        except KeyError:
+            plan = CutPlan(self, objects)
+            if self.profiler is not None:
+                plan.timeCuts(self.profiler)
+            self.cutPlans[objects] = plan
+            return plan
+
+
+    def profileCuts(self, profiler):
+        '''
+        Record the time taken by every cut in the cut flow, and by every
+        special (logic 'other') cut they use, in profiler (a 
+        ZZAnalyzer.utils.profiling.Profiler). Nothing is timed unless this
+        is called.
+        '''
+        self.profiler = profiler
+        for cuts in self.cuts, self.arrayCuts:
+            for name in self.otherCuts:
+                if name in cuts:
+                    cuts[name] = profiler.timeSpecialCut(cuts[name], name)
+        # old plans have the untimed functions
+        self.cutPlans = {}
 
 
     def doCut(self, row, cut, *objects):
@@ -195,6 +275,20 @@ class Cutter(object):
         return not self.cuts[cut](row, *objects)
 
 
+    def doCutArray(self, block, cut, *objects):
+        '''
+        doCut for a whole ColumnBlock.
+        '''
+        return self.arrayCuts[cut](block, *objects)
+
+
+    def negateCutArray(self, block, cut, *objects):
+        '''
+        negateCut for a whole ColumnBlock.
+        '''
+        return np.logical_not(self.arrayCuts[cut](block, *objects))
+
+
     def setupCuts(self, *args):
         '''
         Gets a dictionary of cut parameters from a template file or
@@ -230,10 +324,38 @@ class Cutter(object):
         return cuts
 
 
-    def getCutFunction(self, cutDict):
+    def setupArrayCuts(self, *args):
         '''
-        Return a function that does one or more object cuts.
-        cutDict is template[cut] or at least in the same format
+        As setupCuts, but the functions take a ColumnBlock instead of a row
+        and return a boolean array. Cuts with mode 'other' use the function
+        from self.setupOtherArrayCuts() if there is one, and are done row by
+        row otherwise.
+        '''
+        temp = self.getCutTemplate(*args)
+        otherArrayCuts = self.setupOtherArrayCuts()
+        cuts = {}
+
+        for cut, params in temp.iteritems():
+            if 'logic' not in params:
+                params['logic'] = 'and'
+
+            if params['logic'] == 'other':
+                if cut in otherArrayCuts:
+                    cuts[cut] = otherArrayCuts[cut]
+                else:
+                    cuts[cut] = rowByRow(self.otherCuts[cut])
+                continue
+
+            cuts[cut] = self.getCutFunction(params, True)
+
+        return cuts
+
+
+    def parseCutObjects(self, cutDict):
+        '''
+        Work out how a cut (template[cut] or something in the same format)
+        treats its objects. Returns (objLogic, requireAll, pairwise,
+        ignoreObjects, nObjects).
         '''
         objLogic = 'obj' in cutDict['logic']
         requireAll = 'and' in cutDict['logic']
@@ -260,16 +382,35 @@ class Cutter(object):
         if objLogic and not pairwise:
             nObjects = 1
 
+        return objLogic, requireAll, pairwise, ignoreObjects, nObjects
+
+
+    def getCutFunction(self, cutDict, arrays=False):
+        '''
+        Return a function that does one or more object cuts.
+        cutDict is template[cut] or at least in the same format
+        If arrays is True, the function works on a ColumnBlock instead of a
+        row.
+        '''
+        objLogic, requireAll, pairwise, ignoreObjects, nObjects = self.parseCutObjects(cutDict)
+
         # it will be faster to make a list of functions now and loop over it with a generator expression later
-        cutFuns = [self.getCutLegFunction(leg, legParams, nObjects, ignoreObjects) for leg, legParams in cutDict['cuts'].iteritems()]
+        cutFuns = [self.getCutLegFunction(leg, legParams, nObjects, ignoreObjects, arrays) for leg, legParams in cutDict['cuts'].iteritems()]
+        # elementwise versions for arrays
+        if arrays:
+            allFun = allArrays
+            anyFun = anyArrays
+        else:
+            allFun = all
+            anyFun = any
         # the any function or the all fuction, depending on what we need
-        logicFun = all if requireAll else any
+        logicFun = allFun if requireAll else anyFun
 
         if objLogic:
             if pairwise:
-                return lambda row, *obj: logicFun(all(cut(row, *sorted(ob)) for cut in cutFuns) for ob in itertools.combinations(obj,2))
+                return lambda row, *obj: logicFun(allFun(cut(row, *sorted(ob)) for cut in cutFuns) for ob in itertools.combinations(obj,2))
             else:
-                return lambda row, *obj: logicFun(all(cut(row, ob) for cut in cutFuns) for ob in obj)
+                return lambda row, *obj: logicFun(allFun(cut(row, ob) for cut in cutFuns) for ob in obj)
         else:
             if nObjects == 0:
                 if len(cutFuns) == 1:
@@ -285,7 +426,8 @@ class Cutter(object):
                 return lambda row, *obj: logicFun(cut(row, *obj) for cut in cutFuns)
 
 
-    def getCutLegFunction(self, cutName, cutParams, nObjects, ignoreObjects=False):
+    def getCutLegFunction(self, cutName, cutParams, nObjects, ignoreObjects=False,
+                          arrays=False):
         '''
         Get the function to do a single leg of a single cut. If cutName is the
         name of a variable, the function will cut on that, and will look for
@@ -298,16 +440,18 @@ class Cutter(object):
         (those are the only options). If the cut parameter is
         a string, the name doesn't matter and the paramter indicates which
         other cut to call.
+        If arrays is True, the function works on a ColumnBlock instead of a
+        row (and the branches have already been enabled by the row version).
         '''
 
         if isinstance(cutParams, str):
             # If we just want to do the cut, use doCut(row, cut).
             # If we want to negate the cut, use negateCut(row, cut)
             if cutParams[0] == '!':
-                cutDoer = self.negateCut
+                cutDoer = self.negateCutArray if arrays else self.negateCut
                 cutParams = cutParams[1:]
             else:
-                cutDoer = self.doCut
+                cutDoer = self.doCutArray if arrays else self.doCut
             if ignoreObjects:
                 return lambda row, *obj: cutDoer(row, cutParams)
             elif nObjects == 0:
@@ -322,20 +466,41 @@ class Cutter(object):
                 return lambda row, *obj: cutDoer(row, cutParams, *obj)
 
         # Otherwise, create the cut
+        threshold, wantLessThan = self.parseCutParams(cutName, cutParams)
+
+        if not arrays:
+            toEnable = cutName.split('#')[0]
+            if nObjects and not ignoreObjects:
+                if nObjects == 1:
+                    toEnable = '[em][1-4]?' + toEnable
+                else:
+                    toEnable = '[em][1-3]?_[em][1-4]?_' + toEnable
+            self.enableBranches(toEnable)
+
+        thisCut = cutName.split("#")[0]
+
+        if ignoreObjects:
+            return lambda row, *obj: self.cutEvVar(row, thisCut, threshold, wantLessThan)
+        elif nObjects == 0:
+            return lambda row: self.cutEvVar(row, thisCut, threshold, wantLessThan)
+        elif nObjects == 1:
+            return lambda row, obj: self.cutObjVar(row, thisCut, threshold, wantLessThan, obj)
+        else:
+            return lambda row, *obj: self.cutNObjVar(row, thisCut, threshold, wantLessThan, *obj)
+
+
+    def parseCutParams(self, cutName, cutParams):
+        '''
+        Get (threshold, wantLessThan) from the parameters of one leg of a cut,
+        in the form (threshold, wantLessThan), where wantLessThan may be a
+        bool or one of the strings listed in getCutLegFunction.
+        '''
         try:
             assert len(cutParams) == 2, "Parameters for cut %s must be of the form (threshold, wantLessThan)."%cutName
         except TypeError:
             print "Parameters for cut %s must be an iterable of the form (threshold, wantLessThan)."%cutName
             raise
 
-        toEnable = cutName.split('#')[0]
-        if nObjects and not ignoreObjects:
-            if nObjects == 1:
-                toEnable = '[em][1-4]?' + toEnable
-            else:
-                toEnable = '[em][1-3]?_[em][1-4]?_' + toEnable
-        self.enableBranches(toEnable)
-
         if isinstance(cutParams[1], bool):
             wantLessThan = cutParams[1]
         else:
@@ -351,16 +516,7 @@ class Cutter(object):
                 print "Note that it's always >=, whether your string indicates that or not."
                 raise ValueError
 
-        thisCut = cutName.split("#")[0]
-
-        if ignoreObjects:
-            return lambda row, *obj: self.cutEvVar(row, thisCut, cutParams[0], wantLessThan)
-        elif nObjects == 0:
-            return lambda row: self.cutEvVar(row, thisCut, cutParams[0], wantLessThan)
-        elif nObjects == 1:
-            return lambda row, obj: self.cutObjVar(row, thisCut, cutParams[0], wantLessThan, obj)
-        else:
-            return lambda row, *obj: self.cutNObjVar(row, thisCut, cutParams[0], wantLessThan, *obj)
+        return cutParams[0], wantLessThan
 
 
     def enableBranches(self, branches):
@@ -438,4 +594,41 @@ class Cutter(object):
         return objects
 
 
+    def orderLeptonsArray(self, block, channel, objects):
+        '''
+        Columnar version of orderLeptons. Returns a list of (mask, ordering)
+        pairs, where mask is a boolean array selecting the rows of the 
+        ColumnBlock whose objects should be put in that order. A mask of None
+        means all rows.
+        If a daughter class overrides orderLeptons but not this, orderLeptons
+        is called on each row.
+        '''
+        if type(self).orderLeptons.im_func is not Cutter.orderLeptons.im_func:
+            return groupRowsBy(block, lambda row: self.orderLeptons(row, channel, objects))
+
+        dM = [np.where(nObjVar(block, 'SS', objects[i], objects[i+1]),
+                       1000, zCompatibility(block, objects[i], objects[i+1], self.fsrVar))
+              for i in [0, 2]]
+
+        swap = dM[0] > dM[1]
+        return [(np.logical_not(swap), objects), (swap, objects[2:] + objects[:2])]
+
+
+    def cutMaskArray(self, block, cut, orders):
+        '''
+        Result of analysisCutArray for cut on every row of block, where orders
+        is what orderLeptonsArray returned for this block (a list of (mask,
+        objects) pairs).
+        '''
+        if len(orders) == 1 and orders[0][0] is None:
+            return self.analysisCutArray(block, cut, *orders[0][1])
+
+        result = np.zeros(len(block), dtype=bool)
+        for mask, objects in orders:
+            if not mask.any():
+                continue
+            result[mask] = self.analysisCutArray(block, cut, *objects)[mask]
+        return result
+
+
 
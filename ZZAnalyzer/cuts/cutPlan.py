@@ -0,0 +1,396 @@
+'''
+
+Compile the cuts in a Cutter's cut flow into flat expressions for one
+    particular ordering of objects.
+
+Cutter.getCutFunction() turns the template into nested closures, which
+    work out object names, pairs of objects, 'TYPE' substitutions and calls
+    to other cuts every time a cut is done. A CutPlan does all of that once
+    for a list of objects (e.g. ['e1','e2','m1','m2']) and writes each cut
+    in the cut flow as a single expression on concrete branch names, e.g.
+    ZMassTight on objects 1 and 2 becomes
+
+>>> (not row.e1_e2_Mass < c0) and (row.e1_e2_Mass < c1)
+
+    which is compiled into a function of a row. The same expression tree is
+    also compiled into a function of a ColumnBlock (see
+    ZZAnalyzer.utils.columnar), for the columnar mode of the analyzer.
+    Constant parts of a cut (e.g. 'IsElectron' on a known muon) are
+    resolved when the plan is made, and repeated conditions are only
+    checked once.
+
+Cuts with logic 'other', and cuts that aren't in the template, are called
+    through the Cutter's cuts and arrayCuts dictionaries, so they do exactly
+    what they would if called with Cutter.doCut().
+
+Comparisons give the same answer as Cutter.cutEvVar() and friends for
+    every value, including NaN: a cut that passes if var >= threshold is
+    written as not (var < threshold).
+
+Author: Nate Woods, U. Wisconsin
+
+'''
+
+import itertools
+from collections import OrderedDict
+from keyword import iskeyword
+from re import compile as _compile
+
+import numpy as np
+
+from ZZAnalyzer.utils.columnar import allArrays, anyArrays, asMask
+
+
+_identifier = _compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+def _attr(var, name):
+    '''
+    Source code to get attribute name from variable var.
+    '''
+    if _identifier.match(name) and not iskeyword(name):
+        return '%s.%s'%(var, name)
+    return 'getattr(%s, %r)'%(var, name)
+
+
+
+class _Namespace(dict):
+    '''
+    Names available to the compiled expressions: constants and the
+    functions for cuts that can't be flattened.
+    '''
+    def __init__(self, cutter):
+        super(_Namespace, self).__init__()
+        self.cutter = cutter
+        self._names = {}
+        self['_all'] = allArrays
+        self['_any'] = anyArrays
+        self['_lnot'] = np.logical_not
+
+
+    def _bind(self, prefix, key, value):
+        try:
+            return self._names[key]
+        except KeyError:
+            name = '%s%d'%(prefix, len(self._names))
+            self._names[key] = name
+            self[name] = value
+            return name
+
+
+    def constant(self, value):
+        return self._bind('c', ('const', type(value), value), value)
+
+
+    def rowCut(self, cutName):
+        cuts = self.cutter.cuts
+        if cutName in cuts:
+            fun = cuts[cutName]
+        else: # fail when (if) the cut is actually done, like doCut
+            fun = lambda row, *obj: self.cutter.cuts[cutName](row, *obj)
+        return self._bind('r', ('row', cutName), fun)
+
+
+    def arrayCut(self, cutName):
+        cuts = self.cutter.arrayCuts
+        if cutName in cuts:
+            fun = cuts[cutName]
+        else:
+            fun = lambda block, *obj: self.cutter.arrayCuts[cutName](block, *obj)
+        return self._bind('a', ('array', cutName), fun)
+
+
+
+class _Node(object):
+    '''
+    Base class for one piece of a compiled cut. Daughter classes must
+    provide key(), which must be the same for any two nodes that always
+    give the same result, and rowSource() and arraySource(), which return
+    Python source code for the node given a namespace and the name of the
+    row (or block) variable.
+    '''
+    def branches(self):
+        return set()
+
+
+class _Const(_Node):
+    def __init__(self, value):
+        self.value = bool(value)
+
+    def key(self):
+        return ('const', self.value)
+
+    def rowSource(self, ns, var):
+        return repr(self.value)
+
+    arraySource = rowSource
+
+
+class _Compare(_Node):
+    def __init__(self, branch, threshold, wantLessThan):
+        self.branch = branch
+        self.threshold = threshold
+        self.wantLessThan = wantLessThan
+
+    def key(self):
+        return ('compare', self.branch, self.threshold, self.wantLessThan)
+
+    def branches(self):
+        return set([self.branch])
+
+    def rowSource(self, ns, var):
+        comp = '%s < %s'%(_attr(var, self.branch), ns.constant(self.threshold))
+        if self.wantLessThan:
+            return '(%s)'%comp
+        return '(not %s)'%comp
+
+    def arraySource(self, ns, var):
+        comp = '%s < %s'%(_attr(var, self.branch), ns.constant(self.threshold))
+        if self.wantLessThan:
+            return '(%s)'%comp
+        return '_lnot(%s)'%comp
+
+
+class _Other(_Node):
+    def __init__(self, cutName, objects):
+        self.cutName = cutName
+        self.objects = tuple(objects)
+
+    def key(self):
+        return ('other', self.cutName, self.objects)
+
+    def _args(self, var):
+        return ', '.join([var] + [repr(o) for o in self.objects])
+
+    def rowSource(self, ns, var):
+        return '%s(%s)'%(ns.rowCut(self.cutName), self._args(var))
+
+    def arraySource(self, ns, var):
+        return '%s(%s)'%(ns.arrayCut(self.cutName), self._args(var))
+
+
+class _Not(_Node):
+    def __init__(self, child):
+        self.child = child
+
+    def key(self):
+        return ('not', self.child.key())
+
+    def branches(self):
+        return self.child.branches()
+
+    def rowSource(self, ns, var):
+        return '(not %s)'%self.child.rowSource(ns, var)
+
+    def arraySource(self, ns, var):
+        return '_lnot(%s)'%self.child.arraySource(ns, var)
+
+
+class _And(_Node):
+    rowJoin = ' and '
+    arrayFun = '_all'
+
+    def __init__(self, children):
+        self.children = children
+
+    def key(self):
+        return (self.arrayFun,) + tuple(c.key() for c in self.children)
+
+    def branches(self):
+        return set().union(*[c.branches() for c in self.children])
+
+    def rowSource(self, ns, var):
+        return '(%s)'%self.rowJoin.join(c.rowSource(ns, var) for c in self.children)
+
+    def arraySource(self, ns, var):
+        return '%s((%s,))'%(self.arrayFun, ', '.join(c.arraySource(ns, var) for c in self.children))
+
+
+class _Or(_And):
+    rowJoin = ' or '
+    arrayFun = '_any'
+
+
+
+def _combine(NodeType, children):
+    '''
+    Make an _And or _Or of children, merging nested nodes of the same type,
+    resolving constants, and dropping repeated conditions.
+    '''
+    identity = NodeType is _And # value that doesn't change the result
+
+    out = []
+    seen = set()
+    for child in children:
+        if type(child) is NodeType:
+            subs = child.children
+        else:
+            subs = [child]
+        for sub in subs:
+            if isinstance(sub, _Const):
+                if sub.value == identity:
+                    continue
+                return _Const(not identity)
+            key = sub.key()
+            if key in seen:
+                continue
+            seen.add(key)
+            out.append(sub)
+
+    if not out:
+        return _Const(identity)
+    if len(out) == 1:
+        return out[0]
+    return NodeType(out)
+
+
+def _negate(node):
+    if isinstance(node, _Const):
+        return _Const(not node.value)
+    if isinstance(node, _Compare):
+        return _Compare(node.branch, node.threshold, not node.wantLessThan)
+    if isinstance(node, _Not):
+        return node.child
+    return _Not(node)
+
+
+# Same as the always-useful cuts Cutter adds to its dictionaries
+_builtinCuts = {
+    'true' : lambda *obj: _Const(True),
+    'SameFlavor' : lambda obj1, obj2: _Const(obj1[0]==obj2[0]),
+    'DifferentFlavor' : lambda obj1, obj2: _Const(obj1[0]!=obj2[0]),
+    'IsElectron' : lambda obj: _Const(obj[0]=='e'),
+    'IsMuon' : lambda obj: _Const(obj[0]=='m'),
+    }
+
+
+
+class CutPlan(object):
+    '''
+    All the cuts in a Cutter's cut flow, compiled for one list of objects.
+    rowCuts[cut](row) and arrayCuts[cut](block) do a cut from the cut flow
+    on a row or a ColumnBlock, respectively.
+    '''
+    def __init__(self, cutter, objects):
+        self.cutter = cutter
+        self.objects = list(objects)
+        self.template = cutter.getCutTemplate(cutter.cutSet)
+
+        self._nodes = {}
+        self._ns = _Namespace(cutter)
+
+        self.nodes = OrderedDict()
+        self.rowCuts = OrderedDict()
+        self.arrayCuts = OrderedDict()
+        for cut, (cutName, objNums) in cutter.cutFlow.iteritems():
+            node = self.compileCut(cutName, *[self.objects[i-1] for i in objNums])
+            self.nodes[cut] = node
+            self.rowCuts[cut] = self._makeFunction(node.rowSource(self._ns, 'row'), 'row')
+            self.arrayCuts[cut] = self._makeFunction(node.arraySource(self._ns, 'block'), 'block')
+
+        self.branches = sorted(set().union(*[n.branches() for n in self.nodes.itervalues()]))
+
+
+    def _makeFunction(self, source, var):
+        return eval('lambda %s: %s'%(var, source), self._ns)
+
+
+    def rowSource(self, cut):
+        '''
+        Python source of the compiled row version of cut (for debugging).
+        '''
+        return self.nodes[cut].rowSource(self._ns, 'row')
+
+
+    def timeCuts(self, profiler):
+        '''
+        Record the time taken by each cut in profiler (a 
+        ZZAnalyzer.utils.profiling.Profiler).
+        '''
+        for cuts in self.rowCuts, self.arrayCuts:
+            for cut in cuts:
+                cuts[cut] = profiler.timeCut(cuts[cut], cut)
+
+
+    def arrayCut(self, block, cut):
+        '''
+        Result of cut for every row of block, as a boolean array.
+        '''
+        # NaN fails every comparison, as it should, so don't warn about it
+        with np.errstate(invalid='ignore'):
+            return asMask(self.arrayCuts[cut](block), len(block))
+
+
+    def compileCut(self, cutName, *objects):
+        '''
+        Expression tree for template cut cutName on objects.
+        '''
+        key = (cutName, objects)
+        try:
+            return self._nodes[key]
+        except KeyError:
+            pass
+
+        node = self._compileCut(cutName, objects)
+        self._nodes[key] = node
+        return node
+
+
+    def _compileCut(self, cutName, objects):
+        if cutName in _builtinCuts and (cutName != 'true' or cutName not in self.template):
+            return _builtinCuts[cutName](*objects)
+
+        params = self.template.get(cutName, None)
+        if params is None or params.setdefault('logic', 'and') == 'other':
+            return _Other(cutName, objects)
+
+        objLogic, requireAll, pairwise, ignoreObjects, nObjects = self.cutter.parseCutObjects(params)
+        combine = _And if requireAll else _Or
+        legs = params['cuts'].items()
+
+        if objLogic:
+            if pairwise:
+                groups = [sorted(ob) for ob in itertools.combinations(objects, 2)]
+            else:
+                groups = [[ob] for ob in objects]
+            return _combine(combine, [_combine(_And, [self._compileLeg(leg, legParams, nObjects, ignoreObjects, group)
+                                                      for leg, legParams in legs])
+                                      for group in groups])
+
+        # Same restrictions on the number of objects as the closures
+        if not ignoreObjects and ((nObjects == 0 and objects) or (nObjects == 1 and len(objects) != 1)):
+            raise TypeError("Cut %s takes %d object(s), but was given %d"%(cutName, nObjects, len(objects)))
+
+        return _combine(combine, [self._compileLeg(leg, legParams, nObjects, ignoreObjects, objects)
+                                  for leg, legParams in legs])
+
+
+    def _compileLeg(self, cutName, cutParams, nObjects, ignoreObjects, objects):
+        if isinstance(cutParams, str):
+            negate = cutParams[0] == '!'
+            if negate:
+                cutParams = cutParams[1:]
+
+            if ignoreObjects or nObjects == 0:
+                node = self.compileCut(cutParams)
+            elif nObjects == 1:
+                if len(cutParams) > 4 and cutParams[:4] == "TYPE":
+                    cutParams = objects[0][0] + cutParams.replace("TYPE","")
+                node = self.compileCut(cutParams, objects[0])
+            else:
+                node = self.compileCut(cutParams, *objects)
+
+            if negate:
+                return _negate(node)
+            return node
+
+        threshold, wantLessThan = self.cutter.parseCutParams(cutName, cutParams)
+
+        var = cutName.split("#")[0]
+        if ignoreObjects or nObjects == 0:
+            branch = var
+        elif nObjects == 1:
+            branch = objects[0] + var
+        else:
+            branch = '_'.join(list(objects)+[var])
+
+        return _Compare(branch, threshold, wantLessThan)
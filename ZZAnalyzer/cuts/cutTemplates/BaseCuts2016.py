@@ -7,6 +7,8 @@ Author: Nate Woods, U. Wisconsin
 
 '''
 
+import numpy as np
+
 from ZZAnalyzer.cuts import Cutter
 from ZZAnalyzer.utils.helpers import *
 
@@ -402,6 +404,18 @@ class BaseCuts2016(Cutter):
         return others
 
 
+    def setupOtherArrayCuts(self):
+        '''
+        Vectorized versions of the functions from setupOtherCuts
+        '''
+        temp = self.getCutTemplate()
+        others = super(BaseCuts2016, self).setupOtherArrayCuts()
+        others['eMVAID'] = lambda block, obj: self.eIDTight2012Array(temp['eMVAID'], block, obj)
+        others['SmartCut'] = lambda block, *obj: self.doSmartCutArray(block, *obj)
+
+        return others
+
+
     def eIDTight2012(self, params, row, obj):
         BDTName = params['cuts']['BDTName']
         pt = objVar(row, 'Pt', obj)
@@ -422,6 +436,29 @@ class BaseCuts2016(Cutter):
         return self.cutObjVar(row, BDTName, params['cuts'][ptStr+etaStr][0], params['cuts'][ptStr+etaStr][1], obj)
 
 
+    def eIDTight2012Array(self, params, block, obj):
+        '''
+        eIDTight2012 for a whole ColumnBlock.
+        '''
+        BDTName = params['cuts']['BDTName']
+        pt = objVar(block, 'Pt', obj)
+        absEta = abs(objVar(block, 'SCEta', obj))
+
+        lowPt = pt < params['cuts']['ptThr']
+        lowEta = absEta < params['cuts']['etaLow']
+        highEta = np.logical_and(np.logical_not(lowEta), absEta > params['cuts']['etaHigh'])
+        medEta = np.logical_not(np.logical_or(lowEta, highEta))
+
+        regions = []
+        results = []
+        for ptStr, ptMask in [('lowPt', lowPt), ('highPt', np.logical_not(lowPt))]:
+            for etaStr, etaMask in [('LowEta', lowEta), ('MedEta', medEta), ('HighEta', highEta)]:
+                regions.append(np.logical_and(ptMask, etaMask))
+                results.append(self.cutObjVar(block, BDTName, params['cuts'][ptStr+etaStr][0], params['cuts'][ptStr+etaStr][1], obj))
+
+        return np.select(regions, results, False)
+
+
     def doSmartCut(self, row, *obj):
         # Doesn't apply to eemm
         if obj[0][0] != obj[2][0]:
@@ -447,3 +484,29 @@ class BaseCuts2016(Cutter):
         return not (zACompatibility < z1Compatibility and zBMass < 12)
 
 
+    def doSmartCutArray(self, block, *obj):
+        '''
+        doSmartCut for a whole ColumnBlock.
+        '''
+        # Doesn't apply to eemm
+        if obj[0][0] != obj[2][0]:
+            return True
+
+        # l1 matches l4 if l1 and l3 are same-sign, otherwise l1 matches l3
+        l1MatchesL4 = nObjVar(block, 'SS', *sorted([obj[0], obj[2]])) != 0
+        altObjs = [[obj[0], obj[3], obj[1], obj[2]], [obj[0], obj[2], obj[1], obj[3]]]
+
+        altZMass = [np.where(l1MatchesL4,
+                             nObjVar(block, "Mass"+self.fsrVar, *sorted(altObjs[0][2*i:2*i+2])),
+                             nObjVar(block, "Mass"+self.fsrVar, *sorted(altObjs[1][2*i:2*i+2])))
+                    for i in range(2)]
+        altZCompatibility = [zMassDist(m) for m in altZMass]
+        z1Compatibility = zCompatibility(block, obj[0], obj[1], self.fsrVar)
+
+        zAFirst = altZCompatibility[0] < altZCompatibility[1]
+        zACompatibility = np.where(zAFirst, altZCompatibility[0], altZCompatibility[1])
+        zBMass = np.where(zAFirst, altZMass[1], altZMass[0])
+
+        return np.logical_not(np.logical_and(zACompatibility < z1Compatibility, zBMass < 12))
+
+
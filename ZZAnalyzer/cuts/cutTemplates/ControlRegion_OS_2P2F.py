@@ -14,6 +14,8 @@ from ZZAnalyzer.cuts.cutTemplates.ControlRegion_Base import ControlRegion_Base
 
 from collections import OrderedDict
 
+import numpy as np
+
 
 class ControlRegion_OS_2P2F(ControlRegion_Base):
     def __init__(self, cutset="ControlRegion_OS_2P2F"):
@@ -117,3 +119,13 @@ class ControlRegion_OS_2P2F(ControlRegion_Base):
             return alternateOrder
         return objects
 
+
+    def orderLeptonsArray(self, block, channel, objects):
+        '''
+        orderLeptons for a whole ColumnBlock.
+        '''
+        alternateOrder = objects[2:] + objects[:2]
+        swap = np.logical_and(self.analysisCutArray(block, 'Z1ID', *alternateOrder),
+                              self.analysisCutArray(block, 'Z1Iso', *alternateOrder))
+        return [(np.logical_not(swap), objects), (swap, alternateOrder)]
+
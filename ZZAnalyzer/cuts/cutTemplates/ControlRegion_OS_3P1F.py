@@ -14,6 +14,8 @@ from ZZAnalyzer.cuts.cutTemplates.ControlRegion_Base import ControlRegion_Base
 
 from collections import OrderedDict
 
+import numpy as np
+
 
 class ControlRegion_OS_3P1F(ControlRegion_Base):
     def __init__(self, cutset="ControlRegion_OS_3P1F"):
@@ -153,3 +155,12 @@ class ControlRegion_OS_3P1F(ControlRegion_Base):
         if self.analysisCut(row, 'PromptPlusFake', *alternateOrder):
             return alternateOrder
         return objects
+
+
+    def orderLeptonsArray(self, block, channel, objects):
+        '''
+        orderLeptons for a whole ColumnBlock.
+        '''
+        alternateOrder = objects[2:] + objects[:2]
+        swap = self.analysisCutArray(block, 'PromptPlusFake', *alternateOrder)
+        return [(np.logical_not(swap), objects), (swap, alternateOrder)]
@@ -10,10 +10,12 @@ Author: Nate Woods, U. Wisconsin
 '''
 
 from ZZAnalyzer.cuts.cutTemplates.ControlRegion_Base import ControlRegion_Base
-from ZZAnalyzer.utils.helpers import nObjVar, zCompatibility
+from ZZAnalyzer.utils.helpers import nObjVar, zCompatibility, zMassDist
 
 from collections import OrderedDict
 
+import numpy as np
+
 
 class ControlRegion_SS(ControlRegion_Base):
     def __init__(self, cutset="ControlRegion_SS"):
@@ -74,6 +76,15 @@ class ControlRegion_SS(ControlRegion_Base):
         return objects
 
 
+    def orderLeptonsArray(self, block, channel, objects):
+        '''
+        orderLeptons for a whole ColumnBlock.
+        '''
+        alternateOrder = objects[2:] + objects[:2]
+        swap = self.analysisCutArray(block, 'BadZ2', *alternateOrder)
+        return [(np.logical_not(swap), objects), (swap, alternateOrder)]
+
+
     def doSmartCut(self, row, *obj):
         # Doesn't apply to eemm
         if obj[0][0] != obj[2][0]:
@@ -104,3 +115,38 @@ class ControlRegion_SS(ControlRegion_Base):
                 zBMass.append(altZMass[i][0])
 
         return not any((zACompatibility[i] < z1Compatibility and zBMass[i] < 12) for i in range(2))
+
+
+    def doSmartCutArray(self, block, *obj):
+        '''
+        doSmartCut for a whole ColumnBlock.
+        '''
+        # Doesn't apply to eemm
+        if obj[0][0] != obj[2][0]:
+            return True
+
+        z1Compatibility = zCompatibility(block, obj[0], obj[1], self.fsrVar)
+
+        # Do it both ways the Z1 same-sign lepton could be assigned, pick 
+        # the right one for each row at the end
+        results = []
+        for ssInd in range(2):
+            altObj = [list(obj), list(obj)]
+            for i in range(2):
+                altObj[i][ssInd] = obj[i+2]
+                altObj[i][i+2] = obj[ssInd]
+
+            fails = False
+            for obs in altObj:
+                altZMass = [nObjVar(block, "Mass"+self.fsrVar, *sorted(obs[:2])), nObjVar(block, "Mass"+self.fsrVar, *sorted(obs[2:]))]
+                altZCompatibility = [zMassDist(m) for m in altZMass]
+
+                zAFirst = altZCompatibility[0] < altZCompatibility[1]
+                zACompatibility = np.where(zAFirst, altZCompatibility[0], altZCompatibility[1])
+                zBMass = np.where(zAFirst, altZMass[1], altZMass[0])
+
+                fails = np.logical_or(fails, np.logical_and(zACompatibility < z1Compatibility, zBMass < 12))
+
+            results.append(np.logical_not(fails))
+
+        return np.where(nObjVar(block, 'SS', obj[1], obj[2]) != 0, results[1], results[0])
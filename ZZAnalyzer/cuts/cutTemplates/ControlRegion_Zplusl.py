@@ -167,3 +167,10 @@ class ControlRegion_Zplusl(ControlRegion_Base):
         to swap the order.
         '''
         return objects[1:]+[objects[0]]
+
+
+    def orderLeptonsArray(self, block, channel, objects):
+        '''
+        Same for every row.
+        '''
+        return [(None, objects[1:]+[objects[0]])]
@@ -1,3 +1,5 @@
+import numpy as np
+
 from ZZAnalyzer.cuts import Cutter
 
 from ZZAnalyzer.utils.helpers import nObjVar, zMassDist, zCompatibility
@@ -59,6 +61,16 @@ class HZZ2016(Cutter):
         return others
 
 
+    def setupOtherArrayCuts(self):
+        '''
+        Vectorized versions of the functions from setupOtherCuts
+        '''
+        others = super(HZZ2016, self).setupOtherArrayCuts()
+        others['SmartCut'] = lambda block, *obj: self.doSmartCutArray(block, *obj)
+
+        return others
+
+
     def doSmartCut(self, row, *obj):
         # Doesn't apply to eemm
         if obj[0][0] != obj[2][0]:
@@ -82,3 +94,29 @@ class HZZ2016(Cutter):
             zBMass = altZMass[0]
 
         return not (zACompatibility < z1Compatibility and zBMass < 12)
+
+
+    def doSmartCutArray(self, block, *obj):
+        '''
+        doSmartCut for a whole ColumnBlock.
+        '''
+        # Doesn't apply to eemm
+        if obj[0][0] != obj[2][0]:
+            return True
+
+        # l1 matches l4 if l1 and l3 are same-sign, otherwise l1 matches l3
+        l1MatchesL4 = nObjVar(block, 'SS', *sorted([obj[0], obj[2]])) != 0
+        altObjs = [[obj[0], obj[3], obj[1], obj[2]], [obj[0], obj[2], obj[1], obj[3]]]
+
+        altZMass = [np.where(l1MatchesL4,
+                             nObjVar(block, "Mass"+self.fsrVar, *sorted(altObjs[0][2*i:2*i+2])),
+                             nObjVar(block, "Mass"+self.fsrVar, *sorted(altObjs[1][2*i:2*i+2])))
+                    for i in range(2)]
+        altZCompatibility = [zMassDist(m) for m in altZMass]
+        z1Compatibility = zCompatibility(block, obj[0], obj[1], self.fsrVar)
+
+        zAFirst = altZCompatibility[0] < altZCompatibility[1]
+        zACompatibility = np.where(zAFirst, altZCompatibility[0], altZCompatibility[1])
+        zBMass = np.where(zAFirst, altZMass[1], altZMass[0])
+
+        return np.logical_not(np.logical_and(zACompatibility < z1Compatibility, zBMass < 12))
@@ -9,10 +9,12 @@ Author: Nate Woods, U. Wisconsin
 '''
 
 from ZZAnalyzer.cuts import Cutter
-from ZZAnalyzer.utils.helpers import objVar
+from ZZAnalyzer.utils.helpers import objVar, nObjVar
 
 from collections import OrderedDict
 
+import numpy as np
+
 
 class ZPlusAnything(Cutter):
     def __init__(self, cutset="ZPlusAnything"):
@@ -48,10 +50,12 @@ class ZPlusAnything(Cutter):
         '''
         if channel == 'emm':
             self.orderLeptons = self.orderLeptonsEMM
+            self.orderLeptonsArray = self.orderLeptonsEMMArray
             return True
 
         if len(channel) == 4:
             self.orderLeptons = self.realZFirst
+            self.orderLeptonsArray = self.realZFirstArray
             return True
 
         return False
@@ -64,6 +68,13 @@ class ZPlusAnything(Cutter):
         return ['m1', 'm2', 'e']
 
 
+    def orderLeptonsEMMArray(self, block, channel, objects):
+        '''
+        Same for every row.
+        '''
+        return [(None, ['m1', 'm2', 'e'])]
+
+
     def realZFirst(self, row, channel, objects):
         '''
         For use with 4l final states only. If the second Z is made out of
@@ -87,3 +98,34 @@ class ZPlusAnything(Cutter):
             return super(ZPlusAnything, self).orderLeptons(row, channel, objects)
         return objects
 
+
+    def realZFirstArray(self, block, channel, objects):
+        '''
+        realZFirst for a whole ColumnBlock.
+        '''
+        def zIsBad(obj1, obj2):
+            bad = False
+            for obj in obj1, obj2:
+                bad = np.logical_or(bad, objVar(block, 'ZZTightID', obj) < 0.5)
+                bad = np.logical_or(bad, objVar(block, 'ZZIsoPass', obj) < 0.5)
+            return bad
+
+        keep = np.logical_or(zIsBad(objects[2], objects[3]),
+                             nObjVar(block, 'SS', objects[2], objects[3]) != 0)
+        swap = np.logical_and(np.logical_not(keep), zIsBad(objects[0], objects[1]))
+        bothGood = np.logical_not(np.logical_or(keep, swap))
+
+        out = [(keep, objects), (swap, objects[2:]+objects[:2])]
+
+        # if both are good, order however the base class would
+        if super(ZPlusAnything, self).needReorder(channel):
+            for mask, ordering in super(ZPlusAnything, self).orderLeptonsArray(block, channel, objects):
+                if mask is None:
+                    mask = bothGood
+                else:
+                    mask = np.logical_and(mask, bothGood)
+                out.append((mask, ordering))
+        else:
+            out.append((bothGood, objects))
+
+        return out
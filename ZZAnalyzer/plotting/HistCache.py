@@ -0,0 +1,249 @@
+'''
+
+On-disk cache of filled histograms for NtuplePlotter, so remaking a plot
+whose inputs haven't changed (e.g. after changing only its style) doesn't
+need another TTree::Draw().
+
+Each entry holds what one draw added to a histogram: the bin contents
+(including underflow and overflow), the sum of squared weights, the
+number of entries and the fit statistics. It's keyed by a hash of
+    - the path, size and modification time of every input file
+    - the path to the ntuple in the files
+    - the variable and selection (with weights) drawn
+    - the content hash of every compiled function they call (weight
+          histogram lookups, tag-and-probe and fake rate functions; see
+          WeightStringMaker.registerDrawFunctions())
+    - the histogram's type and bin edges
+and stored as cacheDir/<key>.npz. When the cache gets bigger than maxSize
+bytes, the least recently used entries are removed. Draws calling a
+function whose content isn't known (anything but those and ROOT's math
+functions) are never cached, since nothing would notice if it changed.
+
+To see how big a cache is, or empty it, do
+
+>>> python HistCache.py list [cacheDir]
+>>> python HistCache.py clear [cacheDir]
+
+Author: Nate Woods, U. Wisconsin
+
+'''
+
+import os
+import re
+import json
+import hashlib
+from array import array
+
+import numpy as np
+
+
+_defaultCacheDir = os.path.join(os.environ.get('zza', '.'), 'ZZAnalyzer', '.histCache')
+
+# bump to invalidate everything already cached
+_version = 2
+
+# TH1::kNstat
+_nStats = 13
+
+# functions TTree::Draw() knows itself
+drawBuiltins = set(['abs', 'fabs', 'sqrt', 'exp', 'log', 'log10', 'pow',
+                    'sin', 'cos', 'tan', 'asin', 'acos', 'atan', 'atan2',
+                    'sinh', 'cosh', 'tanh', 'min', 'max', 'floor', 'ceil',
+                    'int', 'float', 'double', 'bool', 'sq'])
+
+_callRegex = re.compile(r'([A-Za-z_][\w:$]*)\s*\(')
+
+
+def calledFunctions(expressions):
+    '''
+    Names of the functions called in expressions (TTree::Draw() strings),
+    except TTree::Draw()'s own (including TMath's and the Name$() ones).
+    '''
+    out = set()
+    for e in expressions:
+        for name in _callRegex.findall(str(e)):
+            if name in drawBuiltins or name.startswith('TMath::') or name.endswith('$'):
+                continue
+            out.add(name)
+    return out
+
+
+def _axisEdges(axis):
+    return [axis.GetBinLowEdge(i) for i in xrange(1, axis.GetNbins() + 2)]
+
+
+def histKey(files, treePath, variable, selection, hist, functions={}):
+    '''
+    Hash identifying what drawing variable with selection from treePath in
+    files into hist would give. functions is {name : content hash} for the
+    compiled functions they call.
+    '''
+    axes = [hist.GetXaxis(), hist.GetYaxis(), hist.GetZaxis()][:hist.GetDimension()]
+
+    keyInfo = {
+        'version' : _version,
+        'files' : [(os.path.abspath(f), os.path.getsize(f), os.path.getmtime(f)) for f in files],
+        'tree' : treePath,
+        'variable' : str(variable),
+        'selection' : str(selection),
+        'functions' : sorted(functions.items()),
+        'type' : hist.ClassName(),
+        'edges' : [_axisEdges(a) for a in axes],
+        }
+
+    return hashlib.sha1(json.dumps(keyInfo, sort_keys=True)).hexdigest()
+
+
+
+class HistCache(object):
+    def __init__(self, cacheDir=_defaultCacheDir, maxSize=1<<30):
+        self.cacheDir = cacheDir
+        self.maxSize = maxSize
+
+
+    def entryFile(self, key):
+        return os.path.join(self.cacheDir, key + '.npz')
+
+
+    def load(self, key, hist):
+        '''
+        If key is in the cache, fill hist (which should be empty) with it and
+        return True. Otherwise, return False.
+        '''
+        fileName = self.entryFile(key)
+        try:
+            with np.load(fileName) as f:
+                contents = f['contents']
+                sumw2 = f['sumw2']
+                stats = f['stats']
+                entries = float(f['entries'])
+        except (IOError, ValueError, KeyError):
+            return False
+
+        if len(contents) != hist.GetNcells():
+            return False
+
+        for i, c in enumerate(contents.tolist()):
+            hist.SetBinContent(i, c)
+        if len(sumw2):
+            hist.Sumw2()
+            histSumw2 = hist.GetSumw2()
+            for i, s in enumerate(sumw2.tolist()):
+                histSumw2.SetAt(s, i)
+        hist.PutStats(array('d', stats.tolist()))
+        hist.SetEntries(entries)
+
+        # mark as recently used
+        try:
+            os.utime(fileName, None)
+        except OSError:
+            pass
+
+        return True
+
+
+    def store(self, key, hist):
+        '''
+        Save the contents of hist under key, then make room if needed.
+        '''
+        if not os.path.isdir(self.cacheDir):
+            try:
+                os.makedirs(self.cacheDir)
+            except OSError: # someone else made it first
+                if not os.path.isdir(self.cacheDir):
+                    raise
+
+        nCells = hist.GetNcells()
+        contents = np.array([hist.GetBinContent(i) for i in xrange(nCells)])
+        histSumw2 = hist.GetSumw2()
+        sumw2 = np.array([histSumw2.At(i) for i in xrange(histSumw2.GetSize())])
+        stats = array('d', [0.] * _nStats)
+        hist.GetStats(stats)
+
+        # write and rename, so nobody ever reads half an entry
+        fileName = self.entryFile(key)
+        tmpName = fileName + '.{}.tmp'.format(os.getpid())
+        with open(tmpName, 'wb') as f:
+            np.savez(f, contents=contents, sumw2=sumw2,
+                     stats=np.array(stats), entries=hist.GetEntries())
+        os.rename(tmpName, fileName)
+
+        self.evict()
+
+
+    def entries(self):
+        '''
+        List of (file name, size, last used time) for every entry, least
+        recently used first.
+        '''
+        if not os.path.isdir(self.cacheDir):
+            return []
+
+        out = []
+        for name in os.listdir(self.cacheDir):
+            if not name.endswith('.npz'):
+                continue
+            fileName = os.path.join(self.cacheDir, name)
+            try:
+                st = os.stat(fileName)
+            except OSError: # removed by someone else
+                continue
+            out.append((fileName, st.st_size, st.st_mtime))
+
+        return sorted(out, key=lambda e: e[2])
+
+
+    def size(self):
+        return sum(e[1] for e in self.entries())
+
+
+    def evict(self, maxSize=None):
+        '''
+        Remove the least recently used entries until the cache is no bigger
+        than maxSize bytes (by default, self.maxSize). Returns the number of
+        entries removed.
+        '''
+        if maxSize is None:
+            maxSize = self.maxSize
+
+        entries = self.entries()
+        total = sum(e[1] for e in entries)
+        nRemoved = 0
+        for fileName, size, used in entries:
+            if total <= maxSize:
+                break
+            try:
+                os.remove(fileName)
+            except OSError:
+                pass
+            total -= size
+            nRemoved += 1
+
+        return nRemoved
+
+
+    def clear(self):
+        '''
+        Remove everything.
+        '''
+        return self.evict(0)
+
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='List or clear the NtuplePlotter histogram cache.')
+    parser.add_argument('action', type=str, choices=['list', 'clear'],
+                        help='What to do with the cache.')
+    parser.add_argument('cacheDir', type=str, nargs='?', default=_defaultCacheDir,
+                        help='Cache directory.')
+    args = parser.parse_args()
+
+    cache = HistCache(args.cacheDir)
+    if args.action == 'list':
+        entries = cache.entries()
+        print "{}: {} entries, {:.1f} MB".format(args.cacheDir, len(entries),
+                                                 sum(e[1] for e in entries) / 1e6)
+    else:
+        print "{}: removed {} entries".format(args.cacheDir, cache.clear())
@@ -33,19 +33,62 @@ from rootpy.plotting.hist import _Hist, _Hist2D, _Hist3D
 from rootpy.plotting.graph import _Graph1DBase
 from rootpy.plotting.utils import draw, get_band, get_limits
 from rootpy.ROOT import kTRUE, kFALSE, TLine
-from rootpy.ROOT import gROOT, TBox
+from rootpy.ROOT import gROOT, TBox, TChain
 from rootpy.tree import Tree, TreeChain, Cut
 from rootpy.plotting.base import Plottable
 from rootpy import asrootpy, QROOT
 
+import numpy as np
+from root_numpy import tree2array, fill_hist
+
 from PlotStyle import PlotStyle
+from HistCache import HistCache, histKey, calledFunctions, _defaultCacheDir as _defaultHistCacheDir
 from ZZAnalyzer.metadata import sampleInfo, sampleGroups
 from ZZAnalyzer.utils.helpers import makeNumberPretty, parseChannels
+from ZZAnalyzer.utils.dataMerger import mergeDataFiles, _defaultCacheDir
+from ZZAnalyzer.utils.histLookup import ArrayWeight
+from ZZAnalyzer.utils.weightVariations import WeightVariations
+from ZZAnalyzer.utils.WeightStringMaker import drawFunctionHash
 
 gROOT.SetBatch(kTRUE)
 
 _tempFileEnding = "_DSNPODKWMDNWCMD"
 
+def splitDrawAxes(variable):
+    '''
+    Split a TTree::Draw() variable "z:y:x" into its axes, the way Draw()
+    does: only at a single ':' outside all brackets that isn't the second
+    half of a ternary (a?b:c). Things like TMath::Abs are left alone.
+    '''
+    axes = []
+    start = 0
+    depth = 0
+    openTernaries = 0
+    i = 0
+    while i < len(variable):
+        c = variable[i]
+        if c in '([{':
+            depth += 1
+        elif c in ')]}':
+            depth -= 1
+        elif c == ':' and variable[i+1:i+2] == ':':
+            # scope operator
+            i += 2
+            continue
+        elif depth == 0:
+            if c == '?':
+                openTernaries += 1
+            elif c == ':':
+                if openTernaries:
+                    openTernaries -= 1
+                else:
+                    axes.append(variable[start:i])
+                    start = i + 1
+        i += 1
+    axes.append(variable[start:])
+
+    return axes
+
 ### Dumb workaround for a ROOT bug
 dummy = Hist(1,0,1)
 cdummy = Canvas(10,10)
@@ -126,6 +169,24 @@ def WrapPlottable(C):
     return Wrap
 
 
+class BookedHist(object):
+    '''
+    Handle for a histogram booked with NtuplePlotter.bookHist() (or
+    bookHist2() or bookHist3()). The histogram is filled, along with
+    everything else booked so far, the first time get() is called.
+    '''
+    def __init__(self, plotter, hist, finish):
+        self.plotter = plotter
+        self.hist = hist
+        self.finish = finish
+        self.filled = False
+
+    def get(self):
+        if not self.filled:
+            self.plotter.fillBooked()
+        return self.hist
+
+
 def getMinBinWidth(obj):
     '''
     Get the width of the narrowest bin in any of the objects.
@@ -142,7 +203,9 @@ def getMinBinWidth(obj):
 
 class NtuplePlotter(object):
     def __init__(self, channels, outdir='./plots', mcFiles={}, 
-                 dataFiles={}, intLumi=-1., ntupleDir='ntuple'):
+                 dataFiles={}, intLumi=-1., ntupleDir='ntuple',
+                 mergeCacheDir=_defaultCacheDir, useHistCache=False,
+                 histCacheDir=_defaultHistCacheDir, histCacheSize=1<<30):
         self.intLumi = float(intLumi)
         if not outdir or outdir[:1] == './':
             self.outdir = os.path.join(os.environ['zza'], 'ZZAnalyzer', outdir[2:])
@@ -168,8 +231,16 @@ class NtuplePlotter(object):
             self.files[cat] = {}
 
         self.sumOfWeights = {} # for MC
+        self.inputFiles = {} # {category : {sample : [file names]}}
 
         self.ntupleDir = ntupleDir
+        # merged data ntuples are kept here between runs
+        self.mergeCacheDir = mergeCacheDir
+
+        # filled histograms are kept here between runs (see HistCache)
+        self.histCache = None
+        if useHistCache:
+            self.histCache = HistCache(histCacheDir, histCacheSize)
         
         self.ntuples = {cat : {} for cat in mcFiles}
         self.ntuples.update({cat : {cat:{}} for cat in dataFiles})
@@ -177,6 +248,7 @@ class NtuplePlotter(object):
             if self.isData(cat):
                 for c in self.channels:
                     dataFileList = self.getFileNamesFromArg(dataFiles[cat]).values()
+                    self.inputFiles[cat] = {cat : dataFileList}
                     if len(dataFileList) > 1:
                         n, f = self.mergeDataFiles(c, dataFileList, cat)
                         self.files[cat][c] = f
@@ -189,8 +261,10 @@ class NtuplePlotter(object):
                         self.ntuples[cat][cat] = {}
             else:
                 self.sumOfWeights[cat] = {}
+                self.inputFiles[cat] = {}
                 for sample, fileNames in samples.iteritems():
                     self.sumOfWeights[cat][sample] = self.getWeightSum(fileNames, sample)
+                    self.inputFiles[cat][sample] = fileNames
                     if len(fileNames) == 1:
                         self.files[cat][sample] = root_open(fileNames[0])
                         self.ntuples[cat][sample] = { c : self.files[cat][sample].Get("{}/{}".format(c,self.ntupleDir)) for c in self.channels }
@@ -199,6 +273,11 @@ class NtuplePlotter(object):
 
         self.drawings = {}
 
+        # histograms booked to be filled later (see bookHist())
+        # {(category, sample, channel) : [(hist, variable, selection), ...]}
+        self.bookings = OrderedDict()
+        self.booked = []
+
         self.style = PlotStyle()
                  
 
@@ -310,29 +389,22 @@ class NtuplePlotter(object):
         Takes all data files, and for a given channel, combines the relevant
         ntuples into one big ntuple, removing redundant copies of the same
         event if an event appears in multiple files. 
-        Returns the new ntuple and a temporary file it's stored in.
+        Returns the new ntuple and the file it's stored in. The merged file
+        is cached (see ZZAnalyzer.utils.dataMerger), so it's only remade if
+        the input files change.
         Physics-based redundant row cleaning is assumed already done; that is,
         it is assumed that multiple copies of an event are strictly identical
         and it doesn't matter which is kept.
         '''
-        tempFile = root_open("dataTEMP_%s%s%s.root"%(channel, _tempFileEnding, category), "recreate")
-        out = Tree("{}/{}".format(channel,self.ntupleDir))
-
         if len(files) == 0:
+            tempFile = root_open("dataTEMP_%s%s%s.root"%(channel, _tempFileEnding, category), "recreate")
+            out = Tree("{}/{}".format(channel,self.ntupleDir))
             return out, tempFile
-        
-        chain = TreeChain("{}/{}".format(channel,self.ntupleDir), files)
 
-        foundEvents = set()
-        out.set_buffer(chain._buffer, create_branches=True)
-        for ev in chain:
-            evID = (ev.run, ev.lumi, ev.evt)
-            if evID in foundEvents:
-                continue
-            out.fill()
-            foundEvents.add(evID)
+        treePath = "{}/{}".format(channel,self.ntupleDir)
+        mergedFile = root_open(mergeDataFiles(files, treePath, self.mergeCacheDir))
 
-        return out, tempFile
+        return mergedFile.Get(treePath), mergedFile
         
 
     def printPassingEvents(self, category, sample=''):
@@ -855,8 +927,80 @@ class NtuplePlotter(object):
             return err
 
     def addToHist(self, hist, category, sample, channel, variable, selection):
+        '''
+        Draw variable with selection from one ntuple into hist (adding to
+        what's already there). If the histogram cache is on, what this draw
+        adds is taken from the cache if it's there, and cached if not.
+        '''
+        key = self.histCacheKey(hist, category, sample, channel, variable,
+                                selection)
+        if key is None:
+            return self.drawToHist(hist, category, sample, channel, variable,
+                                   selection)
+
+        piece = hist.empty_clone()
+        if not self.histCache.load(key, piece):
+            if not self.drawToHist(piece, category, sample, channel, variable,
+                                   selection):
+                return False
+            self.histCache.store(key, piece)
+
+        hist.Add(piece)
+        hist.sumw2()
+
+        return True
+
+
+    def histCacheKey(self, hist, category, sample, channel, variable,
+                     selection):
+        '''
+        Key for drawing variable with selection from one ntuple into hist in
+        the histogram cache, or None if the cache is off, there's no such
+        ntuple, or they call a function whose content can't be checked.
+        '''
+        if self.histCache is None:
+            return None
+        try:
+            files = self.inputFiles[category][sample]
+        except KeyError:
+            return None
+        if not files:
+            return None
+
+        if isinstance(selection, ArrayWeight):
+            expressions = [variable] + selection.expressions()
+            selection = selection.key()
+        else:
+            expressions = [variable, selection]
+
+        functions = {}
+        for name in calledFunctions(expressions):
+            functions[name] = drawFunctionHash(name)
+            if functions[name] is None:
+                return None
+
+        return histKey(files, "{}/{}".format(channel,self.ntupleDir),
+                       variable, selection, hist, functions)
+
+
+    def clearHistCache(self):
+        '''
+        Remove everything from the histogram cache.
+        '''
+        if self.histCache is not None:
+            self.histCache.clear()
+
+
+    def drawToHist(self, hist, category, sample, channel, variable, selection):
         try:
-            self.ntuples[category][sample][channel].Draw(variable, selection, "goff", hist)
+            ntuple = self.ntuples[category][sample][channel]
+            if isinstance(selection, ArrayWeight):
+                # can't be drawn, so fill from arrays instead
+                if self.fillFromTree(self.arrayTree(category, sample, channel),
+                                     [(hist, variable, selection)]):
+                    raise ValueError("Can't fill {} with array weights".format(variable))
+            else:
+                ntuple.Draw(variable, selection, "goff", hist)
         except KeyError:
             if category not in self.ntuples:
                 print "'%s' is not a category of ntuple, nothing to draw!"%category
@@ -881,6 +1025,222 @@ class NtuplePlotter(object):
         return True
 
 
+    def histDraws(self, channels, variables, selections, weights,
+                  applyWeights=True):
+        '''
+        List of (channel, variable, selection) to draw for a histogram, from
+        the arguments of makeHist() and friends (see makeHist()). If
+        applyWeights is True, the weights are folded into the selections
+        (an ArrayWeight becomes the selection, with the cut folded into it).
+        '''
+        channels = parseChannels(channels)
+
+        if isinstance(variables, str):
+            variables = [variables for c in channels]
+        if isinstance(selections, str):
+            selections = [selections for c in channels]
+        if isinstance(weights, (str, ArrayWeight)):
+            weights = [weights for c in channels]
+
+        assert len(channels) == len(variables) and \
+            len(variables) == len(selections) and\
+            len(selections) == len(weights), \
+                "Channel, variable, selection, and weight lists must match"
+
+        draws = []
+        for i in xrange(len(variables)):
+            variable = variables[i]
+            selection = selections[i]
+            weight = weights[i]
+            channel = channels[i]
+            # weight appropriately
+            if applyWeights:
+                if isinstance(weight, ArrayWeight):
+                    selection = weight.withCut(selection)
+                elif weight:
+                    if selection == "":
+                        selection = weight
+                    else:
+                        selection = "({0})*({1})".format(weight,selection)
+
+            draws.append((channel, variable, selection))
+
+        return draws
+
+
+    def drawHist(self, h, category, sample, draws, finish):
+        '''
+        Fill h right away, one TTree::Draw() per item in draws, then format
+        and scale it with finish().
+        '''
+        for channel, variable, selection in draws:
+            self.addToHist(h, category, sample, channel, variable,
+                           selection)
+
+        finish()
+
+        return h
+
+
+    def bookDraws(self, h, category, sample, draws, finish):
+        '''
+        Remember to fill h from draws the next time booked histograms are
+        filled (see fillBooked()). Returns a BookedHist.
+        '''
+        for channel, variable, selection in draws:
+            self.bookings.setdefault((category, sample, channel), []).append((h, variable, selection))
+
+        booked = BookedHist(self, h, finish)
+        self.booked.append(booked)
+
+        return booked
+
+
+    def fillBooked(self, chunkSize=500000):
+        '''
+        Fill every booked histogram, reading each ntuple once, then format
+        and scale them. Results are the same as from makeHist() and friends.
+        '''
+        for (category, sample, channel), toFill in self.bookings.iteritems():
+            try:
+                ntuple = self.ntuples[category][sample][channel]
+            except KeyError:
+                ntuple = None
+
+            # with the histogram cache on, each draw is filled separately
+            # so it can be cached, and cached draws aren't read again
+            pieces = []
+            if ntuple is not None and self.histCache is not None:
+                needed = []
+                for h, variable, selection in toFill:
+                    key = self.histCacheKey(h, category, sample, channel,
+                                            variable, selection)
+                    if key is None:
+                        needed.append((h, variable, selection))
+                        continue
+
+                    piece = h.empty_clone()
+                    if self.histCache.load(key, piece):
+                        h.Add(piece)
+                        h.sumw2()
+                    else:
+                        pieces.append((h, piece, key))
+                        needed.append((piece, variable, selection))
+                toFill = needed
+
+            if ntuple is not None and toFill:
+                toFill = self.fillFromTree(self.arrayTree(category, sample,
+                                                          channel),
+                                           toFill, chunkSize)
+
+            # anything left is drawn the normal way (or complained about)
+            for h, variable, selection in toFill:
+                self.drawToHist(h, category, sample, channel, variable,
+                                selection)
+
+            for h, piece, key in pieces:
+                self.histCache.store(key, piece)
+                h.Add(piece)
+                h.sumw2()
+
+        for booked in self.booked:
+            booked.finish()
+            booked.filled = True
+
+        self.bookings = OrderedDict()
+        self.booked = []
+
+
+    def arrayTree(self, category, sample, channel):
+        '''
+        The ntuple for category, sample and channel, as something root_numpy
+        can read (a TChain instead of a TreeChain).
+        '''
+        ntuple = self.ntuples[category][sample][channel]
+        if not isinstance(ntuple, TreeChain):
+            return ntuple
+
+        tree = TChain("{}/{}".format(channel,self.ntupleDir))
+        for f in self.inputFiles[category][sample]:
+            tree.Add(f)
+        return tree
+
+
+    def fillFromTree(self, tree, toFill, chunkSize=500000):
+        '''
+        Fill histograms from tree in one pass. toFill is a list of (hist,
+        variable, selection). All variables and selections are evaluated
+        together, a chunk of entries at a time, and each histogram is filled
+        the way TTree::Draw() would fill it: variable "y:x" fills (x,y), and
+        rows are weighted by the value of the selection and skipped if it's
+        0. The selection may also be an ArrayWeight.
+        Returns the items of toFill that can't be filled this way (because
+        an expression isn't one number per row, or can't be evaluated by
+        root_numpy), which should be drawn instead.
+        '''
+        expressions = []
+        plans = []
+        drawLater = []
+        for h, variable, selection in toFill:
+            # Draw() takes axes in reverse order
+            axes = splitDrawAxes(variable)[::-1]
+            if len(axes) != h.GetDimension():
+                # something we didn't parse the way Draw() would
+                drawLater.append((h, variable, selection))
+                continue
+            if isinstance(selection, ArrayWeight):
+                needed = axes + selection.expressions()
+            else:
+                needed = axes + [selection]
+            needed = [e for e in needed if e]
+            for e in needed:
+                if e not in expressions:
+                    expressions.append(e)
+            plans.append((h, variable, selection, axes, needed))
+
+        nEntries = tree.GetEntries() if plans else 0
+        for start in xrange(0, nEntries, chunkSize):
+            try:
+                arr = tree2array(tree, branches=expressions, start=start,
+                                 stop=min(start + chunkSize, nEntries))
+            except ValueError:
+                if start:
+                    raise
+                drawLater += [p[:3] for p in plans]
+                plans = []
+                break
+            columns = {e : arr[name] for e, name in zip(expressions, arr.dtype.names)}
+
+            if not start:
+                # jagged columns are jagged in every chunk
+                jagged = [any(columns[e].dtype == object for e in p[4]) for p in plans]
+                drawLater += [p[:3] for p, j in zip(plans, jagged) if j]
+                plans = [p for p, j in zip(plans, jagged) if not j]
+
+            for h, variable, selection, axes, needed in plans:
+                x = [columns[a] for a in axes]
+                if len(x) == 1:
+                    x = x[0]
+                else:
+                    x = np.column_stack(x)
+
+                if isinstance(selection, ArrayWeight):
+                    w = selection(columns)
+                elif selection:
+                    w = columns[selection].astype(np.float64)
+                else:
+                    fill_hist(h, x)
+                    continue
+
+                passing = (w != 0.)
+                fill_hist(h, x[passing], w[passing])
+
+        for p in plans:
+            p[0].sumw2()
+
+        return drawLater
+
+
     def makeHist(self, category, sample, channels, variables, selections, 
                  binning, scale=1, weights='', formatOpts={}, perUnitWidth=True,
                  nameForLegend='', isBackground=False):
@@ -907,10 +1267,92 @@ class NtuplePlotter(object):
         data, and the sample's prettyName is used for MC.
         If weights is a string, it is applied to all channels. If it is an 
         iterable of strings, each item is expected to correspond to one channel
-        as with variables and selections.
+        as with variables and selections. Weights may also be ArrayWeights
+        (see ZZAnalyzer.utils.histLookup), which are evaluated with NumPy
+        instead of in the draw string.
         isBackground forces the histogram to be formatted like MC even if it 
         is data.
         '''
+        return self.drawHist(*self.setUpHist(category, sample, channels,
+                                             variables, selections, binning,
+                                             scale, weights, formatOpts,
+                                             perUnitWidth, nameForLegend,
+                                             isBackground))
+
+
+    def bookHist(self, category, sample, channels, variables, selections, 
+                 binning, scale=1, weights='', formatOpts={}, perUnitWidth=True,
+                 nameForLegend='', isBackground=False):
+        '''
+        Like makeHist(), but the histogram isn't filled until the result of
+        one of the booked histograms is asked for (see BookedHist), and then
+        all booked histograms from the same ntuple are filled together.
+        '''
+        return self.bookDraws(*self.setUpHist(category, sample, channels,
+                                              variables, selections, binning,
+                                              scale, weights, formatOpts,
+                                              perUnitWidth, nameForLegend,
+                                              isBackground))
+
+
+    def makeHistVariations(self, category, sample, channels, variables,
+                           selections, binning, variations, scale=1,
+                           formatOpts={}, perUnitWidth=True, nameForLegend='',
+                           isBackground=False):
+        '''
+        Like makeHist(), but with a WeightVariations (or a list of them, one
+        per channel, as with weights) instead of weights. Returns an
+        OrderedDict of {variation name : histogram}, with '' for the nominal
+        weight. All variations are booked and filled together (see
+        fillBooked()), so each ntuple is read once no matter how many
+        variations there are. Anything else already booked is filled too.
+        '''
+        booked = self.bookHistVariations(category, sample, channels,
+                                         variables, selections, binning,
+                                         variations, scale, formatOpts,
+                                         perUnitWidth, nameForLegend,
+                                         isBackground)
+        self.fillBooked()
+
+        return OrderedDict((name, b.get()) for name, b in booked.iteritems())
+
+
+    def bookHistVariations(self, category, sample, channels, variables,
+                           selections, binning, variations, scale=1,
+                           formatOpts={}, perUnitWidth=True, nameForLegend='',
+                           isBackground=False):
+        '''
+        Like makeHistVariations(), but the histograms are only booked (see
+        bookHist()). Returns an OrderedDict of {variation name : BookedHist}.
+        '''
+        if isinstance(variations, WeightVariations):
+            names = variations.names
+        else:
+            names = variations[0].names
+            assert all(v.names == names for v in variations), \
+                "All channels must have the same weight variations"
+
+        booked = OrderedDict()
+        for name in names:
+            if isinstance(variations, WeightVariations):
+                weights = variations.weight(name)
+            else:
+                weights = [v.weight(name) for v in variations]
+            booked[name] = self.bookHist(category, sample, channels, variables,
+                                         selections, binning, scale, weights,
+                                         formatOpts, perUnitWidth,
+                                         nameForLegend, isBackground)
+
+        return booked
+
+
+    def setUpHist(self, category, sample, channels, variables, selections,
+                  binning, scale=1, weights='', formatOpts={}, perUnitWidth=True,
+                  nameForLegend='', isBackground=False):
+        '''
+        Empty histogram for makeHist() or bookHist(), with everything needed
+        to fill it (see drawHist()).
+        '''
         if nameForLegend:
             prettyName = nameForLegend
         else:
@@ -950,39 +1392,14 @@ class NtuplePlotter(object):
             else:
                 h.legendstyle = "F"
 
-        channels = parseChannels(channels)
-
-        if isinstance(variables, str):
-            variables = [variables for c in channels]
-        if isinstance(selections, str):
-            selections = [selections for c in channels]
-        if isinstance(weights, str):
-            weights = [weights for c in channels]
-
-        assert len(channels) == len(variables) and \
-            len(variables) == len(selections) and\
-            len(selections) == len(weights), \
-                "Channel, variable, selection, and weight lists must match"
-        for i in xrange(len(variables)):
-            variable = variables[i]
-            selection = selections[i]
-            weight = weights[i]
-            channel = channels[i]
-            # weight appropriately
-            if scale > 0.:
-                if weight:
-                    if selection == "":
-                        selection = weight
-                    else:
-                        selection = "({0})*({1})".format(weight,selection)
-                        
-            self.addToHist(h, category, sample, channel, variable,
-                           selection)
+        draws = self.histDraws(channels, variables, selections, weights,
+                               scale > 0.)
 
-        self.formatHist(h, background=isBackground, **formatOpts)
-        self.scaleHist(h, scale, perUnitWidth)
+        def finish():
+            self.formatHist(h, background=isBackground, **formatOpts)
+            self.scaleHist(h, scale, perUnitWidth)
 
-        return h
+        return h, category, sample, draws, finish
 
 
     def makeGroupHist(self, category, samples, *args, **kwargs):
@@ -993,8 +1410,17 @@ class NtuplePlotter(object):
         args and kwargs are all makeHist() arguments except category and 
         sample.
         '''
+        return self.groupHist(category, samples,
+                              [self.makeHist(category, s, *args, **kwargs) for s in samples])
+
+
+    def groupHist(self, category, samples, sampleHists):
+        '''
+        Combine already-made histograms sampleHists (one per sample in
+        samples) into a single histogram for their group, like
+        makeGroupHist().
+        '''
         group = sampleInfo[samples[0]]['group']
-        sampleHists = [self.makeHist(category, s, *args, **kwargs) for s in samples]
         for s in sampleHists:
             s.sumw2()
         histKWArgs = {
@@ -1043,6 +1469,27 @@ class NtuplePlotter(object):
         iterable of strings, each item is expected to correspond to one channel
         as with variables and selections.
         '''
+        return self.drawHist(*self.setUpHist2(category, sample, channels,
+                                              variables, selections, binning,
+                                              scale, weights, formatOpts))
+
+
+    def bookHist2(self, category, sample, channels, variables, selections, 
+                  binning, scale=1., weights='', formatOpts={}):
+        '''
+        Like makeHist2(), but booked like bookHist().
+        '''
+        return self.bookDraws(*self.setUpHist2(category, sample, channels,
+                                               variables, selections, binning,
+                                               scale, weights, formatOpts))
+
+
+    def setUpHist2(self, category, sample, channels, variables, selections, 
+                   binning, scale=1., weights='', formatOpts={}):
+        '''
+        Empty histogram for makeHist2() or bookHist2(), with everything
+        needed to fill it (see drawHist()).
+        '''
         if self.isData(category):
             prettyName = category
         else:
@@ -1063,39 +1510,13 @@ class NtuplePlotter(object):
             }
         h = self.WrappedHist2(*binning, **histKWArgs)
 
-        channels = parseChannels(channels)
-
-        if isinstance(variables, str):
-            variables = [variables for c in channels]
-        if isinstance(selections, str):
-            selections = [selections for c in channels]
-        if isinstance(weights, str):
-            weights = [weights for c in channels]
-
-        assert len(channels) == len(variables) and \
-            len(variables) == len(selections) and\
-            len(selections) == len(weights), \
-                "Channel, variable, selection, and weight lists must match"
-
-        for i in xrange(len(variables)):
-            variable = variables[i]
-            selection = selections[i]
-            weight = weights[i]
-            channel = channels[i]
-            # weight appropriately
-            if weight:
-                if selection == "":
-                    selection = weight
-                else:
-                    selection = "({0})*({1})".format(weight,selection)
-
-            self.addToHist(h, category, sample, channels[i], variables[i],
-                           selection)
+        draws = self.histDraws(channels, variables, selections, weights)
 
-        self.formatHist2(h, **formatOpts)
-        self.scaleHist2(h, scale)
+        def finish():
+            self.formatHist2(h, **formatOpts)
+            self.scaleHist2(h, scale)
 
-        return h
+        return h, category, sample, draws, finish
 
 
     def makeHist3(self, category, sample, channels, variables, selections, 
@@ -1115,6 +1536,27 @@ class NtuplePlotter(object):
         iterable of strings, each item is expected to correspond to one channel
         as with variables and selections.
         '''
+        return self.drawHist(*self.setUpHist3(category, sample, channels,
+                                              variables, selections, binning,
+                                              scale, weights, formatOpts))
+
+
+    def bookHist3(self, category, sample, channels, variables, selections, 
+                  binning, scale=1., weights='', formatOpts={}):
+        '''
+        Like makeHist3(), but booked like bookHist().
+        '''
+        return self.bookDraws(*self.setUpHist3(category, sample, channels,
+                                               variables, selections, binning,
+                                               scale, weights, formatOpts))
+
+
+    def setUpHist3(self, category, sample, channels, variables, selections, 
+                   binning, scale=1., weights='', formatOpts={}):
+        '''
+        Empty histogram for makeHist3() or bookHist3(), with everything
+        needed to fill it (see drawHist()).
+        '''
         if self.isData(category):
             prettyName = category
         else:
@@ -1129,39 +1571,13 @@ class NtuplePlotter(object):
             }
         h = self.WrappedHist3(*binning, **histKWArgs)
 
-        channels = parseChannels(channels)
-
-        if isinstance(variables, str):
-            variables = [variables for c in channels]
-        if isinstance(selections, str):
-            selections = [selections for c in channels]
-        if isinstance(weights, str):
-            weights = [weights for c in channels]
-
-        assert len(channels) == len(variables) and \
-            len(variables) == len(selections) and\
-            len(selections) == len(weights), \
-                "Channel, variable, selection, and weight lists must match"
-
-        for i in xrange(len(variables)):
-            variable = variables[i]
-            selection = selections[i]
-            weight = weights[i]
-            channel = channels[i]
-            # weight appropriately
-            if weight:
-                if selection == "":
-                    selection = weight
-                else:
-                    selection = "({0})*({1})".format(weight,selection)
+        draws = self.histDraws(channels, variables, selections, weights)
 
-            self.addToHist(h, category, sample, channels[i], variables[i],
-                           selection)
+        def finish():
+            self.formatHist3(h, **formatOpts)
+            self.scaleHist3(h, scale)
 
-        self.formatHist3(h, **formatOpts)
-        self.scaleHist3(h, scale)
-
-        return h
+        return h, category, sample, draws, finish
 
 
     def scaleHist(self, h, scale=1., perUnitWidth=True):
@@ -1287,25 +1703,31 @@ class NtuplePlotter(object):
         by passing parameters to self.makeHist().
         If extraHists are specified, these hists are also stacked.
         '''
+        sampleHists = [self.makeHist(category, sample, channel, variable, 
+                                     selection, binning, scale, weight, 
+                                     perUnitWidth=perUnitWidth) for sample in samples]
+
+        return self.stackHists(category, samples, sampleHists, variable,
+                               selection, sortByMax, extraHists)
+
+
+    def stackHists(self, category, samples, sampleHists, variable, selection,
+                   sortByMax=True, extraHists=[]):
+        '''
+        Stack already-made histograms sampleHists (one per sample in samples),
+        combining samples in the same group, like makeStack().
+        '''
         hists = []
-        groups = {}
-        for sample in samples:
+        groups = OrderedDict()
+        for sample, h in zip(samples, sampleHists):
             if 'group' in sampleInfo[sample]:
-                group = sampleInfo[sample]['group']
-                if group in groups:
-                    groups[group].append(sample)
-                else:
-                    groups[group] = [sample]
+                groups.setdefault(sampleInfo[sample]['group'], []).append((sample, h))
             else:
-                hists.append(self.makeHist(category, sample, channel, variable, 
-                                           selection, binning, scale, weight, 
-                                           perUnitWidth=perUnitWidth))
+                hists.append(h)
 
-        for group in groups:
-            hists.append(self.makeGroupHist(category, groups[group], channel,
-                                            variable, selection, binning, 
-                                            scale, weight, 
-                                            perUnitWidth=perUnitWidth))
+        for group, members in groups.iteritems():
+            hists.append(self.groupHist(category, [m[0] for m in members],
+                                        [m[1] for m in members]))
 
         hists = extraHists + self.orderForStack(hists, sortByMax)
 
@@ -1445,13 +1867,47 @@ class NtuplePlotter(object):
         a hist/graph/hist stack as an argument, which will be run just before
         the data points and MC stack are plotted
         '''
-        self.drawings[name] = self.Drawing(name, self.style, canvasX, canvasY, 
-                                           logy, ipynb, logx=logx)
-
         s = self.makeCategoryStack(mcCategory, channel, variable, selection,
                                    binning, 1., mcWeights,
                                    extraHists=extraBkgs)
 
+        if isinstance(dataCategory, str):
+            dataCategory = [dataCategory]
+
+        h = None
+        for dc in dataCategory:
+            hTemp = self.makeHist(dc, dc, channel, variable, selection,
+                                  binning)
+            if h is None:
+                h = hTemp
+            else:
+                h += hTemp
+
+        self.stackPlot(name, s, h, canvasX, canvasY, logy, styleOpts, ipynb,
+                       xTitle, xUnits, yTitle, yUnits, drawNow, outFile,
+                       legParams, drawOpts, drawRatio, legSolid,
+                       widthInYTitle, mcSystFracUp, mcSystFracDown, blinding,
+                       extraObjects, plotType, stackErr, logx,
+                       finishingFuncData, finishingFuncMC, noPointWidth)
+
+
+    def stackPlot(self, name, s, h, canvasX=800, canvasY=1000, logy=False,
+                  styleOpts={}, ipynb=False, xTitle="", xUnits="GeV",
+                  yTitle="Events", yUnits="", drawNow=False, outFile='',
+                  legParams={}, drawOpts={}, drawRatio=True, legSolid=False,
+                  widthInYTitle=False, mcSystFracUp=0., mcSystFracDown=0.,
+                  blinding=[], extraObjects=[], plotType="Preliminary",
+                  stackErr=True, logx=False, finishingFuncData=None,
+                  finishingFuncMC=None, noPointWidth=False):
+        '''
+        Second half of fullPlot(): draw an already-made MC stack s (e.g.
+        from stackHists()) and data histogram h, store the drawing in
+        self.drawings keyed to name, and save it if outFile is specified.
+        Arguments are the same as fullPlot()'s.
+        '''
+        self.drawings[name] = self.Drawing(name, self.style, canvasX, canvasY, 
+                                           logy, ipynb, logx=logx)
+
         if hasattr(finishingFuncMC, '__call__'):
             finishingFuncMC(s)
 
@@ -1465,18 +1921,6 @@ class NtuplePlotter(object):
         for ob in extraObjects:
             self.drawings[name].addObject(ob, hasattr(ob, "legendstyle"))
 
-        if isinstance(dataCategory, str):
-            dataCategory = [dataCategory]
-
-        h = None
-        for dc in dataCategory:
-            hTemp = self.makeHist(dc, dc, channel, variable, selection,
-                                  binning)
-            if h is None:
-                h = hTemp
-            else:
-                h += hTemp
-
         if h.GetEntries():
             if hasattr(finishingFuncData, '__call__'):
                 finishingFuncData(h)
@@ -0,0 +1,247 @@
+'''
+
+Make a lot of plots at once, spread across processes.
+
+Each plot is a "spec," a dict of arguments for NtuplePlotter.fullPlot():
+name, channel, variable, selection and binning, plus any of its keyword
+arguments that can be pickled (so no functions or histograms) and
+outFile (relative to the plotter's output directory; if it's missing, the
+plot is saved to <name>.png). The specs are split into contiguous shards
+and handed out to a pool of worker processes. Each worker has its own
+NtuplePlotter, made from the same arguments, and its own copy of ROOT,
+so nothing in ROOT's global state (open files, gDirectory, canvases,
+object names) is shared. Workers make their plotters one at a time, so
+merged data ntuples (see ZZAnalyzer.utils.dataMerger) are only made once.
+
+A plot that fails doesn't stop the others. If a worker process dies
+(e.g. ROOT segfaults), the plots in the shard it was working on fail and
+the rest carry on (see ZZAnalyzer.utils.poolWatcher). When everything's
+done, a summary of every plot (file made, worker, time taken, or the
+error) is written as JSON to the output directory.
+
+The specs can also be run from a JSON file,
+
+>>> python PlotExecutor.py plots.json [--nProcesses N]
+
+where plots.json has the form
+    {"plotter" : {NtuplePlotter arguments},
+     "plots" : [spec, spec, ...]}
+
+Author: Nate Woods, U. Wisconsin
+
+'''
+
+import os
+import json
+import multiprocessing
+import signal
+import traceback
+from timeit import default_timer as timer
+
+from ZZAnalyzer.utils.poolWatcher import PoolWatcher, runWatched
+
+
+# This process's plotter, made once by each worker
+_plotter = None
+
+
+def _makePlotter(plotterArgs):
+    # import here so the parent process doesn't need ROOT set up at all
+    from NtuplePlotter import NtuplePlotter
+
+    return NtuplePlotter(**plotterArgs)
+
+
+def _initWorker(plotterArgs, lock):
+    # let the parent handle ctrl-c
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    global _plotter
+    with lock:
+        _plotter = _makePlotter(plotterArgs)
+
+
+def _makePlot(spec):
+    '''
+    Make one plot with this process's plotter. Returns a summary dict.
+    '''
+    spec = dict(spec)
+    name = spec.pop('name')
+    spec.setdefault('outFile', name + '.png')
+
+    result = {
+        'name' : name,
+        'outdir' : _plotter.outdir,
+        'file' : os.path.join(_plotter.outdir, spec['outFile']),
+        'pid' : os.getpid(),
+        }
+    for arg in ['channel', 'variable', 'selection']:
+        result[arg] = spec.get(arg)
+
+    start = timer()
+    try:
+        _plotter.fullPlot(name, spec.pop('channel'), spec.pop('variable'),
+                          spec.pop('selection'), spec.pop('binning'), **spec)
+        result['error'] = None
+    except Exception:
+        result['error'] = traceback.format_exc()
+    result['time'] = timer() - start
+
+    # don't keep every canvas around
+    _plotter.drawings.pop(name, None)
+
+    return result
+
+
+def _makePlots(shard):
+    return [_makePlot(spec) for spec in shard]
+
+
+def _lostPlot(spec, pid):
+    '''
+    Summary for a plot whose worker died before it was returned.
+    '''
+    result = {
+        'name' : spec['name'],
+        'outdir' : None,
+        'file' : spec.get('outFile', spec['name'] + '.png'),
+        'pid' : pid,
+        'error' : 'Worker process {} died while making this shard of plots'.format(pid),
+        'time' : None,
+        }
+    for arg in ['channel', 'variable', 'selection']:
+        result[arg] = spec.get(arg)
+
+    return result
+
+
+
+class PlotExecutor(object):
+    # seconds between checks for dead worker processes
+    checkInterval = 10
+
+    def __init__(self, plotterArgs, nProcesses=None, indexFile='plotIndex.json'):
+        '''
+        plotterArgs:  dict of NtuplePlotter arguments (channels, outdir,
+                          mcFiles, dataFiles, intLumi...)
+        nProcesses:   number of worker processes (default: all cores). If 1,
+                          plots are made in this process.
+        indexFile:    name of the summary, in the plotter's output directory
+        '''
+        self.plotterArgs = plotterArgs
+        if nProcesses is None:
+            nProcesses = multiprocessing.cpu_count()
+        self.nProcesses = max(int(nProcesses), 1)
+        self.indexFile = indexFile
+
+
+    def run(self, specs):
+        '''
+        Make all the plots in specs. Returns the list of summaries (see
+        _makePlot()), in the same order as specs.
+        '''
+        specs = list(specs)
+        names = [s['name'] for s in specs]
+        assert len(set(names)) == len(names), "Plot names must be unique"
+
+        start = timer()
+
+        if self.nProcesses == 1 or len(specs) < 2:
+            global _plotter
+            _plotter = _makePlotter(self.plotterArgs)
+            results = [_makePlot(s) for s in specs]
+        else:
+            nProcesses = min(self.nProcesses, len(specs))
+            # a few shards per worker so they all finish around the same time
+            shardSize = max(len(specs) // (4 * nProcesses), 1)
+
+            shards = [specs[i:i+shardSize] for i in xrange(0, len(specs), shardSize)]
+
+            pool = multiprocessing.Pool(nProcesses, _initWorker,
+                                        (self.plotterArgs, multiprocessing.Lock()))
+            watcher = PoolWatcher(pool)
+            try:
+                pending = {i : pool.apply_async(runWatched, (watcher.started, i, _makePlots, shard))
+                           for i, shard in enumerate(shards)}
+                shardResults = {}
+                workersDied = False
+                while pending:
+                    # wait with a timeout so ctrl-c works and dead workers
+                    # are noticed
+                    pending[min(pending)].wait(self.checkInterval)
+                    for i in [i for i, r in pending.iteritems() if r.ready()]:
+                        shardResults[i] = pending.pop(i).get()
+                    for i, pid in watcher.lost():
+                        if i in pending:
+                            del pending[i]
+                            shardResults[i] = [_lostPlot(spec, pid) for spec in shards[i]]
+                            workersDied = True
+
+                if workersDied:
+                    # the pool would wait forever for the dead workers' jobs
+                    pool.terminate()
+                else:
+                    pool.close()
+            except KeyboardInterrupt:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+                watcher.shutdown()
+
+            results = sum((shardResults[i] for i in xrange(len(shards))), [])
+
+        outdirs = [r['outdir'] for r in results if r['outdir'] is not None]
+        if not outdirs:
+            return results
+        for r in results:
+            if r['outdir'] is None:
+                r['outdir'] = outdirs[0]
+                r['file'] = os.path.join(outdirs[0], r['file'])
+
+        summary = {
+            'plots' : results,
+            'nProcesses' : self.nProcesses,
+            'time' : timer() - start,
+            }
+        with open(os.path.join(outdirs[0], self.indexFile), 'w') as f:
+            json.dump(summary, f, indent=2, sort_keys=True)
+
+        return results
+
+
+
+def _toStr(obj):
+    '''
+    Turn the unicode strings JSON gives into normal strings, since that's
+    what NtuplePlotter checks for.
+    '''
+    if isinstance(obj, unicode):
+        return str(obj)
+    if isinstance(obj, list):
+        return [_toStr(o) for o in obj]
+    if isinstance(obj, dict):
+        return {_toStr(k) : _toStr(v) for k, v in obj.iteritems()}
+    return obj
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Make plots in parallel from a JSON list of specs.')
+    parser.add_argument('jobs', type=str,
+                        help='JSON file with NtuplePlotter arguments ("plotter") and plot specs ("plots").')
+    parser.add_argument('--nProcesses', type=int, default=multiprocessing.cpu_count(),
+                        help='Number of worker processes.')
+    args = parser.parse_args()
+
+    with open(args.jobs) as f:
+        jobs = _toStr(json.load(f))
+
+    results = PlotExecutor(jobs['plotter'], args.nProcesses).run(jobs['plots'])
+
+    failed = [r for r in results if r['error']]
+    for r in failed:
+        print "Plot {} failed:".format(r['name'])
+        print r['error']
+    print "Made {} of {} plots.".format(len(results) - len(failed), len(results))
@@ -0,0 +1,258 @@
+'''
+
+Optional columnar copy of the rows an NtupleCopier saves, so downstream
+jobs can read (or memory map) only the columns they need instead of going
+through the ROOT output row by row.
+
+For each channel, the saved rows are written to <outFile>_<channel>.parquet
+(Parquet) or <outFile>_<channel>.arrow (Arrow IPC file format), in the same
+order as in the ROOT output. Only branches matching one of the given regular
+expressions are written (all of them by default), and rows are written in
+row groups (record batches, for Arrow) of rowGroupSize rows. Columns are
+read with ZZAnalyzer.utils.columnar, so floating point branches are stored
+as doubles.
+
+Whatever the analyzer passes to write() as the info for each channel (e.g.
+the cut flow and the summed values of the input's metaInfo tree) is stored
+as JSON in the file's key-value metadata, with the key 'zza'.
+
+Needs pyarrow, but only if a ColumnarExporter is actually made.
+
+Nate Woods, U. Wisconsin
+
+'''
+
+
+import json
+from array import array
+from re import compile as _compile
+
+import numpy as np
+
+from rootpy.io.file import DoesNotExist
+
+from ZZAnalyzer.utils.columnar import ColumnReader
+
+# pyarrow and pyarrow.parquet, imported when the first exporter is made
+pa = None
+pq = None
+
+def _importArrow():
+    global pa, pq
+    if pa is None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("Columnar output needs pyarrow, which isn't installed")
+        pa = pyarrow
+        pq = pyarrow.parquet
+
+
+# NumPy types of the columns ColumnReader gives for each ROOT leaf type
+# (floats are read as doubles), and of the items of vector branches
+_leafDtypes = {
+    'Bool_t' : np.bool_,
+    'Char_t' : np.int8,
+    'UChar_t' : np.uint8,
+    'Short_t' : np.int16,
+    'UShort_t' : np.uint16,
+    'Int_t' : np.int32,
+    'UInt_t' : np.uint32,
+    'Long64_t' : np.int64,
+    'ULong64_t' : np.uint64,
+    'Float_t' : np.float64,
+    'Double_t' : np.float64,
+    }
+_vectorDtypes = {
+    'bool' : np.bool_,
+    'char' : np.int8,
+    'unsigned char' : np.uint8,
+    'short' : np.int16,
+    'unsigned short' : np.uint16,
+    'int' : np.int32,
+    'unsigned int' : np.uint32,
+    'long' : np.int64,
+    'unsigned long' : np.uint64,
+    'Long64_t' : np.int64,
+    'ULong64_t' : np.uint64,
+    'float' : np.float32,
+    'double' : np.float64,
+    }
+
+
+def _arrowType(branch):
+    '''
+    Arrow type of the column ColumnReader gives for branch (a TBranch).
+    Anything unrecognized is taken to be a double.
+    '''
+    className = branch.GetClassName()
+    if className.startswith('vector<'):
+        item = className[len('vector<'):-1].strip()
+        return pa.list_(pa.from_numpy_dtype(np.dtype(_vectorDtypes.get(item, np.float64))))
+
+    leaves = branch.GetListOfLeaves()
+    typeName = leaves[0].GetTypeName() if leaves.GetEntries() else ''
+    return pa.from_numpy_dtype(np.dtype(_leafDtypes.get(typeName, np.float64)))
+
+
+class ColumnarExporter(object):
+    extensions = {
+        'parquet' : '.parquet',
+        'arrow' : '.arrow',
+        }
+
+    def __init__(self, outFile, fmt='parquet', branches=None,
+                 rowGroupSize=100000, readChunkSize=100000):
+        '''
+        outFile:       name of the ROOT output file the rows are also saved to
+        fmt:           'parquet' or 'arrow'
+        branches:      list of regular expressions for the branches to write,
+                           or None for all of them
+        rowGroupSize:  number of rows per row group (or record batch)
+        readChunkSize: maximum number of input rows to read columns for at
+                           once
+        '''
+        _importArrow()
+        if fmt not in self.extensions:
+            raise ValueError("Unknown columnar output format {}, options are {}".format(fmt, ', '.join(self.extensions)))
+
+        self.outFile = outFile
+        self.format = fmt
+        self.patterns = None
+        if branches:
+            self.patterns = [_compile(b) for b in branches]
+        self.rowGroupSize = max(int(rowGroupSize), 1)
+        self.readChunkSize = max(int(readChunkSize), 1)
+
+        self.entries = {}
+
+
+    def fileName(self, channel):
+        return self.outFile.replace('.root', '_{}{}'.format(channel, self.extensions[self.format]))
+
+
+    def addRow(self, channel, iRow):
+        '''
+        Remember that entry iRow of channel's input ntuple was saved.
+        '''
+        self.entries.setdefault(channel, array('l')).append(iRow)
+
+
+    def write(self, inFileName, treePaths, info={}):
+        '''
+        Write the saved rows of every channel.
+        treePaths:  {channel : path to the channel's ntuple in inFileName}
+        info:       {channel : JSON-friendly dict to store as metadata}
+        '''
+        for channel, treePath in treePaths.iteritems():
+            self.writeChannel(channel, inFileName, treePath, info.get(channel, {}))
+
+
+    def writeChannel(self, channel, inFileName, treePath, info):
+        reader = ColumnReader(inFileName, treePath)
+        try:
+            if self.patterns is None:
+                branches = reader.branchNames
+            else:
+                branches = reader.branchesMatching(self.patterns)
+
+            entries = self.entries.get(channel, array('l'))
+            if len(entries):
+                entries = np.frombuffer(entries, dtype=np.int_)
+            else:
+                entries = np.zeros(0, dtype=np.int_)
+
+            metadata = {'zza' : json.dumps(info, sort_keys=True)}
+
+            writer = None
+            try:
+                for start in xrange(0, max(len(entries), 1), self.rowGroupSize):
+                    if len(entries):
+                        columns = self.readRows(reader, branches,
+                                                entries[start:start+self.rowGroupSize])
+                        table = pa.Table.from_arrays([pa.array(columns[b]) for b in branches],
+                                                     names=branches)
+                    else:
+                        table = self.emptyTable(reader, branches)
+                    table = table.replace_schema_metadata(metadata)
+
+                    if writer is None:
+                        writer = self.makeWriter(self.fileName(channel), table.schema)
+                    self.writeTable(writer, table)
+            finally:
+                if writer is not None:
+                    writer.close()
+        finally:
+            reader.close()
+
+
+    def readRows(self, reader, branches, rows):
+        '''
+        Dict of arrays of branches for the listed entries, in the order
+        listed. Reads at most self.readChunkSize consecutive entries at once.
+        '''
+        if not len(rows):
+            return reader.read(branches, 0, 0)
+
+        entries, order = np.unique(rows, return_inverse=True)
+
+        pieces = []
+        i = 0
+        while i < len(entries):
+            start = entries[i]
+            j = np.searchsorted(entries, start + self.readChunkSize)
+            # no further than the last entry needed from this window
+            stop = entries[j-1] + 1
+            columns = reader.read(branches, start, stop)
+            pieces.append({b : columns[b][entries[i:j] - start] for b in branches})
+            i = j
+
+        return {b : np.concatenate([p[b] for p in pieces])[order] for b in branches}
+
+
+    def emptyTable(self, reader, branches):
+        '''
+        Table with no rows, with the types the branches would have had.
+        '''
+        return pa.Table.from_arrays([pa.array([], type=_arrowType(reader.tree.GetBranch(b)))
+                                     for b in branches],
+                                    names=branches)
+
+
+    def makeWriter(self, fileName, schema):
+        if self.format == 'parquet':
+            return pq.ParquetWriter(fileName, schema)
+        return pa.RecordBatchFileWriter(fileName, schema)
+
+
+    def writeTable(self, writer, table):
+        if self.format == 'parquet':
+            writer.write_table(table, row_group_size=self.rowGroupSize)
+        else:
+            for batch in table.to_batches():
+                writer.write_batch(batch)
+
+
+
+def summedMetaInfo(inFileName, treePath='metaInfo/metaInfo'):
+    '''
+    Dict of the sum of every numerical branch of the metaInfo tree in
+    inFileName (e.g. {'summedWeights' : ..., 'nevents' : ...}), or an empty
+    dict if there is no metaInfo tree.
+    '''
+    try:
+        reader = ColumnReader(inFileName, treePath)
+    except DoesNotExist:
+        return {}
+
+    try:
+        columns = reader.read(reader.branchNames, 0, reader.GetEntries())
+    finally:
+        reader.close()
+
+    out = {}
+    for b, col in columns.iteritems():
+        if col.dtype.kind in 'biuf':
+            out[b] = col.sum().item()
+    return out
@@ -3,16 +3,35 @@
 A greatly simplified way to copy the passing rows of ntuples, because that's
 all we ever do anyway.
 
+Rows aren't written as they're saved. NtupleCopier just remembers the entry
+number of each one, and copies them all at once in save(): if every entry of
+an ntuple passed, whole baskets are copied without being decompressed
+(CloneTree with the "fast" option); otherwise, the entries are copied in C++
+with an entry list (CopyTree). Either way, the rows don't go through Python.
+If rows of a channel are saved out of order (or twice), or bulkCopy is
+False, that channel falls back to filling the output one row at a time from
+the input ntuple's buffer when each row is saved.
+
+With addExporter(), the saved rows are also written to a columnar file
+(see ColumnarExporter).
+
 Nate Woods, U. Wisconsin
 
 '''
 
 
+from array import array
+
+import ROOT
+
 from rootpy.io import root_open, Directory
 from rootpy.tree import Tree
 
 
 class NtupleCopier(object):
+    # Set to False to always fill the output trees row by row
+    bulkCopy = True
+
     def __init__(self, fileName, *args, **ntuples):
         self.channels = ntuples.keys()
 
@@ -20,34 +39,122 @@ class NtupleCopier(object):
         # assume all ntuples from same file
         self.ntupleFile = ntuples.values()[0].GetDirectory().GetFile()
 
-        self.ntuples = self.makeNtuples(self.file, *args, **ntuples)
+        self.ntuplesIn = ntuples
+        self.dirs = self.makeDirs(self.file, *args, **ntuples)
+
+        # entry numbers of saved rows, for channels being copied in bulk
+        self.entries = {}
+        # output trees, for channels being filled row by row
+        self.ntuples = {}
+        self.exporter = None
+        for channel in self.channels:
+            if self.bulkCopy:
+                self.entries[channel] = array('l')
+            else:
+                self.ntuples[channel] = self.makeNtuple(channel)
 
 
-    def makeNtuples(self, outFile, *args, **ntuplesIn):
+    def makeDirs(self, outFile, *args, **ntuplesIn):
         out = {}
 
         for channel, nIn in ntuplesIn.iteritems():
             outFile.cd()
-            d = self.file.mkdir(nIn.GetDirectory().GetPath().split(':/')[-1],
-                                recurse=True)
-            d.cd()
+            out[channel] = self.file.mkdir(nIn.GetDirectory().GetPath().split(':/')[-1],
+                                           recurse=True)
+
+        return out
+
+
+    def addExporter(self, exporter):
+        '''
+        Also save rows with exporter (a ColumnarExporter).
+        '''
+        self.exporter = exporter
+
 
-            out[channel] = Tree(nIn.GetName())
+    def treePath(self, channel):
+        nIn = self.ntuplesIn[channel]
+        return '/'.join([nIn.GetDirectory().GetPath().split(':/')[-1], nIn.GetName()])
 
-            if not nIn._buffer:
-                nIn.create_buffer()
-            out[channel].set_buffer(nIn._buffer, create_branches=True, visible=True)
+
+    def makeNtuple(self, channel):
+        '''
+        Output tree sharing the input ntuple's buffer, for filling row by row.
+        '''
+        nIn = self.ntuplesIn[channel]
+        self.dirs[channel].cd()
+
+        out = Tree(nIn.GetName())
+
+        if not nIn._buffer:
+            nIn.create_buffer()
+        out.set_buffer(nIn._buffer, create_branches=True, visible=True)
 
         return out
 
 
-    def saveRow(self, row, channel, *args, **kwargs):
-        self.ntuples[channel].fill()
+    def needsRow(self, channel):
+        '''
+        True if the whole row has to be in the input ntuple's buffer when
+        it's saved, i.e. if channel is being filled row by row.
+        '''
+        return channel in self.ntuples
+
+
+    def saveRow(self, row, channel, iRow=None, *args, **kwargs):
+        '''
+        Save entry iRow of channel's input ntuple (by default, the last one
+        read).
+        '''
+        if iRow is None and (self.exporter is not None or channel not in self.ntuples):
+            iRow = self.ntuplesIn[channel].GetReadEntry()
+
+        if self.exporter is not None:
+            self.exporter.addRow(channel, iRow)
+
+        if channel in self.ntuples:
+            self.ntuples[channel].fill()
+            return
+
+        entries = self.entries[channel]
+        if entries and iRow <= entries[-1]:
+            self.startFilling(channel, iRow)
+            self.ntuples[channel].fill()
+            return
+
+        entries.append(iRow)
+
+
+    def startFilling(self, channel, current):
+        '''
+        Stop collecting entries for channel, and fill its output tree with
+        the rows saved so far. Entry current is left in the input buffer.
+        '''
+        nIn = self.ntuplesIn[channel]
+
+        out = self.makeNtuple(channel)
+        # read all branches, in case some were turned off
+        for iRow in self.entries.pop(channel):
+            ROOT.TTree.GetEntry(nIn, iRow, 1)
+            out.fill()
+        ROOT.TTree.GetEntry(nIn, current, 1)
+
+        self.ntuples[channel] = out
 
 
     def save(self, *exclude, **kwargs):
+        '''
+        Write everything and close the output. If there's an exporter,
+        kwargs['exportInfo'] is the metadata for each channel (see
+        ColumnarExporter.write()).
+        '''
         self.writeNtuples(**kwargs)
 
+        if self.exporter is not None:
+            self.exporter.write(self.ntupleFile.GetName(),
+                                {c : self.treePath(c) for c in self.channels},
+                                kwargs.get('exportInfo', {}))
+
         self.copyEverythingElse(*exclude, **kwargs)
 
         self.file.close()
@@ -57,6 +164,35 @@ class NtupleCopier(object):
         for n in self.ntuples.values():
             n.write()
 
+        for channel, entries in self.entries.iteritems():
+            self.copyEntries(channel, entries).Write()
+
+
+    def copyEntries(self, channel, entries):
+        '''
+        Copy the listed entries of channel's input ntuple into a new tree in
+        the right directory of the output file, and return the new tree.
+        '''
+        nIn = self.ntuplesIn[channel]
+        nIn.SetBranchStatus('*', 1)
+        self.dirs[channel].cd()
+
+        if len(entries) == nIn.GetEntries():
+            # Everything passed, so baskets can be copied without unzipping
+            return nIn.CloneTree(-1, 'fast')
+
+        entryList = ROOT.TEntryList('', '', nIn)
+        for iRow in entries:
+            entryList.Enter(iRow)
+
+        nIn.SetEntryList(entryList)
+        try:
+            out = nIn.CopyTree('')
+        finally:
+            nIn.SetEntryList(0)
+
+        return out
+
 
     def copyEverythingElse(self, *exclude, **kwargs):
         '''
@@ -72,4 +208,3 @@ class NtupleCopier(object):
             k = key.GetName()
             if k not in exclude:
                 getattr(self.ntupleFile, k).copytree(self.file)
-
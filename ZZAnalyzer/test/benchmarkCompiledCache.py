@@ -0,0 +1,85 @@
+#!/usr/bin/python
+'''
+
+Compare the startup cost of getting the fake rate functions compiled and
+loaded, in a fresh process each time:
+    - through rootpy.compiled (how it used to be done)
+    - through the compiled code cache, starting from an empty cache (cold)
+    - through the compiled code cache, after it's been filled (warm)
+For each, the time to compile/load the code and the wall time of the
+whole process (including importing ROOT) are printed.
+
+Author: Nate Woods, U. Wisconsin
+
+'''
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from timeit import default_timer as timer
+
+
+assert os.environ["zza"], "Run setup.sh before running analysis"
+
+
+def child(mode, cacheDir):
+    '''
+    Get the fake rate code loaded, print how long it took.
+    '''
+    import ROOT
+    from ZZAnalyzer.utils.ReducibleBackgroundCalculator import ___FRCodeToCompile___
+
+    start = timer()
+    if mode == 'rootpy':
+        import rootpy.compiled as ROOTComp
+        ROOTComp.register_code(___FRCodeToCompile___,
+                               ['lepFakeFactor', 'lepFakeFactorAdditive'])
+        getattr(ROOTComp, 'lepFakeFactor')
+    else:
+        from ZZAnalyzer.utils.compiledCache import CompiledCache
+        f = CompiledCache(cacheDir).compileCode(___FRCodeToCompile___,
+                                                ['lepFakeFactor', 'lepFakeFactorAdditive'],
+                                                'fakeFactors')
+        assert f['lepFakeFactor'](0.5, 0., 0.) == 1.
+    print timer() - start
+
+
+def runChild(mode, cacheDir):
+    '''
+    (compile time, process wall time) for one fresh process.
+    '''
+    start = timer()
+    out = subprocess.check_output([sys.executable, os.path.abspath(__file__),
+                                   '--child', mode, cacheDir])
+    wall = timer() - start
+    return float(out.strip().split('\n')[-1]), wall
+
+
+parser = argparse.ArgumentParser(description='Benchmark compiling fake rate code with and without the compiled code cache.')
+parser.add_argument('--nTrials', type=int, default=5,
+                    help='Number of warm (and rootpy) processes to average over.')
+parser.add_argument('--child', type=str, nargs=2, default=None,
+                    help=argparse.SUPPRESS)
+args = parser.parse_args()
+
+if args.child is not None:
+    child(*args.child)
+    exit(0)
+
+cacheDir = tempfile.mkdtemp()
+try:
+    results = {}
+    results['rootpy.compiled'] = [runChild('rootpy', cacheDir) for i in range(args.nTrials)]
+    results['cache (cold)'] = [runChild('cache', cacheDir)]
+    results['cache (warm)'] = [runChild('cache', cacheDir) for i in range(args.nTrials)]
+finally:
+    shutil.rmtree(cacheDir)
+
+print "{:20} {:>12} {:>12}".format('', 'compile (s)', 'process (s)')
+for mode in ['rootpy.compiled', 'cache (cold)', 'cache (warm)']:
+    times = results[mode]
+    print "{:20} {:12.3f} {:12.3f}".format(mode, sum(t[0] for t in times) / len(times),
+                                           sum(t[1] for t in times) / len(times))
@@ -0,0 +1,195 @@
+#!/usr/bin/python
+'''
+
+Compare the compiled cut plans (ZZAnalyzer.cuts.cutPlan) to the closures
+built by Cutter.getCutFunction(), for BaseCuts2016 and the usual control
+region modifiers. Every cut in each cut flow is done on every row (not just
+rows passing the previous cuts) both ways, row by row and on whole columns,
+and the results are checked to be identical. Prints the time taken each way.
+
+By default, runs on random fake rows (with some NaNs thrown in). Give
+--infile to run on the first --nRows rows of a real ntuple instead.
+
+Author: Nate Woods, U. Wisconsin
+
+'''
+
+import argparse
+import os
+from timeit import default_timer as timer
+
+import numpy as np
+
+from ZZAnalyzer.cuts import getCutClass
+from ZZAnalyzer.utils.helpers import mapObjects, parseChannels
+from ZZAnalyzer.utils.columnar import ColumnReader
+
+
+assert os.environ["zza"], "Run setup.sh before running analysis"
+
+
+_cutSets = [
+    ('BaseCuts2016', [], 'zz'),
+    ('BaseCuts2016', ['HZZ2016'], 'zz'),
+    ('BaseCuts2016', ['SMPZZ2016'], 'zz'),
+    ('BaseCuts2016', ['ControlRegion_OS_2P2F'], 'zz'),
+    ('BaseCuts2016', ['ControlRegion_OS_3P1F'], 'zz'),
+    ('BaseCuts2016', ['ControlRegion_SS'], 'zz'),
+    ('BaseCuts2016', ['ControlRegion_Zplusl', 'SMPZZ2016'], '3l'),
+    ('BaseCuts2016', ['ControlRegion_ZpluslTight', 'SMPZZ2016'], '3l'),
+    ]
+
+
+class FakeBlock(object):
+    '''
+    Acts like a ColumnBlock of random values. Each column is made the first
+    time it's used, from a seed that depends only on its name, so the rows
+    are the same for every cut set.
+    '''
+    _intLike = ['SS', 'Pass', 'Is', 'MatchedStations', 'BestTrackType', 'ZZTightID', 'ZZIso']
+
+    def __init__(self, nRows):
+        self.entries = np.arange(nRows)
+        self._columns = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getattr__(self, name):
+        if name[:1] == '_':
+            raise AttributeError(name)
+        try:
+            return self._columns[name]
+        except KeyError:
+            pass
+
+        rng = np.random.RandomState(sum(ord(c) * (i+1) for i, c in enumerate(name)) % 2**31)
+        if any(s in name for s in self._intLike):
+            col = rng.randint(0, 3, len(self)).astype(np.float64)
+        elif 'Mass' in name:
+            col = rng.uniform(0., 200., len(self))
+        elif 'Eta' in name or 'PVD' in name:
+            col = rng.uniform(-3., 3., len(self))
+        elif 'pv' in name:
+            col = rng.uniform(-30., 30., len(self))
+        else:
+            col = rng.uniform(-1., 40., len(self))
+        col[rng.uniform(size=len(self)) < 0.01] = np.nan
+
+        self._columns[name] = col
+        return col
+
+    def rows(self):
+        for i in xrange(len(self)):
+            yield _FakeRow(self, i)
+
+
+class _FakeRow(object):
+    __slots__ = ('_block', '_i')
+
+    def __init__(self, block, i):
+        self._block = block
+        self._i = i
+
+    def __getattr__(self, name):
+        return float(getattr(self._block, name)[self._i])
+
+
+def getBlock(args, channel):
+    '''
+    Returns (block, list of rows)
+    '''
+    if args.infile:
+        reader = ColumnReader(args.infile, '/'.join([channel, args.ntupleDir]))
+        block = reader.blocks(reader.branchNames, args.nRows, 0,
+                              min(args.nRows, reader.GetEntries())).next()
+    else:
+        block = FakeBlock(args.nRows)
+
+    # reading columns isn't what we're timing, so get them all now
+    rows = [r for r in block.rows()]
+    return block, rows
+
+
+def benchmark(cutter, channel, block, rows):
+    '''
+    Returns the times for [closures on rows, plan on rows, closures on
+    arrays, plan on arrays, compiling the plans] and the number of
+    disagreements.
+    '''
+    objects = mapObjects(channel)
+    orders = [objects]
+    if cutter.needReorder(channel) and len(objects) == 4:
+        orders.append(objects[2:] + objects[:2])
+
+    times = [0.] * 5
+    nBad = 0
+    for order in orders:
+        start = timer()
+        plan = cutter.getCutPlan(order)
+        times[4] += timer() - start
+
+        for cut, (cutName, objNums) in cutter.cutFlow.iteritems():
+            obj = [order[i-1] for i in objNums]
+            closure = cutter.cuts[cutName]
+            arrayClosure = cutter.arrayCuts[cutName]
+            compiled = plan.rowCuts[cut]
+
+            start = timer()
+            old = [bool(closure(r, *obj)) for r in rows]
+            times[0] += timer() - start
+
+            start = timer()
+            new = [bool(compiled(r)) for r in rows]
+            times[1] += timer() - start
+
+            with np.errstate(invalid='ignore'):
+                start = timer()
+                oldArr = np.logical_and(np.ones(len(block), dtype=bool), arrayClosure(block, *obj))
+                times[2] += timer() - start
+
+            start = timer()
+            newArr = plan.arrayCut(block, cut)
+            times[3] += timer() - start
+
+            old = np.array(old, dtype=bool)
+            bad = np.logical_or(old != np.array(new, dtype=bool),
+                                np.logical_or(old != oldArr, old != newArr))
+            if bad.any():
+                print "    {} ({}) disagrees for {} rows".format(cut, ', '.join(order), np.count_nonzero(bad))
+                print "        compiled as {}".format(plan.rowSource(cut))
+                nBad += np.count_nonzero(bad)
+
+    return times, nBad
+
+
+parser = argparse.ArgumentParser(description='Benchmark compiled cut plans against closures.')
+parser.add_argument('--nRows', type=int, default=20000, help='Number of rows to cut on.')
+parser.add_argument('--infile', type=str, default='',
+                    help='Ntuple to take rows from. If not given, fake rows are used.')
+parser.add_argument('--ntupleDir', type=str, default='ntuple',
+                    help='Path to the ntuple in the file, relative to the channel.')
+args = parser.parse_args()
+
+totals = [0.] * 5
+totalBad = 0
+blocks = {}
+for baseCuts, modifiers, channels in _cutSets:
+    cutter = getCutClass(baseCuts, *modifiers)()
+    print "{}:".format(' + '.join(modifiers + [baseCuts]))
+    for channel in parseChannels(channels):
+        if channel not in blocks:
+            blocks[channel] = getBlock(args, channel)
+        times, nBad = benchmark(cutter, channel, *blocks[channel])
+        print "    {:5}  rows: closures {:.3f}s, plan {:.3f}s    arrays: closures {:.4f}s, plan {:.4f}s    compiling: {:.4f}s".format(channel, *times)
+        totals = [t + dt for t, dt in zip(totals, times)]
+        totalBad += nBad
+
+print ""
+print "Total  rows: closures {:.3f}s, plan {:.3f}s ({:.1f}x)".format(totals[0], totals[1], totals[0] / max(totals[1], 1e-9))
+print "     arrays: closures {:.4f}s, plan {:.4f}s ({:.1f}x)".format(totals[2], totals[3], totals[2] / max(totals[3], 1e-9))
+print "  compiling: {:.4f}s".format(totals[4])
+if totalBad:
+    print "{} DISAGREEMENTS between closures and compiled plans!".format(totalBad)
+    exit(1)
+print "All results agree."
@@ -0,0 +1,117 @@
+#!/usr/bin/python
+'''
+
+Compare the two ways NtupleCopier can write passing rows: filling the output
+row by row from the input ntuple's buffer, and collecting the entry numbers
+and copying them all at once when the output is saved. For each pass
+fraction, a random set of rows (the same for both) is saved from one
+channel of a real ntuple, and the time and write throughput are printed.
+The outputs are checked to have the same contents.
+
+Author: Nate Woods, U. Wisconsin
+
+'''
+
+import argparse
+import os
+import shutil
+import tempfile
+from timeit import default_timer as timer
+
+import numpy as np
+from root_numpy import tree2array
+from rootpy.io import root_open
+
+from ZZAnalyzer.results import NtupleCopier
+
+
+assert os.environ["zza"], "Run setup.sh before running analysis"
+
+
+class RowByRowCopier(NtupleCopier):
+    bulkCopy = False
+
+
+def copyRows(Copier, inFile, outFile, channel, ntupleDir, entries):
+    '''
+    Save entries from one channel with Copier. Returns the time taken.
+    '''
+    with root_open(inFile) as f:
+        ntuple = f.Get('/'.join([channel, ntupleDir]))
+        ntuple.create_buffer()
+
+        start = timer()
+        copier = Copier(outFile, **{channel : ntuple})
+        for iRow in entries:
+            ntuple.GetEntry(iRow)
+            copier.saveRow(ntuple, channel)
+        copier.save()
+        return timer() - start
+
+
+def sameArrays(a, b):
+    '''
+    True if a and b have the same type and contents, compared bit for bit
+    so NaNs match. tree2array gives vector branches as object columns of
+    arrays, whose bytes are just pointers, so those are compared element
+    by element.
+    '''
+    if a.dtype != b.dtype or a.shape != b.shape:
+        return False
+    if a.dtype.names:
+        return all(sameArrays(a[name], b[name]) for name in a.dtype.names)
+    if a.dtype.hasobject:
+        return all(sameArrays(np.asarray(x), np.asarray(y)) for x, y in zip(a.ravel(), b.ravel()))
+    return a.tobytes() == b.tobytes()
+
+
+def contents(fileName, channel, ntupleDir):
+    with root_open(fileName) as f:
+        return tree2array(f.Get('/'.join([channel, ntupleDir])))
+
+
+parser = argparse.ArgumentParser(description='Benchmark bulk copying of passing rows against filling row by row.')
+parser.add_argument('infile', type=str, help='Ntuple to copy rows from.')
+parser.add_argument('--channel', type=str, default='eeee', help='Channel to copy.')
+parser.add_argument('--fractions', type=float, nargs='*', default=[0.001, 0.01, 0.1, 0.5, 1.],
+                    help='Fractions of rows to save.')
+parser.add_argument('--ntupleDir', type=str, default='ntuple',
+                    help='Path to the ntuple in the file, relative to the channel.')
+args = parser.parse_args()
+
+with root_open(args.infile) as f:
+    nRows = f.Get('/'.join([args.channel, args.ntupleDir])).GetEntries()
+
+rng = np.random.RandomState(12345)
+tmpDir = tempfile.mkdtemp()
+allSame = True
+try:
+    for frac in args.fractions:
+        entries = np.nonzero(rng.uniform(size=nRows) < frac)[0].tolist()
+        if frac >= 1.:
+            entries = range(nRows)
+
+        outRows = os.path.join(tmpDir, 'rows.root')
+        outBulk = os.path.join(tmpDir, 'bulk.root')
+        tRows = copyRows(RowByRowCopier, args.infile, outRows, args.channel, args.ntupleDir, entries)
+        tBulk = copyRows(NtupleCopier, args.infile, outBulk, args.channel, args.ntupleDir, entries)
+
+        mb = os.path.getsize(outBulk) / 1e6
+        print "Saving {:.1%} ({} rows, {:.1f} MB):".format(frac, len(entries), mb)
+        print "    row by row: {:.2f}s ({:.0f} rows/s, {:.1f} MB/s)".format(tRows, len(entries) / max(tRows, 1e-9),
+                                                                          mb / max(tRows, 1e-9))
+        print "    bulk:       {:.2f}s ({:.0f} rows/s, {:.1f} MB/s)  {:.1f}x faster".format(tBulk, len(entries) / max(tBulk, 1e-9),
+                                                                                            mb / max(tBulk, 1e-9),
+                                                                                            tRows / max(tBulk, 1e-9))
+
+        a = contents(outRows, args.channel, args.ntupleDir)
+        b = contents(outBulk, args.channel, args.ntupleDir)
+        if not sameArrays(a, b):
+            print "    OUTPUTS DIFFER!"
+            allSame = False
+finally:
+    shutil.rmtree(tmpDir)
+
+if not allSame:
+    exit(1)
+print "All outputs are identical."
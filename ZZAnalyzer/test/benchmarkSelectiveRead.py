@@ -0,0 +1,126 @@
+#!/usr/bin/python
+'''
+
+Compare reading every branch of every row to reading only the branches the
+cuts and row cleaner need (Analyzer's selectiveRead mode), by running the
+same analysis on a real ntuple both ways. Prints the time taken and the
+number of bytes read from the file each way, and checks that the output
+ntuples have exactly the same contents and the cut flows are the same.
+
+Author: Nate Woods, U. Wisconsin
+
+'''
+
+import argparse
+import os
+import shutil
+import tempfile
+from timeit import default_timer as timer
+
+import numpy as np
+import ROOT
+from root_numpy import tree2array
+from rootpy.io import root_open
+
+from ZZAnalyzer.analyzers import Analyzer
+from ZZAnalyzer.utils.helpers import parseChannels
+
+
+assert os.environ["zza"], "Run setup.sh before running analysis"
+
+
+def runAnalysis(args, outFile, selectiveRead):
+    '''
+    Returns (time taken, bytes read)
+    '''
+    ROOT.TFile.SetFileBytesRead(0)
+    start = timer()
+    analyzer = Analyzer(args.channels, args.baseCuts, args.infile, outFile,
+                        args.maxEvents, 1000., args.cleanRows,
+                        cutModifiers=args.modifiers, ntupleDir=args.ntupleDir,
+                        selectiveRead=selectiveRead)
+    analyzer.analyze()
+    return timer() - start, ROOT.TFile.GetFileBytesRead()
+
+
+def sameArrays(a, b):
+    '''
+    True if a and b have the same type and contents, compared bit for bit
+    so NaNs match. tree2array gives vector branches as object columns of
+    arrays, whose bytes are just pointers, so those are compared element
+    by element.
+    '''
+    if a.dtype != b.dtype or a.shape != b.shape:
+        return False
+    if a.dtype.names:
+        return all(sameArrays(a[name], b[name]) for name in a.dtype.names)
+    if a.dtype.hasobject:
+        return all(sameArrays(np.asarray(x), np.asarray(y)) for x, y in zip(a.ravel(), b.ravel()))
+    return a.tobytes() == b.tobytes()
+
+
+def sameContents(fileA, fileB, channels, ntupleDir):
+    '''
+    True if every output ntuple has the same rows in both files (see
+    sameArrays()). The files themselves can't be compared directly
+    because ROOT stores the time they were made.
+    '''
+    same = True
+    with root_open(fileA) as fA:
+        with root_open(fileB) as fB:
+            for channel in channels:
+                path = '/'.join([channel, ntupleDir])
+                try:
+                    a = tree2array(fA.Get(path))
+                    b = tree2array(fB.Get(path))
+                except Exception: # no output for this channel
+                    continue
+                if not sameArrays(a, b):
+                    print "    {} ntuples differ!".format(channel)
+                    same = False
+    return same
+
+
+parser = argparse.ArgumentParser(description='Benchmark reading only the needed branches against reading everything.')
+parser.add_argument('infile', type=str, help='Ntuple to run on.')
+parser.add_argument('--channels', type=str, default='zz', help='Channels to run on.')
+parser.add_argument('--baseCuts', type=str, default='BaseCuts2016', help='Cut set.')
+parser.add_argument('--modifiers', type=str, nargs='*', default=[], help='Cut modifiers.')
+parser.add_argument('--cleanRows', type=str, default='', help='Row cleaner, if any.')
+parser.add_argument('--maxEvents', type=float, default=float('inf'),
+                    help='Number of rows of each channel to run on.')
+parser.add_argument('--ntupleDir', type=str, default='ntuple',
+                    help='Path to the ntuple in the file, relative to the channel.')
+args = parser.parse_args()
+
+tmpDir = tempfile.mkdtemp()
+try:
+    outFull = os.path.join(tmpDir, 'full.root')
+    outSelective = os.path.join(tmpDir, 'selective.root')
+
+    # first read can be slow because the file isn't in the page cache yet
+    runAnalysis(args, os.path.join(tmpDir, 'warmup.root'), False)
+
+    tFull, bytesFull = runAnalysis(args, outFull, False)
+    tSelective, bytesSelective = runAnalysis(args, outSelective, True)
+
+    print ""
+    print "All branches:    {:.2f}s, {:.1f} MB read".format(tFull, bytesFull / 1e6)
+    print "Needed branches: {:.2f}s, {:.1f} MB read".format(tSelective, bytesSelective / 1e6)
+    print "Saved {:.2f}s ({:.1f}x faster), {:.1f} MB ({:.0f}% less)".format(tFull - tSelective,
+                                                                             tFull / max(tSelective, 1e-9),
+                                                                             (bytesFull - bytesSelective) / 1e6,
+                                                                             100. * (bytesFull - bytesSelective) / max(bytesFull, 1))
+
+    same = sameContents(outFull, outSelective, parseChannels(args.channels), args.ntupleDir)
+    with open(outFull.replace('.root', '.txt')) as fA:
+        with open(outSelective.replace('.root', '.txt')) as fB:
+            if fA.read() != fB.read():
+                print "Cut flows differ!"
+                same = False
+finally:
+    shutil.rmtree(tmpDir)
+
+if not same:
+    exit(1)
+print "Outputs are identical."
@@ -12,13 +12,12 @@ import multiprocessing
 import argparse
 import os
 import signal
-import time
 
 from rootpy.plotting import Hist
 from rootpy import ROOT
 
 from ZZAnalyzer.metadata.analyses import *
-from ZZAnalyzer.analyzers import AnalysisManager
+from ZZAnalyzer.analyzers import AnalysisManager, AnalysisScheduler
 
 ROOT.gROOT.SetBatch(True)
 
@@ -65,6 +64,18 @@ parser.add_argument('--noSIP', action='store_true',
                     help="Don't do lepton SIP cuts.")
 parser.add_argument('--looseSIP', action='store_true',
                     help="Use looser lepton SIP cut (currently 10 instead of 4).")
+parser.add_argument('--sharedScan', action='store_true',
+                    help="Run analyses that use the same input file together, reading it only once.")
+parser.add_argument('--columnar', action='store_true',
+                    help="Do cuts on whole chunks of rows at once with NumPy instead of looping over rows.")
+parser.add_argument('--retries', type=int, default=1,
+                    help='Number of times to try an analysis again if it fails.')
+parser.add_argument('--cache', action='store_true',
+                    help="Don't rerun analyses whose input, settings and code haven't changed since last time.")
+parser.add_argument('--profile', action='store_true',
+                    help="Time each cut and stage of every job, and add up the times for each analysis.")
+parser.add_argument('--selectiveRead', action='store_true',
+                    help="Only read the branches the cuts need, except for rows that get saved.")
 
 # we have to create some ROOT object to get ROOT's metadata system setup before the threads start
 # or else we get segfault-causing race conditions
@@ -107,6 +118,21 @@ if args.looseSIP:
     for ana in zAnalyses:
         zAnalyses[ana]['cutModifiers'].insert(0,'LooseSIP')
 
+if args.columnar:
+    for anaSet in [zzAnalyses, zlAnalyses, zAnalyses]:
+        for ana in anaSet:
+            anaSet[ana]['columnar'] = True
+
+if args.profile:
+    for anaSet in [zzAnalyses, zlAnalyses, zAnalyses]:
+        for ana in anaSet:
+            anaSet[ana]['profile'] = True
+
+if args.selectiveRead:
+    for anaSet in [zzAnalyses, zlAnalyses, zAnalyses]:
+        for ana in anaSet:
+            anaSet[ana]['selectiveRead'] = True
+
 desiredZZResultsData = []
 desiredZZResultsMC = []
 
@@ -165,65 +191,82 @@ desiredZResults = ['singleZ']
 for sampleID in args.zzData:
     inputs = os.path.join(pathStart, "uwvvNtuples_data_"+sampleID)
     man = AnalysisManager(zzAnalyses, inputs, pool, args.channels,
-                          args.assumeInputExists, args.Spring16)
+                          args.assumeInputExists, args.Spring16,
+                          args.sharedScan, args.cache)
     man.addAnalyses(*desiredZZResultsData)
     managers.append(man)
 
 for sampleID in args.zlData:
     inputs = os.path.join(pathStart, "uwvvZPlusl_data_"+sampleID)
     man = AnalysisManager(zlAnalyses, inputs, pool, '3l',
-                          args.assumeInputExists, args.Spring16)
+                          args.assumeInputExists, args.Spring16,
+                          args.sharedScan, args.cache)
     man.addAnalyses(*desiredZLResults)
     managers.append(man)
 
 for sampleID in args.zData:
     inputs = os.path.join(pathStart, "uwvvSingleZ_data_"+sampleID)
     man = AnalysisManager(zAnalyses, inputs, pool, 'z',
-                          args.assumeInputExists, args.Spring16)
+                          args.assumeInputExists, args.Spring16,
+                          args.sharedScan, args.cache)
     man.addAnalyses(*desiredZResults)
     managers.append(man)
 
 for sampleID in args.zzMC:
     inputs = os.path.join(pathStart, "uwvvNtuples_mc_"+sampleID)
     man = AnalysisManager(zzAnalyses, inputs, pool, args.channels,
-                          args.assumeInputExists, args.Spring16)
+                          args.assumeInputExists, args.Spring16,
+                          args.sharedScan, args.cache)
     man.addAnalyses(*desiredZZResultsMC)
     managers.append(man)
 
 for sampleID in args.zlMC:
     inputs = os.path.join(pathStart, "uwvvZPlusl_mc_"+sampleID)
     man = AnalysisManager(zlAnalyses, inputs, pool, '3l',
-                          args.assumeInputExists, args.Spring16)
+                          args.assumeInputExists, args.Spring16,
+                          args.sharedScan, args.cache)
     man.addAnalyses(*desiredZLResults)
     managers.append(man)
 
 for sampleID in args.zMC:
     inputs = os.path.join(pathStart, "uwvvSingleZ_mc_"+sampleID)
     man = AnalysisManager(zAnalyses, inputs, pool, 'z',
-                          args.assumeInputExists, args.Spring16)
+                          args.assumeInputExists, args.Spring16,
+                          args.sharedScan, args.cache)
     man.addAnalyses(*desiredZResults)
     managers.append(man)
 
 
 
 # A little trickery to make keyboard interrupts work
+scheduler = AnalysisScheduler(pool, nThreads, args.retries)
+for man in managers:
+    scheduler.addManager(man)
+
 try:
-    while True:
-        results = [m.runReady() for m in managers]
-        if not any(results):
-            break
-        time.sleep(5)
+    allWorked = scheduler.run()
 except KeyboardInterrupt:
     pool.terminate()
     pool.join()
     print "\nKilled ZZ Analyzers"
     exit(1)
 else:
-    pool.close()
+    if scheduler.workersDied:
+        # the pool would wait forever for the jobs of dead workers
+        pool.terminate()
+    else:
+        pool.close()
     pool.join()
 
+if args.profile:
+    for m in managers:
+        m.writeProfileSummary()
+
 print "Done!"
 
+if not allWorked:
+    exit(1)
+
 
 
 
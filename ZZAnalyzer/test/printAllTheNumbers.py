@@ -17,15 +17,16 @@ rlog["/rootpy.compiled"].setLevel(rlog.WARNING)
 
 
 from ZZAnalyzer.plotting import NtuplePlotter
-from ZZAnalyzer.utils import WeightStringMaker, TPFunctionManager, BkgManager
+from ZZAnalyzer.utils import WeightStringMaker, TPFunctionManager, BkgManager, WeightVariations
 
 from rootpy.io import root_open
 import rootpy.compiled as C
-from rootpy.plotting import HistStack, Canvas
+from rootpy.plotting import Canvas
 from rootpy.ROOT import Double
 
 import os
 from math import sqrt
+from collections import OrderedDict
 from datetime import date
 
 from argparse import ArgumentParser
@@ -166,36 +167,99 @@ for s in plotter.ntuples['mc3P1F']:
     #if s[:7] == 'GluGluT' or s[:3] == 'ZZT':
         subtractSamples.append(s)
 
-central = {}        
-for scaleSet in [['', '', ''], # [id, iso, PU]
-                 ['down', '', ''], ['up', '', ''],
-                 ['', 'down', ''], ['', 'up', ''],
-                 ['', '', 'down'], ['', '', 'up']]:
+# [id, iso, PU] scales for each weight variation, nominal first
+scaleSets = OrderedDict([
+    ('', ['', '', '']),
+    ('IDdown', ['down', '', '']), ('IDup', ['up', '', '']),
+    ('Isodown', ['', 'down', '']), ('Isoup', ['', 'up', '']),
+    ('PUdown', ['', '', 'down']), ('PUup', ['', '', 'up']),
+    ])
 
+def mcWeightStrings(scaleSet):
     z1eMCWeight = '*'.join(TP.getTPString('e%d'%ne, 'TightID', scaleSet[0])+'*'+TP.getTPString('e%d'%ne, 'IsoTight', scaleSet[1]) for ne in range(1,3))
     z2eMCWeight = '*'.join(TP.getTPString('e%d'%ne, 'TightID', scaleSet[0])+'*'+TP.getTPString('e%d'%ne, 'IsoTight', scaleSet[1]) for ne in range(3,5))
     z1mMCWeight = '*'.join(TP.getTPString('m%d'%nm, 'TightID', scaleSet[0])+'*'+TP.getTPString('m%d'%nm, 'IsoTight', scaleSet[1]) for nm in range(1,3))
     z2mMCWeight = '*'.join(TP.getTPString('m%d'%nm, 'TightID', scaleSet[0])+'*'+TP.getTPString('m%d'%nm, 'IsoTight', scaleSet[1]) for nm in range(3,5))
     
-    
-    mcWeight = {
+    return {
         'eeee' : '(GenWeight*{0}*{1}*{2})'.format(puScaleFactorStr[scaleSet[2]], z1eMCWeight, z2eMCWeight),
         'eemm' : '(GenWeight*{0}*{1}*{2})'.format(puScaleFactorStr[scaleSet[2]], z1eMCWeight, z1mMCWeight),
         'mmmm' : '(GenWeight*{0}*{1}*{2})'.format(puScaleFactorStr[scaleSet[2]], z1mMCWeight, z2mMCWeight),
     }
 
-    cr3PScaleMC = {c:'*'.join([mcWeight[c], cr3PScale[c]]) for c in mcWeight}
-    cr2PScaleMC = {c:'*'.join([mcWeight[c], cr2PScale[c]]) for c in mcWeight}
-    cr2PMigrationScaleMC = {c:'*'.join([mcWeight[c], 
-                                        cr2PMigrationScale[c]])
-                            for c in mcWeight}
-                 
-    mcWeight['zz'] = [mcWeight['eeee'], mcWeight['eemm'], mcWeight['mmmm']]
-    cr3PScaleMC['zz'] = [cr3PScaleMC[c] for c in ['eeee','eemm','mmmm']]
-    cr2PScaleMC['zz'] = [cr2PScaleMC[c] for c in ['eeee','eemm','mmmm']]
-    cr2PMigrationScaleMC['zz'] = [cr2PMigrationScaleMC[c] for c in ['eeee',
-                                                                    'eemm',
-                                                                    'mmmm']]
+mcWeights = OrderedDict((name, mcWeightStrings(ss)) for name, ss in scaleSets.iteritems())
+
+# all variations of each weight, so they can all be filled in one pass
+mcWeight = {
+    c : WeightVariations(mcWeights[''][c], 
+                         [(name, mcWeights[name][c]) for name in scaleSets.keys()[1:]]) 
+    for c in ['eeee','eemm','mmmm']
+}
+cr3PScaleMC = {c:mcWeight[c].times(cr3PScale[c]) for c in mcWeight}
+# 2P2F migration only needs the nominal weight; it rides along with 2P2F
+cr2PScaleMC = {c:mcWeight[c].times(cr2PScale[c]).add('migration',
+                                                      '*'.join([mcWeights[''][c], 
+                                                                cr2PMigrationScale[c]]))
+               for c in mcWeight}
+
+mcWeight['zz'] = [mcWeight['eeee'], mcWeight['eemm'], mcWeight['mmmm']]
+cr3PScaleMC['zz'] = [cr3PScaleMC[c] for c in ['eeee','eemm','mmmm']]
+cr2PScaleMC['zz'] = [cr2PScaleMC[c] for c in ['eeee','eemm','mmmm']]
+
+# Book everything up front, so each ntuple is read once for all channels 
+# and variations
+bins=[1,0.,2.]
+cr3P1FHists = {}
+cr2P2FHists = {}
+cr2P2FMigrationHists = {}
+sub3PHists = {}
+sub2PHists = {}
+mcHists = {}
+dataHists = {}
+for channel in ['zz', 'eeee', 'eemm', 'mmmm']:
+    # data CR weights don't change with the MC scales, but each variation
+    # gets its own copy to subtract from
+    cr3P1FHists[channel] = {
+        name : plotter.bookHist('3P1F', '3P1F', channel, '1.', basicSelection, 
+                                bins, weights=cr3PScale[channel], 
+                                perUnitWidth=False, nameForLegend='Z+X (From Data)',
+                                isBackground=True) for name in scaleSets
+        }
+    cr2P2FHists[channel] = {
+        name : plotter.bookHist('2P2F', '2P2F', channel, '1.', basicSelection, 
+                                bins, weights=cr2PScale[channel], 
+                                perUnitWidth=False, nameForLegend='Z+X (From Data)',
+                                isBackground=True) for name in scaleSets
+        }
+    cr2P2FMigrationHists[channel] = plotter.bookHist('2P2F', '2P2F', channel, '1.', 
+                                                     basicSelection, bins, 
+                                                     weights=cr2PMigrationScale[channel],
+                                                     perUnitWidth=False, 
+                                                     nameForLegend='Z+X (From Data)',
+                                                     isBackground=True)
+    sub3PHists[channel] = {
+        ss : plotter.bookHistVariations("mc3P1F", ss, channel, '1.', 
+                                        basicSelection, bins, 
+                                        cr3PScaleMC[channel], 
+                                        perUnitWidth=False) for ss in subtractSamples
+        }
+    sub2PHists[channel] = {
+        ss : plotter.bookHistVariations("mc2P2F", ss, channel, '1.', 
+                                        basicSelection, bins, 
+                                        cr2PScaleMC[channel], 
+                                        perUnitWidth=False) for ss in subtractSamples
+        }
+    mcHists[channel] = {
+        s : plotter.bookHistVariations('mc', s, channel, '1.', basicSelection, 
+                                       bins, mcWeight[channel], 1.) 
+        for s in plotter.ntuples['mc']
+        }
+    dataHists[channel] = plotter.bookHist('data', 'data', channel, '1.', 
+                                          basicSelection, bins)
+plotter.fillBooked()
+
+central = {}        
+for scaleName, scaleSet in scaleSets.iteritems():
 
     print ''
     if scaleSet[0]:
@@ -209,17 +273,10 @@ for scaleSet in [['', '', ''], # [id, iso, PU]
                  
     checkMigration = not any(scaleSet)
 
-    bins=[1,0.,2.]
     for channel in ['zz', 'eeee', 'eemm', 'mmmm']:
 
-        cr3P1F = plotter.makeHist('3P1F', '3P1F', channel, '1.', basicSelection, 
-                                  bins, weights=cr3PScale[channel], 
-                                  perUnitWidth=False, nameForLegend='Z+X (From Data)',
-                                  isBackground=True)
-        cr2P2F = plotter.makeHist('2P2F', '2P2F', channel, '1.', basicSelection, 
-                                  bins, weights=cr2PScale[channel], 
-                                  perUnitWidth=False, nameForLegend='Z+X (From Data)',
-                                  isBackground=True)
+        cr3P1F = cr3P1FHists[channel][scaleName].get()
+        cr2P2F = cr2P2FHists[channel][scaleName].get()
         
         cr3P1F.sumw2()
         cr2P2F.sumw2()
@@ -229,31 +286,17 @@ for scaleSet in [['', '', ''], # [id, iso, PU]
         # print "        3P1F: %f  2P2F: %f"%(cr3P1F.Integral(), cr2P2F.Integral())
 
         if checkMigration:
-            cr2P2FMigration = plotter.makeHist('2P2F', '2P2F', channel, '1.', 
-                                               basicSelection, bins, 
-                                               weights=cr2PMigrationScale[channel],
-                                               perUnitWidth=False, 
-                                               nameForLegend='Z+X (From Data)',
-                                               isBackground=True)
+            cr2P2FMigration = cr2P2FMigrationHists[channel].get()
             cr2P2FMigration.sumw2()
 
         for ss in subtractSamples:
-            sub3P = plotter.makeHist("mc3P1F", ss, channel,
-                                     '1.', basicSelection, bins,
-                                     weights=cr3PScaleMC[channel],
-                                     perUnitWidth=False)
+            sub3P = sub3PHists[channel][ss][scaleName].get()
             cr3P1F -= sub3P
-            sub2P = plotter.makeHist("mc2P2F", ss, channel,
-                                     '1.', basicSelection, bins,
-                                     weights=cr2PScaleMC[channel],
-                                     perUnitWidth=False)
+            sub2P = sub2PHists[channel][ss][scaleName].get()
             cr2P2F -= sub2P
 
             if checkMigration:
-                sub2PMigration = plotter.makeHist("mc2P2F", ss, channel,
-                                                  '1.', basicSelection, bins,
-                                                  weights=cr2PMigrationScaleMC[channel],
-                                                  perUnitWidth=False)
+                sub2PMigration = sub2PHists[channel][ss]['migration'].get()
                 cr2P2FMigration -= sub2PMigration
                 cr2P2FMigration.sumw2()
 
@@ -310,20 +353,19 @@ for scaleSet in [['', '', ''], # [id, iso, PU]
             expectedMigration = integral2P2FMigration - integral2P2F
             expectedErrorMigration = sqrt(expectedError2P2FMigration**2. + expectedError2P2F**2)
 
-        plotter.fullPlot('count_%s_ID%s_Iso%s_PU%s'%(channel,scaleSet[0], 
-                                                     scaleSet[1], scaleSet[2]),
-                         channel, '1.', basicSelection, 
-                         bins, 'mc', 'data', canvasX=1000, logy=False, 
-                         xTitle="one", 
-                         xUnits="",
-                         extraBkgs=[cr3P1F], outFile='count_%s_ID%s_Iso%s_PU%s.png'%(channel,scaleSet[0], scaleSet[1], scaleSet[2]), 
-                         mcWeights=mcWeight[channel])
-        for ob in plotter.drawings['count_%s_ID%s_Iso%s_PU%s'%(channel,scaleSet[0], scaleSet[1], scaleSet[2])].objects:
-            if isinstance(ob, HistStack):
-                mcStack = ob
-                break
-
-        expectedTotal = sum(mcStack.hists)
+        # stack the hists filled above instead of drawing the MC again for 
+        # every variation
+        mcSampleNames = mcHists[channel].keys()
+        mcStack = plotter.stackHists('mc', mcSampleNames, 
+                                     [mcHists[channel][smp][scaleName].get() for smp in mcSampleNames], 
+                                     '1.', basicSelection, extraHists=[cr3P1F])
+        plotter.stackPlot('count_%s_ID%s_Iso%s_PU%s'%(channel,scaleSet[0], 
+                                                      scaleSet[1], scaleSet[2]),
+                          mcStack, dataHists[channel].get(), canvasX=1000, 
+                          logy=False, xTitle="one", xUnits="",
+                          outFile='count_%s_ID%s_Iso%s_PU%s.png'%(channel,scaleSet[0], scaleSet[1], scaleSet[2]))
+
+        expectedTotal = sum([cr3P1F] + [hs[scaleName].get() for hs in mcHists[channel].values()])
         expectedTotal.sumw2()
         expectedError = Double(0)
         integralTot = expectedTotal.IntegralAndError(0,expectedTotal.GetNbinsX(), expectedError)
@@ -27,9 +27,66 @@ from rootpy.plotting.hist import _Hist, _Hist2D, _Hist3D
 
 from ZZAnalyzer.plotting import NtuplePlotter
 from ZZAnalyzer.utils.helpers import parseChannels, mapObjects
+from ZZAnalyzer.utils.histLookup import HistLookup
 
 from itertools import chain as iChain
 
+import numpy as np
+
+
+def _histArrays(h):
+    '''
+    (contents, errors) of every bin of h, including under- and overflow, 
+    as arrays in ROOT's global bin order.
+    '''
+    lookup = HistLookup(h)
+    return lookup.values.copy(), lookup.errors.copy()
+
+
+def _setHistArrays(h, values, errors):
+    for i, (v, e) in enumerate(zip(values, errors)):
+        h.SetBinContent(i, v)
+        h.SetBinError(i, e)
+
+
+def _flowMask(h):
+    '''
+    Array that's True for the under- and overflow bins of h, in global bin
+    order.
+    '''
+    axes = HistLookup(h).axes
+    shape = [n + 2 for n, lo, hi, edges in axes][::-1] # z, y, x
+    indices = np.unravel_index(np.arange(np.prod(shape)), shape)
+    out = np.zeros(np.prod(shape), dtype=bool)
+    for ind, n in zip(indices, shape):
+        out |= (ind == 0) | (ind == n - 1)
+    return out
+
+
+def _subtractArrays(values, errors, subValues, subErrors):
+    '''
+    Bin contents and errors of h1 - h2, like TH1::Add(h2, -1.).
+    '''
+    return values - subValues, np.sqrt(errors * errors + subErrors * subErrors)
+
+
+def _divideArrays(num, numErrors, denom, denomErrors):
+    '''
+    Bin contents and errors of num / denom, like TH1::Divide() (bins with
+    an empty denominator are 0).
+    '''
+    values = np.zeros_like(num)
+    errors = np.zeros_like(num)
+    ok = denom != 0.
+
+    c1 = num[ok]
+    c2 = denom[ok]
+    c2sq = c2 * c2
+    values[ok] = c1 / c2
+    errors[ok] = np.sqrt((numErrors[ok]**2 * c2sq + denomErrors[ok]**2 * c1 * c1) / 
+                         (c2sq * c2sq))
+    return values, errors
+
 
 class FakeRateCalculator(object):
     def __init__(self, looseFilesData, tightFilesData, 
@@ -74,19 +131,12 @@ class FakeRateCalculator(object):
             self.plotter.WrappedStack,
             self.plotter.WrappedHist3, # THistStack only goes up to 2-D
             ]
-        self.histMakers = [
-            lambda *args, **kwargs: self.plotter.makeHist(*args, 
+        self.histBookers = [
+            lambda *args, **kwargs: self.plotter.bookHist(*args, 
                                                            perUnitWidth=False, 
                                                            **kwargs),
-            self.plotter.makeHist2,
-            self.plotter.makeHist3,
-            ]
-        self.stackMakers = [
-            lambda *args, **kwargs: self.plotter.makeStack(*args,
-                                                            perUnitWidth=False,
-                                                            **kwargs),
-            self.plotter.makeStack2, # THistStack same for 1- and 2-D
-            self.plotter.makeStack3,
+            self.plotter.bookHist2,
+            self.plotter.bookHist3,
             ]
         self.extractHistFromStack = [
             lambda s: self.WrappedHists[0](asrootpy(s.GetStack().Last()),
@@ -101,6 +151,7 @@ class FakeRateCalculator(object):
             ]
                                            
         self.outputs = []
+        self.booked = [] # fake rates waiting for calculateBooked()
 
         self.fakeFactor = fakeFactor
 
@@ -124,6 +175,43 @@ class FakeRateCalculator(object):
         denominator before the fake rate is calculated. No bin may be less 
         than 0.
         '''
+        finish = self.setUpFakeRate(name, channels, *varsAndBinnings, **kwargs)
+        self.plotter.fillBooked()
+        return finish()
+
+
+    def bookFakeRate(self, name, channels, *varsAndBinnings, **kwargs):
+        '''
+        Like calculateFakeRate(), but only book the histograms it needs. All
+        booked fake rates are calculated together by calculateBooked(), which
+        reads each ntuple once for all of them.
+        '''
+        self.booked.append(self.setUpFakeRate(name, channels, *varsAndBinnings,
+                                              **kwargs))
+
+
+    def calculateBooked(self):
+        '''
+        Fill the histograms for every booked fake rate in one pass over each
+        ntuple, then calculate the fake rates. They are stored in
+        self.outputs, in the order they were booked, and returned.
+        '''
+        self.plotter.fillBooked()
+
+        outputs = []
+        for finish in self.booked:
+            outputs += finish()
+        self.booked = []
+
+        return outputs
+
+
+    def setUpFakeRate(self, name, channels, *varsAndBinnings, **kwargs):
+        '''
+        Book the numerator and denominator histograms for a fake rate (see
+        calculateFakeRate() for arguments), and return a function that 
+        calculates and returns the fake rate(s) once they're filled.
+        '''
         subtractSamples = kwargs.pop('subtractSamples', [])
 
         if len(varsAndBinnings) % 2 == 1 or len(varsAndBinnings) < 2 or len(varsAndBinnings) > 6:
@@ -146,110 +234,140 @@ class FakeRateCalculator(object):
         varList = [varTemplate.format(self.fakeObjectForChannel(ch)) for ch in channels]
         selecList = ["" for v in varList]
 
-        outputs = []
-        drawablesMC = {}
+        book = self.histBookers[nDims-1]
+
+        bookedMC = {}
         if self.hasMC:
             samplesToDraw = [s for s in self.plotter.ntuples['numMC'].keys() if s not in subtractSamples]
+            for typ in ['num', 'denom']:
+                bookedMC[typ] = [book(typ+"MC", s, channels, varList, 
+                                      selecList, binning, 1., "GenWeight") 
+                                 for s in samplesToDraw]
 
-            sNum = self.stackMakers[nDims-1]("numMC", samplesToDraw, channels, 
-                                             varList, selecList, binning, 
-                                             weight="GenWeight")
-            drawablesMC['num'] = sNum
-            numMC = self.extractHistFromStack[nDims-1](sNum)
-            sDenom = self.stackMakers[nDims-1]("denomMC", samplesToDraw, 
-                                               channels, varList,
-                                               selecList, binning, 
-                                               weight="GenWeight")
-            drawablesMC['denom'] = sDenom
-            denomMC = self.extractHistFromStack[nDims-1](sDenom)
-            
-            fMC = self.WrappedHists[nDims-1](asrootpy(numMC.Clone()),
-                                             name=name+"MC_fakeRate",
-                                             isData=False)
-            fMC.Divide(denomMC)
-            drawablesMC['fakeRate'] = fMC
-
-            if self.fakeFactor:
-                # actual scale factor, f/(1-f)
-                outMC = self.WrappedHists[nDims-1](asrootpy(numMC.empty_clone()),
-                                                   name=name+"MC")
-                for fb, b in zip(fMC, outMC):
-                    if b.overflow:
-                        continue
-                    b.value = fb.value / (1. - fb.value)
-            else:
-                outMC = self.WrappedHists[nDims-1](fMC.clone(), name=name+"MC")
-                for b in outMC:
-                    if b.overflow:
-                        b.value = 0.
-                        b.error = 0.
-
-            outputs.append(outMC)
-
-        drawablesData = {}
+        bookedData = {}
         if self.hasData:
-            num = self.histMakers[nDims-1]("num", "num", channels, varList, 
-                                           selecList, binning)
-            denom = self.histMakers[nDims-1]("denom", "denom", channels, varList, 
-                                             selecList, binning)
-
-            num.sumw2()
-            denom.sumw2()
-
-            for ss in subtractSamples:
-                subNum = self.histMakers[nDims-1]("numMC", ss, channels,
-                                                  varList, selecList, binning,
-                                                  1., weights="GenWeight")
-                num -= subNum
-                subDenom = self.histMakers[nDims-1]("denomMC", ss, channels,
-                                                    varList, selecList, binning,
-                                                    1., weights="GenWeight")
-                denom -= subDenom
-
-            for bNum, bDenom in zip(num, denom):
-                if bNum.value < 0. or bDenom.value <= 0.:
-                    bNum.value = 0.
-                    bNum.error = 0.
-                    bDenom.value = 0.0000001
-                    bDenom.error = 0.
-            
-            num.sumw2()
-            denom.sumw2()
-
-            f = self.WrappedHists[nDims-1](asrootpy(num.Clone()),
-                                           name=name+"_fakeRate")
-            f.Divide(denom)
-            drawablesData['num'] = num
-            drawablesData['denom'] = denom
-            drawablesData['fakeRate'] = f
-
-            if self.fakeFactor:
-                out = self.WrappedHists[nDims-1](asrootpy(num.empty_clone()),
-                                                 name=name)
-                for fb, b in zip(f, out):
-                    if b.overflow:
-                        continue
-                    b.value = fb.value / (1. - fb.value)
-            else:
-                out = self.WrappedHists[nDims-1](f.clone(), name=name)
-                for b in out:
-                    if b.overflow:
-                        b.value = 0.
-                        b.error = 0.
-
-            outputs.append(out)
-
-        for o in outputs:
-            for i in xrange(nDims):
-                o.axis(i).title = varsAndBinnings[i*2]
-
-        if kwargs.pop('draw', False):
-            self.drawFakeRate(name, nDims, drawablesData, drawablesMC, **kwargs)
-
-        self.outputs += outputs
-        return outputs
-        
-       
+            for typ in ['num', 'denom']:
+                bookedData[typ] = book(typ, typ, channels, varList, selecList, 
+                                       binning)
+                bookedData[typ+'Sub'] = [book(typ+"MC", ss, channels, varList, 
+                                              selecList, binning, 1., 
+                                              weights="GenWeight") 
+                                         for ss in subtractSamples]
+
+        def finish():
+            outputs = []
+            drawablesMC = {}
+            if self.hasMC:
+                for typ in ['num', 'denom']:
+                    drawablesMC[typ] = self.stackFromHists(nDims, typ+"MC", samplesToDraw,
+                                                           [b.get() for b in bookedMC[typ]],
+                                                           varList, selecList)
+                numMC = self.extractHistFromStack[nDims-1](drawablesMC['num'])
+                denomMC = self.extractHistFromStack[nDims-1](drawablesMC['denom'])
+
+                fMC = self.WrappedHists[nDims-1](asrootpy(numMC.Clone()),
+                                                 name=name+"MC_fakeRate",
+                                                 isData=False)
+                _setHistArrays(fMC, *_divideArrays(*(_histArrays(numMC) + 
+                                                     _histArrays(denomMC))))
+                drawablesMC['fakeRate'] = fMC
+
+                outputs.append(self.fakeRateOutput(name+"MC", fMC, numMC))
+
+            drawablesData = {}
+            if self.hasData:
+                num = bookedData['num'].get()
+                denom = bookedData['denom'].get()
+
+                num.sumw2()
+                denom.sumw2()
+
+                # subtract MC and zero out bad bins as arrays
+                numVals, numErrs = _histArrays(num)
+                denomVals, denomErrs = _histArrays(denom)
+                for bNum, bDenom in zip(bookedData['numSub'], bookedData['denomSub']):
+                    numVals, numErrs = _subtractArrays(numVals, numErrs, 
+                                                       *_histArrays(bNum.get()))
+                    denomVals, denomErrs = _subtractArrays(denomVals, denomErrs,
+                                                           *_histArrays(bDenom.get()))
+
+                bad = (numVals < 0.) | (denomVals <= 0.)
+                numVals[bad] = 0.
+                numErrs[bad] = 0.
+                denomVals[bad] = 0.0000001
+                denomErrs[bad] = 0.
+
+                _setHistArrays(num, numVals, numErrs)
+                _setHistArrays(denom, denomVals, denomErrs)
+
+                num.sumw2()
+                denom.sumw2()
+
+                f = self.WrappedHists[nDims-1](asrootpy(num.Clone()),
+                                               name=name+"_fakeRate")
+                _setHistArrays(f, *_divideArrays(numVals, numErrs, 
+                                                 denomVals, denomErrs))
+                drawablesData['num'] = num
+                drawablesData['denom'] = denom
+                drawablesData['fakeRate'] = f
+
+                outputs.append(self.fakeRateOutput(name, f, num))
+
+            for o in outputs:
+                for i in xrange(nDims):
+                    o.axis(i).title = varsAndBinnings[i*2]
+
+            if kwargs.pop('draw', False):
+                self.drawFakeRate(name, nDims, drawablesData, drawablesMC, **kwargs)
+
+            self.outputs += outputs
+            return outputs
+
+        return finish
+
+
+    def stackFromHists(self, nDims, category, samples, hists, variable,
+                       selection):
+        '''
+        Stack (or for 3-D, sum) filled histograms the way the plotter's
+        makeStack(), makeStack2() or makeStack3() would.
+        '''
+        if nDims == 1:
+            return self.plotter.stackHists(category, samples, hists, variable,
+                                           selection)
+        if nDims == 2:
+            return self.WrappedStacks[1](self.plotter.orderForStack(hists),
+                                         category=category, variable=variable,
+                                         selection=selection)
+        s = hists[0].empty_clone()
+        for h in hists:
+            s += h
+        return s
+
+
+    def fakeRateOutput(self, name, f, template):
+        '''
+        Histogram to save for fake rate f: f, or f/(1-f) if this is making
+        fake factors, with under- and overflow bins zeroed.
+        '''
+        values, errors = _histArrays(f)
+        inRange = ~_flowMask(f)
+
+        if self.fakeFactor:
+            # actual scale factor, f/(1-f)
+            out = self.WrappedHists[template.GetDimension()-1](asrootpy(template.empty_clone()),
+                                                               name=name)
+            factors = values[inRange] / (1. - values[inRange])
+            for i, v in zip(np.flatnonzero(inRange), factors):
+                out.SetBinContent(int(i), v)
+        else:
+            out = self.WrappedHists[template.GetDimension()-1](f.clone(), name=name)
+            _setHistArrays(out, np.where(inRange, values, 0.), 
+                           np.where(inRange, errors, 0.))
+
+        return out
+
+
     def drawFakeRate(self, name, nDims, drawablesData, drawablesMC, **kwargs):
         '''
         Create a .png with the fake rate plot, with numbers superimposed over 
@@ -439,23 +557,26 @@ if __name__ == '__main__':
             objToPrint = obj[0]+'_'+chs[0]
         else:
             objToPrint = obj[0]
-        calc.calculateFakeRate(objToPrint+'_FakeRate', chs,
+        calc.bookFakeRate(objToPrint+'_FakeRate', chs,
                                'Pt', ptBinning, 'Eta', etaBinning,
                                draw=args.paint,
                                subtractSamples=samplesToSubtract,
                                xTitle='p_{T}', xUnits='GeV',
                                yTitle='\\eta')
-        calc.calculateFakeRate(objToPrint+'_FakeRatePt', chs,
+        calc.bookFakeRate(objToPrint+'_FakeRatePt', chs,
                                'Pt', ptBinning,
                                subtractSamples=samplesToSubtract,
                                draw=args.paint,
                                xTitle='p_{T}', xUnits='GeV')
-        calc.calculateFakeRate(objToPrint+'_FakeRateEta', chs,
+        calc.bookFakeRate(objToPrint+'_FakeRateEta', chs,
                                'Eta', etaBinning,
                                subtractSamples=samplesToSubtract,
                                draw=args.paint,
                                xTitle='\\eta')
 
+    # every numerator and denominator for every fake rate, one pass per ntuple
+    calc.calculateBooked()
+
     calc.writeOutput()
 
     # clean up
@@ -18,12 +18,14 @@ logging.basicConfig(level=logging.WARNING)
 rlog["/ROOT.TH1F.Add"].setLevel(rlog.ERROR)
 rlog["/rootpy.compiled"].setLevel(rlog.WARNING)
 
-from WeightStringMaker import WeightStringMaker
+from WeightStringMaker import WeightStringMaker, registerDrawFunctions
+from ZZAnalyzer.utils.compiledCache import compileCode
+from ZZAnalyzer.utils.fakeFactors import FakeFactors
 
 from rootpy.io import root_open
-import rootpy.compiled as ROOTComp
 
 import os
+import hashlib
 
 assert os.environ['zza'], "Please run setup.sh before doing anything."
 
@@ -57,12 +59,12 @@ class BkgManager(object):
 
 
     def compile(self):
-        ROOTComp.register_code(___FRCodeToCompile___, 
-                               ['lepFakeFactor',
-                                'lepFakeFactorAdditive'])
-        
-        # force system to compile code now
-        arglebargle = getattr(ROOTComp, 'lepFakeFactor')
+        # compile now (or load from the cache)
+        compileCode(___FRCodeToCompile___, 
+                    ['lepFakeFactor',
+                     'lepFakeFactorAdditive'], 'fakeFactors')
+        registerDrawFunctions(['lepFakeFactor', 'lepFakeFactorAdditive'],
+                              hashlib.sha1(___FRCodeToCompile___).hexdigest())
 
         self.singleLepWeightTemp = ('(lepFakeFactor({f}, '
                                     '{{0}}ZZTightID, '
@@ -102,6 +104,14 @@ class BkgManager(object):
             }
 
 
+    def arrayEngine(self):
+        '''
+        FakeFactors that computes the same weights as the strings from
+        arrays (see ZZAnalyzer.utils.fakeFactors).
+        '''
+        return FakeFactors(self.fakeRates)
+
+
     def z1String3P1F(self, lep, correct=True):
         out = self.zTemps[lep]
         if correct:
@@ -288,12 +298,13 @@ class BkgManagerFactorized(object):
         Compile the ROOT C macros needed for applying fake rates,
         put together the strings to apply them.
         '''
-        ROOTComp.register_code(___FRCodeToCompileFactorized___, 
-                               ['overlapArea', 'isoNoOverlap', 
-                                'lepFakeFactor', 'zFakeFactorGeom'])
-        
-        # force system to compile code now
-        arglebargle = getattr(ROOTComp, 'lepFakeFactor')
+        # compile now (or load from the cache)
+        compileCode(___FRCodeToCompileFactorized___, 
+                    ['overlapArea', 'isoNoOverlap', 
+                     'lepFakeFactor', 'zFakeFactorGeom'], 'fakeFactorsFactorized')
+        registerDrawFunctions(['overlapArea', 'isoNoOverlap',
+                               'lepFakeFactor', 'zFakeFactorGeom'],
+                              hashlib.sha1(___FRCodeToCompileFactorized___).hexdigest())
 
         self.singleLepWeightTemp = ('lepFakeFactor({fID}, '
                                     '{{0}}ZZTightID > 0.5, '
@@ -326,6 +337,13 @@ class BkgManagerFactorized(object):
                 ) for lep in ['e','m']
             }
 
+    def arrayEngine(self):
+        '''
+        FakeFactors that computes the same weights as the strings from
+        arrays (see ZZAnalyzer.utils.fakeFactors).
+        '''
+        return FakeFactors(self.fakeRates, factorized=True)
+
     def z1String3P1F(self, lep, *args):
         return self.zTemps[lep].format(lep+'1', lep+'2')
 
@@ -11,16 +11,37 @@ Author: Nate Woods, U. Wisconsin
 
 
 from ZZAnalyzer.utils.helpers import objVar
+from ZZAnalyzer.utils.compiledCache import compileCode, compileFile, sourceHash
+from ZZAnalyzer.utils.histLookup import HistLookup
 
 from rootpy.plotting import Hist, Hist2D, Hist3D
-import rootpy.compiled as ROOTComp
 from rootpy.ROOT import gROOT
 from rootpy.tree.treebuffer import TreeBuffer
 
 import os
+import hashlib
 assert os.environ["zza"], "Run setup.sh before running analysis"
 
 
+# Hash of everything behind each function made for use in draw strings
+# (code, and histogram contents for the histogram lookups), by function
+# name, so cached histograms drawn with them can tell when they change
+# (see NtuplePlotter.histCacheKey())
+_drawFunctionHashes = {}
+
+def registerDrawFunctions(names, contentHash):
+    for name in names:
+        _drawFunctionHashes[name] = contentHash
+
+
+def drawFunctionHash(name):
+    '''
+    Content hash of draw string function name, or None if it wasn't made
+    here.
+    '''
+    return _drawFunctionHashes.get(name)
+
+
 class _WeightStringSingleton(type):
     '''
     Have to do some kind of singleton thing to avoid duplicate functions.
@@ -64,24 +85,26 @@ class WeightStringMaker(object):
         Return a string that weights an event by the value of histogram h in 
         the bin that would be filled by variables.
         '''
+        iName = "{0}{1}".format(self.fName, self._counter)
+
         # make a copy so we can change directory, save it in global scope
-        hCopy = h.clone()
+        # name it predictably so the same code (and compiled library) can be
+        # used next time
+        hCopy = h.clone(name='{}_hist'.format(iName))
         hCopy.SetDirectory(gROOT)
         #gROOT.GetListOfSpecials().Add(hCopy)
         self._hists.append(hCopy)
-        
-        iName = "{0}{1}".format(self.fName, self._counter)
 
-        ROOTComp.register_code(
-            self.codeBase.format(self._counter,
-                                 ', '.join('double x%d'%i for i in range(len(variables))),
-                                 hCopy.GetName(),
-                                 ', '.join("x%d"%i for i in range(len(variables)))),
-            [iName,])
+        code = self.codeBase.format(self._counter,
+                                    ', '.join('double x%d'%i for i in range(len(variables))),
+                                    hCopy.GetName(),
+                                    ', '.join("x%d"%i for i in range(len(variables))))
+
+        # compiles now (or loads from the cache)
+        compileCode(code, [iName,], iName)
+        registerDrawFunctions([iName],
+                              hashlib.sha1(code + HistLookup(hCopy).key()).hexdigest())
         out = '{0}({1})'.format(iName, ', '.join(variables))
-        
-        # force system to compile code now
-        arglebargle = getattr(ROOTComp, iName)
 
         self._counter += 1
         
@@ -173,10 +196,10 @@ class TPFunctionManager(object):
         fName = '_'.join([effName, lepType])        
         codeFile = os.path.join(self.path, fName+'.C')
         
-        ROOTComp.register_file(codeFile, [fName])
-        
-        # force to compile, save as Python function
-        self.functions[lepType][effName] = getattr(ROOTComp, fName)
+        # compile (or load from the cache), save as Python function
+        self.functions[lepType][effName] = compileFile(codeFile, [fName])[fName]
+        with open(codeFile) as f:
+            registerDrawFunctions([fName], sourceHash(f.read(), [self.path]))
         
         # String to call the function from a draw string
         self.fStrings[lepType][effName] = self.fStrTemp.format(fName)
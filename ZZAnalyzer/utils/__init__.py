@@ -1,2 +1,4 @@
 from WeightStringMaker import WeightStringMaker, TPFunctionManager
 from ReducibleBackgroundCalculator import BkgManager
+from histLookup import HistLookup, ArrayWeight
+from weightVariations import WeightVariations
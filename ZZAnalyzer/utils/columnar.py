@@ -0,0 +1,265 @@
+'''
+
+Tools to read FSA ntuples a chunk of rows at a time as NumPy arrays, so
+cuts and other per-row quantities can be computed on whole columns instead
+of looping over rows in Python.
+
+A ColumnBlock holds the columns for some set of rows (usually a contiguous
+range of entries) and behaves like an ntuple row whose attributes are
+arrays, so the helpers in ZZAnalyzer.utils.helpers (evVar, objVar,
+nObjVar, zCompatibility...) work on it unchanged.
+
+Floating point branches are converted to double precision when they are
+read, because that's what comparisons on rows read through rootpy use.
+Comparing a float32 column to a threshold like 0.02 can give a different
+answer than comparing the same value as a Python float.
+
+Columns are read from a separate copy of the TTree (ColumnReader opens its
+own handle on the file), so reading columns never touches the branch
+addresses or buffers of the tree the analyzer loops over and copies rows
+from.
+
+Author: Nate Woods, U. Wisconsin
+
+'''
+
+import math
+
+import numpy as np
+
+from rootpy.io import root_open
+
+
+class ColumnReader(object):
+    '''
+    Reads columns from one ntuple in one file.
+    '''
+    def __init__(self, fileName, treePath):
+        self.fileName = fileName
+        self.treePath = treePath
+        self.file = root_open(fileName)
+        try:
+            self.tree = self.file.Get(treePath)
+        except:
+            self.file.close()
+            raise
+        self.branchNames = [b.GetName() for b in self.tree.GetListOfBranches()]
+
+
+    def GetEntries(self):
+        return self.tree.GetEntries()
+
+
+    def branchesMatching(self, patterns):
+        '''
+        Names of all branches in the tree that match any of the compiled
+        regular expressions in patterns (e.g. Cutter.branchesNeeded).
+        '''
+        return [b for b in self.branchNames if any(p.match(b) for p in patterns)]
+
+
+    def read(self, branches, start, stop):
+        '''
+        Dict of arrays for branches for entries [start, stop).
+        '''
+        missing = [b for b in branches if b not in self.branchNames]
+        if missing:
+            raise AttributeError("No branch(es) {} in {}:{}".format(', '.join(missing),
+                                                                   self.fileName,
+                                                                   self.treePath))
+        if not branches or stop <= start:
+            return {b : np.array([]) for b in branches}
+
+        # only needed when actually reading, so the rest of this module (used
+        # by the cutters) works without root_numpy
+        from root_numpy import tree2array
+
+        arr = tree2array(self.tree, branches=list(branches), start=start, stop=stop)
+
+        out = {}
+        for name in arr.dtype.names:
+            col = arr[name]
+            if col.dtype.kind == 'f' and col.dtype != np.float64:
+                col = col.astype(np.float64)
+            out[name] = col
+        return out
+
+
+    def blocks(self, branches, chunkSize, start=0, stop=None):
+        '''
+        Generator of ColumnBlocks of (at most) chunkSize consecutive rows,
+        with branches already read.
+        '''
+        if stop is None:
+            stop = self.GetEntries()
+        chunkSize = max(int(chunkSize), 1)
+
+        for chunkStart in xrange(int(start), int(stop), chunkSize):
+            chunkStop = min(chunkStart + chunkSize, int(stop))
+            yield ColumnBlock(self, np.arange(chunkStart, chunkStop),
+                              self.read(branches, chunkStart, chunkStop))
+
+
+    def close(self):
+        self.file.close()
+
+
+
+class ColumnBlock(object):
+    '''
+    Columns for a set of rows, plus the entry number of each row. Acts like
+    an ntuple row with arrays for attributes. Columns that weren't read up
+    front are read from the reader on first use.
+    '''
+    def __init__(self, reader, entries, columns):
+        self._reader = reader
+        self.entries = entries
+        self._columns = columns
+
+
+    def __len__(self):
+        return len(self.entries)
+
+
+    def __getattr__(self, name):
+        if name[:1] == '_':
+            raise AttributeError(name)
+        try:
+            return self._columns[name]
+        except KeyError:
+            pass
+
+        # Not read yet (e.g. a branch a cut function uses without declaring).
+        if not len(self.entries):
+            col = self._reader.read([name], 0, 0)[name]
+        else:
+            first = self.entries[0]
+            col = self._reader.read([name], first, self.entries[-1]+1)[name]
+            col = col[self.entries - first]
+        self._columns[name] = col
+        return col
+
+
+    def take(self, selection):
+        '''
+        New block with only the rows selected by a boolean mask or index array.
+        '''
+        return ColumnBlock(self._reader, self.entries[selection],
+                           {b : c[selection] for b, c in self._columns.iteritems()})
+
+
+    def row(self, i):
+        return BlockRow(self, i)
+
+
+    def rows(self):
+        '''
+        Iterate over single rows, for things that can only be done one row at
+        a time.
+        '''
+        for i in xrange(len(self)):
+            yield BlockRow(self, i)
+
+
+
+class BlockRow(object):
+    '''
+    One row of a ColumnBlock, for functions that expect an ntuple row.
+    '''
+    __slots__ = ('_block', '_i')
+
+    def __init__(self, block, i):
+        self._block = block
+        self._i = i
+
+    def __getattr__(self, name):
+        return getattr(self._block, name)[self._i]
+
+
+
+def eventBoundaries(reader, start, stop, nChunks):
+    '''
+    Split entries [start, stop) of reader's tree into at most nChunks ranges
+    of about the same size, moving each boundary forward to the first row
+    of an event so that all rows of an event (which are always next to each
+    other in FSA ntuples) end up in the same range. Returns the list of
+    boundaries, starting with start and ending with stop.
+    '''
+    if stop <= start:
+        return [start, stop]
+
+    ids = reader.read(['run', 'lumi', 'evt'], start, stop)
+    newEvent = np.zeros(stop - start, dtype=bool)
+    newEvent[0] = True
+    for col in ids.itervalues():
+        newEvent[1:] |= col[1:] != col[:-1]
+    eventStarts = np.nonzero(newEvent)[0] + start
+
+    bounds = [start]
+    for target in np.linspace(start, stop, nChunks + 1)[1:-1]:
+        i = np.searchsorted(eventStarts, int(math.ceil(target)))
+        if i == len(eventStarts):
+            break
+        if eventStarts[i] > bounds[-1]:
+            bounds.append(int(eventStarts[i]))
+    bounds.append(stop)
+
+    return bounds
+
+
+def asMask(result, nRows):
+    '''
+    Make sure the result of a cut is a boolean array of length nRows, even if
+    the cut didn't depend on the row (e.g. 'true' or 'SameFlavor').
+    '''
+    return np.logical_and(np.ones(nRows, dtype=bool), result)
+
+
+def allArrays(masks):
+    '''
+    Elementwise version of all() for an iterable of boolean arrays.
+    '''
+    return reduce(np.logical_and, masks, True)
+
+
+def anyArrays(masks):
+    '''
+    Elementwise version of any() for an iterable of boolean arrays.
+    '''
+    return reduce(np.logical_or, masks, False)
+
+
+def rowByRow(f):
+    '''
+    Turn a function of (row, *objects) returning a bool into a function of
+    (block, *objects) returning a boolean array, by calling it on each row.
+    For cuts that don't have a vectorized version.
+    '''
+    def arrayFun(block, *obj):
+        return np.fromiter((bool(f(row, *obj)) for row in block.rows()),
+                           dtype=bool, count=len(block))
+    return arrayFun
+
+
+def groupRowsBy(block, f):
+    '''
+    Call f(row) on every row of block, where f returns a list (e.g. an object
+    ordering). Return a list of (mask, value) pairs, one for each distinct
+    value, where mask selects the rows that gave that value.
+    '''
+    values = {}
+    indices = {}
+    for i, row in enumerate(block.rows()):
+        val = f(row)
+        key = tuple(val)
+        if key not in values:
+            values[key] = val
+            indices[key] = []
+        indices[key].append(i)
+
+    out = []
+    for key, val in values.iteritems():
+        mask = np.zeros(len(block), dtype=bool)
+        mask[indices[key]] = True
+        out.append((mask, val))
+    return out
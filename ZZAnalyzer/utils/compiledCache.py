@@ -0,0 +1,355 @@
+'''
+
+On-disk cache of C++ code compiled with ACLiC, so the fake rate and
+tag-and-probe functions (and the histogram lookup functions of
+WeightStringMaker) are compiled once instead of by every process that
+uses them.
+
+Each piece of code gets a directory cacheDir/<key>/, where the key is a
+hash of
+    - the source code, and every local header it includes
+          (#include "...", looked for next to the including file and in
+          the include directory)
+    - the names of the functions wanted from it
+    - the ROOT version and the command ACLiC compiles with
+holding the source, the shared library and its dictionary, and a small
+JSON file describing them. Libraries are built in the entry directory
+itself (ACLiC's dictionary remembers where it was made, so they can't be
+moved afterwards), and the JSON file is written last, so an entry without
+one is unfinished and gets rebuilt. The check-then-build is done while
+holding an exclusive lock on cacheDir/<key>.lock, so any number of
+processes can ask for the same code at once and it will be compiled
+exactly once; the rest wait for it and load the result.
+
+The cache is off unless the environment variable ZZA_COMPILED_CACHE is set
+to something other than 0 (or enableCache() is called); the module-level
+compileCode() and compileFile() then compile with rootpy.compiled, the way
+they always have been.
+
+The cache only grows on its own. To list or remove entries, do
+
+>>> python compiledCache.py list [cacheDir]
+>>> python compiledCache.py evict [cacheDir] [--days N] [--all]
+
+where evict removes entries not used in the last N days (default 30).
+
+Author: Nate Woods, U. Wisconsin
+
+'''
+
+import os
+import json
+import glob
+import fcntl
+import shutil
+import hashlib
+import re
+import time
+
+import ROOT
+
+
+_defaultCacheDir = os.path.join(os.environ.get('zza', '.'), 'ZZAnalyzer', '.compiledCache')
+
+# bump to invalidate everything already cached
+_version = 2
+
+_includeRegex = re.compile(r'^\s*#\s*include\s*"([^"]+)"', re.MULTILINE)
+
+
+def _findHeader(header, dirs):
+    for d in dirs:
+        path = os.path.join(d, header)
+        if os.path.isfile(path):
+            return os.path.abspath(path)
+    return None
+
+
+def localHeaders(source, includeDirs=[]):
+    '''
+    Sorted list of the local headers (#include "...") source uses, directly
+    or through other local headers, looked for in includeDirs (and, for
+    headers included by headers, the including header's directory).
+    Headers that can't be found (e.g. ROOT's) are left out.
+    '''
+    found = set()
+    toRead = [(source, list(includeDirs))]
+    while toRead:
+        text, dirs = toRead.pop()
+        for header in _includeRegex.findall(text):
+            path = _findHeader(header, dirs)
+            if path is None or path in found:
+                continue
+            found.add(path)
+            with open(path) as f:
+                toRead.append((f.read(), [os.path.dirname(path)] + list(includeDirs)))
+    return sorted(found)
+
+
+def sourceHash(source, includeDirs=[]):
+    '''
+    Hash of source and every local header it includes (see localHeaders()).
+    '''
+    h = hashlib.sha1(source)
+    for path in localHeaders(source, includeDirs):
+        with open(path) as f:
+            h.update(path)
+            h.update(hashlib.sha1(f.read()).hexdigest())
+    return h.hexdigest()
+
+
+def _toolchain():
+    '''
+    Everything about this ROOT installation that can change a compiled
+    library.
+    '''
+    return [ROOT.gROOT.GetVersion(), ROOT.gSystem.GetMakeSharedLib(),
+            ROOT.gSystem.GetIncludePath(), ROOT.gSystem.GetFlagsOpt()]
+
+
+
+class CompiledCache(object):
+    # keys of libraries already loaded in this process
+    _loaded = set()
+
+    def __init__(self, cacheDir=_defaultCacheDir):
+        self.cacheDir = cacheDir
+
+
+    def key(self, source, symbols, includeDir=''):
+        keyInfo = {
+            'version' : _version,
+            'source' : sourceHash(source, [includeDir] if includeDir else []),
+            'symbols' : sorted(symbols),
+            'toolchain' : _toolchain(),
+            }
+        return hashlib.sha1(json.dumps(keyInfo, sort_keys=True)).hexdigest()
+
+
+    def entryDir(self, key):
+        return os.path.join(self.cacheDir, key)
+
+
+    def compileCode(self, source, symbols, name='code', includeDir=''):
+        '''
+        Compile source (C++ code, as a string) if it isn't in the cache
+        already, load it, and return {symbol : function} for each of
+        symbols. name is used for the source and library file names;
+        includeDir, if given, is added to the include path while compiling.
+        '''
+        key = self.key(source, symbols, includeDir)
+
+        if key not in self._loaded:
+            entry = self.entryDir(key)
+            if not os.path.isfile(os.path.join(entry, 'entry.json')):
+                self.build(key, source, symbols, name, includeDir)
+
+            with open(os.path.join(entry, 'entry.json')) as f:
+                info = json.load(f)
+            if ROOT.gSystem.Load(os.path.join(entry, info['library'])) < 0:
+                raise RuntimeError("Failed to load compiled {} from {}".format(name, entry))
+            self._loaded.add(key)
+
+            # mark as recently used
+            try:
+                os.utime(os.path.join(entry, 'entry.json'), None)
+            except OSError:
+                pass
+
+        return {s : getattr(ROOT, s) for s in symbols}
+
+
+    def compileFile(self, fileName, symbols):
+        '''
+        Same as compileCode(), for the code in fileName.
+        '''
+        with open(fileName) as f:
+            source = f.read()
+
+        name = os.path.splitext(os.path.basename(fileName))[0]
+        return self.compileCode(source, symbols, name,
+                                os.path.dirname(os.path.abspath(fileName)))
+
+
+    def build(self, key, source, symbols, name, includeDir=''):
+        '''
+        Compile source into the cache under key, unless another process
+        already did (or is doing it, in which case wait for it).
+        '''
+        if not os.path.isdir(self.cacheDir):
+            try:
+                os.makedirs(self.cacheDir)
+            except OSError: # someone else made it first
+                if not os.path.isdir(self.cacheDir):
+                    raise
+
+        entry = self.entryDir(key)
+        infoFile = os.path.join(entry, 'entry.json')
+        with open(entry + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                if os.path.isfile(infoFile): # done while we waited
+                    return
+
+                # left over from a build that failed partway
+                if os.path.isdir(entry):
+                    shutil.rmtree(entry)
+                os.makedirs(entry)
+
+                try:
+                    sourceFile = os.path.join(entry, name + '.C')
+                    with open(sourceFile, 'w') as f:
+                        f.write(source)
+
+                    includePath = ROOT.gSystem.GetIncludePath()
+                    if includeDir:
+                        ROOT.gSystem.AddIncludePath('-I' + includeDir)
+                    try:
+                        # k: keep library, O: optimize, c: compile but don't load
+                        ok = ROOT.gSystem.CompileMacro(sourceFile, 'kOc',
+                                                       os.path.join(entry, name))
+                    finally:
+                        ROOT.gSystem.SetIncludePath(includePath)
+                    if not ok:
+                        raise RuntimeError("Failed to compile {}".format(name))
+
+                    libs = glob.glob(os.path.join(entry, '*.' + ROOT.gSystem.GetSoExt()))
+                    if not libs:
+                        raise RuntimeError("Can't find the library compiled from {}".format(name))
+
+                    # written last and renamed into place, so it only
+                    # exists once the entry is complete
+                    tmpName = infoFile + '.{}.tmp'.format(os.getpid())
+                    with open(tmpName, 'w') as f:
+                        json.dump({
+                                'name' : name,
+                                'symbols' : sorted(symbols),
+                                'library' : os.path.basename(libs[0]),
+                                'toolchain' : _toolchain(),
+                                'created' : time.time(),
+                                }, f, indent=2, sort_keys=True)
+                    os.rename(tmpName, infoFile)
+                except:
+                    shutil.rmtree(entry, ignore_errors=True)
+                    raise
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+    def entries(self):
+        '''
+        List of (entry directory, info, last used time) for every entry.
+        '''
+        if not os.path.isdir(self.cacheDir):
+            return []
+
+        out = []
+        for name in sorted(os.listdir(self.cacheDir)):
+            entry = os.path.join(self.cacheDir, name)
+            infoFile = os.path.join(entry, 'entry.json')
+            if not os.path.isfile(infoFile):
+                continue
+            try:
+                with open(infoFile) as f:
+                    info = json.load(f)
+                used = os.path.getmtime(infoFile)
+            except (IOError, OSError, ValueError):
+                info = None
+                used = 0.
+            out.append((entry, info, used))
+        return out
+
+
+    def evict(self, maxAgeDays=30., everything=False):
+        '''
+        Remove entries not used in the last maxAgeDays days (or all entries,
+        if everything is True). Each is removed while holding its lock, so
+        nobody is building it at the time. Returns the removed directories.
+        '''
+        cutoff = time.time() - maxAgeDays * 24. * 3600.
+
+        removed = []
+        for entry, info, used in self.entries():
+            if not everything and used >= cutoff:
+                continue
+            with open(entry + '.lock', 'w') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    shutil.rmtree(entry, ignore_errors=True)
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+            try:
+                os.remove(entry + '.lock')
+            except OSError:
+                pass
+            removed.append(entry)
+
+        return removed
+
+
+
+_defaultCache = CompiledCache()
+
+_cacheEnabled = os.environ.get('ZZA_COMPILED_CACHE', '0') not in ['', '0']
+
+def enableCache(enable=True):
+    '''
+    Turn the default cache on (or off) for compileCode() and compileFile().
+    '''
+    global _cacheEnabled
+    _cacheEnabled = enable
+
+
+def compileCode(source, symbols, name='code'):
+    '''
+    compileCode() with the default cache, or with rootpy.compiled if the
+    cache is off.
+    '''
+    if _cacheEnabled:
+        return _defaultCache.compileCode(source, symbols, name)
+
+    import rootpy.compiled as ROOTComp
+    ROOTComp.register_code(source, symbols)
+    # getting them forces the code to compile now
+    return {s : getattr(ROOTComp, s) for s in symbols}
+
+
+def compileFile(fileName, symbols):
+    '''
+    compileFile() with the default cache, or with rootpy.compiled if the
+    cache is off.
+    '''
+    if _cacheEnabled:
+        return _defaultCache.compileFile(fileName, symbols)
+
+    import rootpy.compiled as ROOTComp
+    ROOTComp.register_file(fileName, symbols)
+    return {s : getattr(ROOTComp, s) for s in symbols}
+
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='List or remove compiled code in the cache.')
+    parser.add_argument('action', type=str, choices=['list', 'evict'],
+                        help='What to do with the cache.')
+    parser.add_argument('cacheDir', type=str, nargs='?', default=_defaultCacheDir,
+                        help='Cache directory.')
+    parser.add_argument('--days', type=float, default=30.,
+                        help='When evicting, remove entries not used in this many days.')
+    parser.add_argument('--all', action='store_true',
+                        help='When evicting, remove everything.')
+    args = parser.parse_args()
+
+    cache = CompiledCache(args.cacheDir)
+    if args.action == 'list':
+        for entry, info, used in cache.entries():
+            if info is None:
+                print "    {}  unreadable".format(os.path.basename(entry))
+                continue
+            print "    {}  {:20} [{}], last used {}".format(os.path.basename(entry)[:12], info['name'],
+                                                           ', '.join(info['symbols']), time.ctime(used))
+    else:
+        removed = cache.evict(args.days, args.all)
+        print "{}: removed {} entries".format(args.cacheDir, len(removed))
@@ -0,0 +1,128 @@
+'''
+
+Merge the same ntuple from several data files, keeping only the first copy
+of each event (events can be in more than one primary dataset, e.g. both
+DoubleMuon and MuonEG).
+
+Only the run, lumi and evt branches are read to find the duplicates, a
+chunk of rows at a time, and the first copy of each event is found with
+packed event keys (see ZZAnalyzer.utils.eventIndex). The rows to keep are
+then copied in C++ with an entry list on a TChain of the inputs, so no row
+goes through Python.
+
+Merged ntuples are kept in a cache directory, under a name made from the
+input files (names, sizes and modification times) and the ntuple path, so
+merging the same files again just opens the old result.
+
+Physics-based redundant row cleaning is assumed already done; that is,
+multiple copies of an event are assumed to be identical, so it doesn't
+matter which is kept. Files are merged in sorted order so the result is
+always the same.
+
+Author: Nate Woods, U. Wisconsin
+
+'''
+
+import os
+import hashlib
+
+import numpy as np
+
+import ROOT
+from rootpy.io import root_open
+
+from ZZAnalyzer.utils.columnar import ColumnReader
+from ZZAnalyzer.utils.eventIndex import EventIndex
+
+
+_defaultCacheDir = os.path.join(os.environ.get('zza', '.'), 'ZZAnalyzer', '.dataMergeCache')
+
+
+def mergeKey(files, treePath):
+    '''
+    Hash identifying the merge of treePath from these files.
+    '''
+    h = hashlib.sha1(treePath)
+    for f in sorted(os.path.abspath(f) for f in files):
+        st = os.stat(f)
+        h.update('{}:{}:{}\n'.format(f, st.st_size, st.st_mtime))
+    return h.hexdigest()
+
+
+def firstCopies(files, treePath, chunkSize=500000):
+    '''
+    For each file (in order), a sorted array of the entries of treePath to
+    keep so that each event is only kept the first time it appears.
+    '''
+    run = []
+    lumi = []
+    evt = []
+    nRows = []
+    for f in files:
+        reader = ColumnReader(f, treePath)
+        try:
+            n = 0
+            for block in reader.blocks(['run', 'lumi', 'evt'], chunkSize):
+                run.append(block.run)
+                lumi.append(block.lumi)
+                evt.append(block.evt)
+                n += len(block)
+            nRows.append(n)
+        finally:
+            reader.close()
+
+    if not sum(nRows):
+        return [np.zeros(0, dtype=np.int_) for f in files]
+
+    keep = EventIndex.fromArrays(np.concatenate(run), np.concatenate(lumi),
+                                 np.concatenate(evt)).firstRows('first')
+
+    out = []
+    start = 0
+    for n in nRows:
+        out.append(np.nonzero(keep[start:start+n])[0])
+        start += n
+    return out
+
+
+def mergeDataFiles(files, treePath, cacheDir=_defaultCacheDir, chunkSize=500000):
+    '''
+    Name of a file with treePath merged from all files, without duplicate
+    events. Made if it's not already in cacheDir.
+    '''
+    files = sorted(os.path.abspath(f) for f in files)
+
+    fileName = os.path.join(cacheDir, 'merged_{}_{}.root'.format(treePath.replace('/', '_'),
+                                                                  mergeKey(files, treePath)))
+    if os.path.exists(fileName):
+        return fileName
+
+    if not os.path.isdir(cacheDir):
+        try:
+            os.makedirs(cacheDir)
+        except OSError: # someone else made it first
+            if not os.path.isdir(cacheDir):
+                raise
+
+    entryList = ROOT.TEntryList('mergeList', 'mergeList')
+    for f, entries in zip(files, firstCopies(files, treePath, chunkSize)):
+        subList = ROOT.TEntryList('', '', treePath, f)
+        for iRow in entries.tolist():
+            subList.Enter(iRow)
+        entryList.Add(subList)
+
+    chain = ROOT.TChain(treePath)
+    for f in files:
+        chain.Add(f)
+    chain.SetEntryList(entryList)
+
+    # write and rename, so nobody ever opens half a file
+    tmpName = fileName.replace('.root', '_{}.tmp.root'.format(os.getpid()))
+    with root_open(tmpName, 'recreate') as fOut:
+        d = fOut.mkdir(os.path.dirname(treePath), recurse=True) if '/' in treePath else fOut
+        d.cd()
+        out = chain.CopyTree('')
+        out.Write()
+    os.rename(tmpName, fileName)
+
+    return fileName
@@ -0,0 +1,356 @@
+'''
+
+Fast lookups of events by (run, lumi, evt).
+
+Each event ID is packed into one unsigned 64-bit integer,
+
+>>> key = run << (lumiBits + evtBits) | lumi << evtBits | evt
+
+so sorting the keys sorts the events by run, then lumi, then event, and
+finding events, matching events between two ntuples or removing duplicate
+events can all be done with NumPy sorts and binary searches instead of
+Python sets of tuples. The number of bits for each number (the "layout",
+(lumiBits, evtBits)) is the smallest that fits the events being indexed,
+with the rest used for the run number. To compare indices with different
+layouts, the events of one are repacked in the layout of the other (events
+that don't fit in it can't be in it).
+
+An EventIndex holds the key of every row of an ntuple, in entry order, so
+it can say which entries belong to which events. loadIndex() makes one for
+a channel of an ntuple file, and saves it in a sidecar file next to the
+ntuple (file.root -> file.evtidx.npz) so later jobs don't have to read the
+ntuple again. The sidecar is rebuilt if the ntuple changes.
+
+Author: Nate Woods, U. Wisconsin
+
+'''
+
+import os
+
+import numpy as np
+
+
+def _bits(n):
+    '''
+    Number of bits needed to store the non-negative integer n (at least 1).
+    '''
+    return max(int(n).bit_length(), 1)
+
+
+def _asUInt(a):
+    a = np.asarray(a)
+    if a.dtype.kind not in 'iub':
+        a = a.astype(np.int64)
+    if a.size and a.min() < 0:
+        raise ValueError("Event IDs can't be negative")
+    return a.astype(np.uint64)
+
+
+def layoutFor(run, lumi, evt):
+    '''
+    Smallest layout (lumiBits, evtBits) that fits these run, lumi and event
+    numbers (arrays). Raises ValueError if they can't be packed in 64 bits.
+    '''
+    lumiBits = _bits(np.max(lumi)) if len(lumi) else 1
+    evtBits = _bits(np.max(evt)) if len(evt) else 1
+    runBits = _bits(np.max(run)) if len(run) else 1
+    if runBits + lumiBits + evtBits > 64:
+        raise ValueError("Run, lumi and event numbers need {} bits, which is more than 64".format(runBits + lumiBits + evtBits))
+    return (lumiBits, evtBits)
+
+
+def packKeys(run, lumi, evt, layout=None):
+    '''
+    Array of uint64 keys for arrays (or lists) of run, lumi and event
+    numbers. Returns (keys, layout).
+    '''
+    run = _asUInt(run)
+    lumi = _asUInt(lumi)
+    evt = _asUInt(evt)
+
+    needed = layoutFor(run, lumi, evt)
+    if layout is None:
+        layout = needed
+    elif needed[0] > layout[0] or needed[1] > layout[1]:
+        raise ValueError("Events don't fit in layout {}".format(layout))
+    elif len(run) and _bits(np.max(run)) + layout[0] + layout[1] > 64:
+        raise ValueError("Run numbers don't fit in layout {}".format(layout))
+
+    lumiBits, evtBits = layout
+    keys = (run << np.uint64(lumiBits + evtBits)) | (lumi << np.uint64(evtBits)) | evt
+
+    return keys, tuple(layout)
+
+
+def unpackKeys(keys, layout):
+    '''
+    (run, lumi, evt) arrays from keys made with layout.
+    '''
+    keys = np.asarray(keys, dtype=np.uint64)
+    lumiBits, evtBits = layout
+    evt = keys & np.uint64((1 << evtBits) - 1)
+    lumi = (keys >> np.uint64(evtBits)) & np.uint64((1 << lumiBits) - 1)
+    run = keys >> np.uint64(lumiBits + evtBits)
+    return run, lumi, evt
+
+
+def parseEventList(lines):
+    '''
+    (run, lumi, evt) arrays from lines like run:lumi:evt[:anything else],
+    ignoring blank lines and the leading spaces, '<' and '>' of diff output.
+    '''
+    run = []
+    lumi = []
+    evt = []
+    for line in lines:
+        words = line.strip().lstrip('< >').split(':')
+        if len(words) < 3 or not words[0]:
+            continue
+        run.append(int(words[0]))
+        lumi.append(int(words[1]))
+        evt.append(int(words[2]))
+    return (np.array(run, dtype=np.uint64), np.array(lumi, dtype=np.uint64),
+            np.array(evt, dtype=np.uint64))
+
+
+
+class EventIndex(object):
+    '''
+    Keys of a list of rows (e.g. all the rows of an ntuple, in entry order),
+    with vectorized lookups.
+    '''
+    def __init__(self, keys, layout):
+        self.keys = np.asarray(keys, dtype=np.uint64)
+        self.layout = tuple(layout)
+        self._order = None
+
+
+    @classmethod
+    def fromArrays(cls, run, lumi, evt, layout=None):
+        return cls(*packKeys(run, lumi, evt, layout))
+
+
+    @classmethod
+    def fromEvents(cls, events, layout=None):
+        '''
+        Index of a list of (run, lumi, evt) tuples.
+        '''
+        events = list(events)
+        return cls.fromArrays([e[0] for e in events], [e[1] for e in events],
+                              [e[2] for e in events], layout)
+
+
+    def __len__(self):
+        return len(self.keys)
+
+
+    @property
+    def order(self):
+        '''
+        Entries sorted by event, keeping the order of rows of the same event.
+        '''
+        if self._order is None:
+            self._order = np.argsort(self.keys, kind='mergesort')
+        return self._order
+
+
+    def sortedKeys(self):
+        return self.keys[self.order]
+
+
+    def events(self):
+        '''
+        (run, lumi, evt) arrays for every row.
+        '''
+        return unpackKeys(self.keys, self.layout)
+
+
+    def repacked(self, layout):
+        '''
+        Same index with keys in a different layout.
+        '''
+        layout = tuple(layout)
+        if layout == self.layout:
+            return self
+        return EventIndex.fromArrays(*(self.events() + (layout,)))
+
+
+    def keysFor(self, other):
+        '''
+        Keys of the rows of other (an EventIndex) in this index's layout, and
+        a boolean array that's False for rows whose events can't be in this
+        index because they don't fit in its layout (their keys are 0).
+        '''
+        if other.layout == self.layout:
+            return other.keys, np.ones(len(other), dtype=bool)
+
+        run, lumi, evt = other.events()
+        lumiBits, evtBits = self.layout
+        one = np.uint64(1)
+        fits = ((lumi < (one << np.uint64(lumiBits))) &
+                (evt < (one << np.uint64(evtBits))) &
+                (run < (one << np.uint64(64 - lumiBits - evtBits))))
+
+        keys = np.zeros(len(other), dtype=np.uint64)
+        if fits.any():
+            keys[fits] = packKeys(run[fits], lumi[fits], evt[fits], self.layout)[0]
+        return keys, fits
+
+
+    def contains(self, other):
+        '''
+        Boolean array, True for each row of other (an EventIndex) whose event
+        is in this index.
+        '''
+        keys, found = self.keysFor(other)
+        sortedKeys = self.sortedKeys()
+        i = np.searchsorted(sortedKeys, keys)
+        found &= i < len(sortedKeys)
+        found[found] = sortedKeys[i[found]] == keys[found]
+        return found
+
+
+    def isIn(self, other):
+        '''
+        Boolean array, True for each row of this index whose event is in
+        other.
+        '''
+        return other.contains(self)
+
+
+    def entriesOf(self, other):
+        '''
+        Sorted array of all entries of this index whose events are in other
+        (an EventIndex).
+        '''
+        return np.nonzero(self.isIn(other))[0]
+
+
+    def join(self, other):
+        '''
+        All pairs of rows with the same event, as two arrays of entries (one
+        in this index, one in other), sorted by event.
+        '''
+        keys, fits = self.keysFor(other)
+        bEntries = np.nonzero(fits)[0]
+        bOrder = bEntries[np.argsort(keys[bEntries], kind='mergesort')]
+        bKeys = keys[bOrder]
+        aKeys = self.sortedKeys()
+
+        # for each row of this index, the range of rows of other with the same key
+        lo = np.searchsorted(bKeys, aKeys, side='left')
+        hi = np.searchsorted(bKeys, aKeys, side='right')
+        counts = hi - lo
+
+        aOut = np.repeat(self.order, counts)
+        starts = np.repeat(lo - np.cumsum(counts) + counts, counts)
+        bOut = bOrder[starts + np.arange(len(aOut))]
+
+        return aOut, bOut
+
+
+    def firstRows(self, keep='first'):
+        '''
+        Boolean array, True for one row of each event: the first one in
+        entry order if keep is 'first', the last one if keep is 'last'.
+        '''
+        sortedKeys = self.sortedKeys()
+        chosen = np.ones(len(self), dtype=bool)
+        if len(self):
+            if keep == 'first':
+                chosen[1:] = sortedKeys[1:] != sortedKeys[:-1]
+            elif keep == 'last':
+                chosen[:-1] = sortedKeys[1:] != sortedKeys[:-1]
+            else:
+                raise ValueError("keep must be 'first' or 'last', not {}".format(keep))
+
+        out = np.zeros(len(self), dtype=bool)
+        out[self.order[chosen]] = True
+        return out
+
+
+    def uniqueEntries(self, keep='first'):
+        '''
+        One entry for each event (see firstRows()), sorted by event.
+        '''
+        mask = self.firstRows(keep)
+        return self.order[mask[self.order]]
+
+
+    def eventGroups(self):
+        '''
+        (order, starts), where order is the entries sorted by event and the
+        rows of event i are order[starts[i]:starts[i+1]].
+        '''
+        sortedKeys = self.sortedKeys()
+        newEvent = np.ones(len(self), dtype=bool)
+        if len(self):
+            newEvent[1:] = sortedKeys[1:] != sortedKeys[:-1]
+        return self.order, np.nonzero(newEvent)[0]
+
+
+
+def sidecarName(fileName):
+    return os.path.splitext(fileName)[0] + '.evtidx.npz'
+
+
+def _fileStamp(fileName):
+    st = os.stat(fileName)
+    return np.array([st.st_size, st.st_mtime])
+
+
+def _readIndex(fileName, treePath):
+    from ZZAnalyzer.utils.columnar import ColumnReader
+
+    reader = ColumnReader(fileName, treePath)
+    try:
+        ids = reader.read(['run', 'lumi', 'evt'], 0, reader.GetEntries())
+    finally:
+        reader.close()
+    return EventIndex.fromArrays(ids['run'], ids['lumi'], ids['evt'])
+
+
+def loadIndex(fileName, channel, ntupleDir='ntuple', rebuild=False, save=True):
+    '''
+    EventIndex for every row of channel's ntuple in fileName, from the
+    sidecar file if it's there and up to date. Otherwise, the index is made
+    from the ntuple and (if save is True) added to the sidecar. If the
+    sidecar can't be written (e.g. read-only directory), the index is just
+    returned.
+    '''
+    treePath = '/'.join([channel, ntupleDir])
+    name = treePath.replace('/', '.')
+    sidecar = sidecarName(fileName)
+    stamp = _fileStamp(fileName)
+
+    stored = {}
+    if os.path.exists(sidecar) and not rebuild:
+        try:
+            with np.load(sidecar) as f:
+                stored = {k : f[k] for k in f.files}
+        except (IOError, ValueError):
+            stored = {}
+        if 'stamp' not in stored or not np.array_equal(stored['stamp'], stamp):
+            stored = {}
+
+    if name + '.keys' in stored:
+        return EventIndex(stored[name + '.keys'],
+                          stored[name + '.layout'].tolist())
+
+    index = _readIndex(fileName, treePath)
+
+    if save:
+        stored['stamp'] = stamp
+        stored[name + '.keys'] = index.keys
+        stored[name + '.layout'] = np.array(index.layout)
+        # write and rename, so nobody ever reads half a file
+        tmpName = sidecar + '.{}.tmp'.format(os.getpid())
+        try:
+            with open(tmpName, 'wb') as f:
+                np.savez(f, **stored)
+            os.rename(tmpName, sidecar)
+        except (IOError, OSError):
+            if os.path.exists(tmpName):
+                os.remove(tmpName)
+
+    return index
@@ -0,0 +1,327 @@
+'''
+
+Array version of the reducible (Z+X) background weights of BkgManager and
+BkgManagerFactorized, for whole chunks of a 3P1F or 2P2F control region
+ntuple at once instead of through long TTree::Draw() strings.
+
+Each weight is computed the same way as the corresponding string, with
+the same operations in the same order (fake rates are found with
+HistLookups, which find bins like TH1::FindBin()), so the results are the
+same as the string-based weights:
+    - weights3P1F():           BkgManager[Factorized].fullString3P1F()
+    - weights2P2F():           BkgManager[Factorized].fullString2P2F()
+    - weights2P2FMigration():  BkgManager.fullString2P2FMigration()
+Each takes a ColumnBlock (or dict of arrays) for one channel's ntuple.
+
+yields() reads an ntuple a chunk at a time and returns the weighted yield
+in each bin of any number of observables, with statistical errors, in
+one pass. Get a FakeFactors for a manager with its arrayEngine() method.
+
+Author: Nate Woods, U. Wisconsin
+
+'''
+
+import numpy as np
+
+from ZZAnalyzer.utils.histLookup import HistLookup, binAxis
+from ZZAnalyzer.utils.weightVariations import WeightVariations, binnedYields
+
+
+_zPairs = {
+    'eeee' : [('e1', 'e2'), ('e3', 'e4')],
+    'eemm' : [('e1', 'e2'), ('m1', 'm2')],
+    'mmmm' : [('m1', 'm2'), ('m3', 'm4')],
+    }
+
+_regions = ['3P1F', '2P2F', '2P2FMigration']
+
+
+def _col(rows, name):
+    if isinstance(rows, dict):
+        return rows[name]
+    return getattr(rows, name)
+
+
+
+class FakeFactors(object):
+    def __init__(self, fakeRates, factorized=False):
+        '''
+        fakeRates: for the normal method, {'e' : hist, 'm' : hist}. For the
+                       factorized method, {'ID' : {'e' : hist, 'm' : hist},
+                       'Iso' : {...}}. Histograms may be HistLookups already.
+        '''
+        self.factorized = factorized
+
+        def lookup(h):
+            return h if isinstance(h, HistLookup) else HistLookup(h)
+
+        if factorized:
+            self.fakeRates = {t : {lep : lookup(h) for lep, h in frs.iteritems()}
+                              for t, frs in fakeRates.iteritems()}
+        else:
+            self.fakeRates = {lep : lookup(h) for lep, h in fakeRates.iteritems()}
+
+
+    def shifted(self, nSigma):
+        '''
+        Same fake factors with every fake rate moved by nSigma times its
+        error (for systematic variations, e.g. as functions in a
+        WeightVariations).
+        '''
+        if self.factorized:
+            return FakeFactors({t : {lep : fr.shifted(nSigma) for lep, fr in frs.iteritems()}
+                                for t, frs in self.fakeRates.iteritems()}, True)
+        return FakeFactors({lep : fr.shifted(nSigma) for lep, fr in self.fakeRates.iteritems()})
+
+
+    def branchesNeeded(self, channel):
+        out = []
+        for l1, l2 in _zPairs[channel]:
+            for lep in [l1, l2]:
+                out += [lep + v for v in ['Pt', 'Eta', 'ZZTightID', 'ZZIsoPass']]
+                if self.factorized:
+                    out.append(lep + 'ZZIsoFSR')
+            out.append('{}_{}_DR'.format(l1, l2))
+        return out
+
+
+    ### Normal method (BkgManager)
+
+    def lepFakeFactor(self, rows, lep, additive=False):
+        '''
+        lepFakeFactor() (or lepFakeFactorAdditive()) for one lepton.
+        '''
+        f = self.fakeRates[lep[0]](_col(rows, lep + 'Pt'),
+                                   np.abs(_col(rows, lep + 'Eta')))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            out = f / (1. - f)
+
+        passing = (_col(rows, lep + 'ZZTightID') + _col(rows, lep + 'ZZIsoPass')) > 1.5
+        out[passing] = 0. if additive else 1.
+
+        return out
+
+
+    def zCorrection(self, rows, l1, l2, failValue):
+        '''
+        Collinear lepton correction: failValue for Zs with a failing lepton
+        and DR < 0.6, 1 otherwise.
+        '''
+        nPass = (_col(rows, l1 + 'ZZTightID') + _col(rows, l1 + 'ZZIsoPass') +
+                 _col(rows, l2 + 'ZZTightID') + _col(rows, l2 + 'ZZIsoPass'))
+        return np.where((nPass < 4.) & (_col(rows, '{}_{}_DR'.format(l1, l2)) < 0.6),
+                        failValue, 1.)
+
+
+    def zFactors(self, rows, l1, l2, correct, failValue):
+        '''
+        List of the factors multiplied together for one Z in the string
+        version, so the full weight can be multiplied in the same order.
+        '''
+        if self.factorized:
+            if correct and failValue < 0.:
+                return [self.zWeightFactorized(rows, l1, l2, True)]
+            return self.lepFactorsFactorized(rows, l1, l2)
+
+        out = [self.lepFakeFactor(rows, l1), self.lepFakeFactor(rows, l2)]
+        if correct:
+            out.append(self.zCorrection(rows, l1, l2, failValue))
+        return out
+
+
+    def _fullWeight(self, rows, channel, correct, failValue):
+        (l1, l2), (l3, l4) = _zPairs[channel]
+        factors = (self.zFactors(rows, l1, l2, correct, failValue) +
+                   self.zFactors(rows, l3, l4, correct, failValue))
+        out = factors[0]
+        for f in factors[1:]:
+            out = out * f
+        return out
+
+
+    def weights3P1F(self, rows, channel, correct=True):
+        return self._fullWeight(rows, channel, correct, 0.)
+
+
+    def weights2P2F(self, rows, channel, correct=True):
+        return self._fullWeight(rows, channel, correct, -1.)
+
+
+    def zWeightMigration(self, rows, l1, l2, correct):
+        out = (self.lepFakeFactor(rows, l1, True) +
+               self.lepFakeFactor(rows, l2, True))
+        # collinear correction as 3P1F
+        if correct:
+            out = out * self.zCorrection(rows, l1, l2, 0.)
+        return out
+
+
+    def weights2P2FMigration(self, rows, channel, correct=True):
+        '''
+        Weights to find the 2P2F contribution to 3P1F instead of SR.
+        '''
+        assert not self.factorized, "The factorized method has no 2P2F migration weights"
+
+        (l1, l2), (l3, l4) = _zPairs[channel]
+        z1 = self.zWeightMigration(rows, l1, l2, correct)
+        z2 = self.zWeightMigration(rows, l3, l4, correct)
+        # the string version multiplies instead of adding for mmmm
+        if channel == 'mmmm':
+            return z1 * z2
+        return z1 + z2
+
+
+    ### Factorized method (BkgManagerFactorized)
+
+    @staticmethod
+    def _factorizedFactor(fID, passID, fIso, passIso):
+        '''
+        Factorized lepFakeFactor().
+        '''
+        f = np.where(passID, 1., fID) * np.where(passIso, 1., fIso)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            out = f / (1. - f)
+        out[passID & passIso] = 1.
+        return out
+
+
+    def _factorizedInputs(self, rows, lep):
+        pt = _col(rows, lep + 'Pt')
+        absEta = np.abs(_col(rows, lep + 'Eta'))
+        return (self.fakeRates['ID'][lep[0]](pt, absEta),
+                _col(rows, lep + 'ZZTightID') > 0.5,
+                self.fakeRates['Iso'][lep[0]](pt, absEta))
+
+
+    def lepFactorsFactorized(self, rows, l1, l2):
+        '''
+        Factorized fake factors of both leptons of a Z.
+        '''
+        return [self._factorizedFactor(*(self._factorizedInputs(rows, lep) +
+                                         (_col(rows, lep + 'ZZIsoPass') > 0.5,)))
+                for lep in [l1, l2]]
+
+
+    def zWeightFactorized(self, rows, l1, l2, geom=False, relIsoCut=0.35, R=0.3):
+        '''
+        Product of the two leptons' factorized fake factors, or
+        zFakeFactorGeom() if geom is True.
+        '''
+        if not geom:
+            f1, f2 = self.lepFactorsFactorized(rows, l1, l2)
+            return f1 * f2
+
+        fID1, passID1, fIso1 = self._factorizedInputs(rows, l1)
+        fID2, passID2, fIso2 = self._factorizedInputs(rows, l2)
+
+        relIso1 = _col(rows, l1 + 'ZZIsoFSR')
+        relIso2 = _col(rows, l2 + 'ZZIsoFSR')
+        pt1 = _col(rows, l1 + 'Pt')
+        pt2 = _col(rows, l2 + 'Pt')
+        dR = _col(rows, '{}_{}_DR'.format(l1, l2))
+
+        passIso1 = relIso1 < relIsoCut
+        passIso2 = relIso2 < relIsoCut
+
+        out = (self._factorizedFactor(fID1, passID1, fIso1, passIso1) *
+               self._factorizedFactor(fID2, passID2, fIso2, passIso2))
+
+        # overlapping isolation cones
+        overlapping = ~((dR > 2. * R) | (passIso1 & passIso2))
+        if overlapping.any():
+            iso1 = relIso1 * pt1
+            iso2 = relIso2 * pt2
+
+            with np.errstate(invalid='ignore'): # non-overlapping rows
+                overlap = (2. * R * R * np.arccos(dR / (2 * R)) -
+                           0.5 * dR * np.sqrt(4 * R * R - dR * dR))
+                area = np.pi * R * R
+                ownIso1 = ((iso1 - iso2 * overlap / area) /
+                           (1. - overlap * overlap / area / area))
+                ownIso2 = iso1 + iso2 - ownIso1
+
+                passOwnIso1 = (ownIso1 / pt1) < relIsoCut
+                passOwnIso2 = (ownIso2 / pt2) < relIsoCut
+
+            fFact = (self._factorizedFactor(fID1, passID1, fIso1, passOwnIso1) *
+                     self._factorizedFactor(fID2, passID2, fIso2, passOwnIso2))
+            flip = ((passID1 & passOwnIso1 & ~passIso1) !=
+                    (passID2 & passOwnIso2 & ~passIso2))
+            fFact[flip] *= -1.
+
+            out[overlapping] = fFact[overlapping]
+
+        out[passID1 & passIso1 & passID2 & passIso2] = 1.
+
+        return out
+
+
+    ### Everything together
+
+    def weights(self, rows, channel, region, correct=True):
+        '''
+        Weights for region '3P1F', '2P2F', or '2P2FMigration'.
+        '''
+        assert region in _regions, "Unknown region {}, options are {}".format(region, ', '.join(_regions))
+        return getattr(self, 'weights' + region)(rows, channel, correct)
+
+
+    def yields(self, fileName, channel, region, observables, correct=True,
+               extraWeight=None, ntupleDir='ntuple', chunkSize=100000):
+        '''
+        Weighted yields of the control region ntuple for channel in fileName,
+        binned in each of observables, in one pass over the ntuple.
+        observables:  {name : (variable, binning)}, where variable is a
+                          branch name or a function of a ColumnBlock, and
+                          binning is like makeHist()'s
+        extraWeight:  optional function of a ColumnBlock (e.g. an
+                          ArrayWeight) to multiply the weights by, or a
+                          WeightVariations to get yields for each of its
+                          variations at once
+        Returns {name : (yields, errors)}, arrays with one entry per bin
+        including underflow and overflow (like a histogram's contents),
+        plus {'total' : (yield, error)}. With WeightVariations, each has an
+        extra first dimension, one entry per variation in the order of its
+        names.
+        '''
+        # here so the rest of ZZAnalyzer.utils doesn't need root_numpy
+        from ZZAnalyzer.utils.columnar import ColumnReader
+
+        variations = isinstance(extraWeight, WeightVariations)
+        nWeights = len(extraWeight.names) if variations else 1
+
+        axes = {name : binAxis(binning) for name, (var, binning) in observables.iteritems()}
+        sumW = {name : np.zeros((nWeights, ax[0] + 2)) for name, ax in axes.iteritems()}
+        sumW2 = {name : np.zeros((nWeights, ax[0] + 2)) for name, ax in axes.iteritems()}
+        total = np.zeros((2, nWeights))
+
+        branches = self.branchesNeeded(channel)
+        branches += [var for var, binning in observables.values()
+                     if isinstance(var, str) and var not in branches]
+
+        reader = ColumnReader(fileName, '/'.join([channel, ntupleDir]))
+        try:
+            for block in reader.blocks(branches, chunkSize):
+                w = self.weights(block, channel, region, correct)
+                if variations:
+                    w = w * extraWeight.matrix(block)
+                elif extraWeight is not None:
+                    w = w * extraWeight(block)
+                w = np.atleast_2d(w)
+
+                total[0] += w.sum(axis=1)
+                total[1] += (w * w).sum(axis=1)
+
+                for name, (var, binning) in observables.iteritems():
+                    x = var(block) if callable(var) else getattr(block, var)
+                    binW, binW2 = binnedYields(axes[name], x, w)
+                    sumW[name] += binW
+                    sumW2[name] += binW2
+        finally:
+            reader.close()
+
+        out = {name : (sumW[name], np.sqrt(sumW2[name])) for name in axes}
+        out['total'] = (total[0], np.sqrt(total[1]))
+        if not variations:
+            out = {name : (y[0], e[0]) for name, (y, e) in out.iteritems()}
+        return out
@@ -165,6 +165,7 @@ def dictFromJSONFile(fName):
         return loadJSON(f)
 
 
+_zzhelpers_imported_classes_ = {}
 def importClass(className, modType):
     '''
     Helper function for importing cut, result, and cleaner classes by name.
@@ -172,7 +173,12 @@ def importClass(className, modType):
     file it's in, modulo a '.py').
     modType should indicate whether it's for a cut class, a result class, or
     a cleaner class.
+    Each module is only loaded once per process. Loading it again would 
+    replace the class used by super() in its methods, breaking any objects
+    already made from the old version (e.g. when several Analyzers share a 
+    process).
     '''
+    global _zzhelpers_imported_classes_
     if 'cut' in modType.lower():
         zzaDir = 'cuts/cutTemplates'
     elif 'result' in modType.lower():
@@ -186,6 +192,9 @@ def importClass(className, modType):
 
     modName = os.path.join('ZZAnalyzer', zzaDir, className)
 
+    if modName in _zzhelpers_imported_classes_:
+        return _zzhelpers_imported_classes_[modName]
+
     imp.acquire_lock()
     try:
         (f,p,d) = imp.find_module(modName)
@@ -201,5 +210,7 @@ def importClass(className, modType):
     finally:
         imp.release_lock()
 
+    _zzhelpers_imported_classes_[modName] = TheClass
+
     return TheClass
 
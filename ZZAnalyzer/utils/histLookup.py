@@ -0,0 +1,265 @@
+'''
+
+Event weights from histograms, evaluated on whole arrays at once with
+NumPy instead of through compiled C++ functions (see WeightStringMaker).
+
+A HistLookup copies a histogram's bin edges and contents (and errors)
+into arrays when it's made, so after that it doesn't need ROOT, gROOT or
+the histogram at all. Looking up values for arrays of coordinates finds
+bins exactly the way TAxis::FindBin() does (including the floating point
+arithmetic for evenly binned axes): values below the axis go in the
+underflow bin, and values at or above the top of the axis (or NaN) go in
+the overflow bin. With clamp=True, under- and overflow values are moved
+into the first and last bins instead.
+
+An ArrayWeight is the product of an optional per-row expression (e.g.
+'genWeight'), an optional cut, and any number of HistLookups, each of some
+per-row variables. The plotter can take one in place of a weight string
+(see NtuplePlotter.makeHist()), and it can be evaluated directly on a
+ColumnBlock or a dict of arrays in a columnar analysis:
+
+>>> puWeight = HistLookup(fPU.puweight)
+>>> eSF = HistLookup(fSF.eleSF)
+>>> w = ArrayWeight('genWeight').times(puWeight, 'nTruePU').times(eSF, 'e1Pt', 'abs(e1Eta)')
+>>> weights = w(columns) # columns['e1Pt'] etc. are arrays
+
+Variables and expressions are TTree::Draw() expressions for the plotter;
+when evaluating directly, each is looked up in the columns by name, so to
+use a function of branches there, pass a function of the columns (e.g.
+lambda b: np.abs(b.e1Eta)) instead of a string. Strings that aren't just a
+branch name are rejected before anything is read.
+
+Author: Nate Woods, U. Wisconsin
+
+'''
+
+import hashlib
+import re
+
+import numpy as np
+
+
+def _axisInfo(axis):
+    '''
+    (nBins, low edge, high edge, array of edges or None if evenly binned)
+    for a TAxis.
+    '''
+    n = axis.GetNbins()
+    edges = None
+    if axis.GetXbins().GetSize():
+        edges = np.array([axis.GetBinLowEdge(i) for i in xrange(1, n + 2)])
+    return (n, axis.GetXmin(), axis.GetXmax(), edges)
+
+
+def findBins(axisInfo, x):
+    '''
+    Array of the bin (0 for underflow, nBins+1 for overflow) each value in
+    x would go in, like TAxis::FindBin().
+    '''
+    n, lo, hi, edges = axisInfo
+    x = np.asarray(x, dtype=np.float64)
+
+    bins = np.full(x.shape, n + 1, dtype=np.int64)
+    with np.errstate(invalid='ignore'): # NaN goes in the overflow
+        under = x < lo
+        inside = ~under & (x < hi)
+    bins[under] = 0
+
+    if edges is None:
+        bins[inside] = 1 + (n * (x[inside] - lo) / (hi - lo)).astype(np.int64)
+    else:
+        bins[inside] = np.searchsorted(edges, x[inside], side='right')
+
+    return bins
+
+
+def binAxis(binning):
+    '''
+    (nBins, low, high, edges) axis info (see findBins()) for a
+    binning like makeHist() takes: [nBins, low, high] or a list of edges.
+    '''
+    if len(binning) == 3:
+        return (int(binning[0]), float(binning[1]), float(binning[2]), None)
+    edges = np.array(binning, dtype=np.float64)
+    return (len(edges) - 1, edges[0], edges[-1], edges)
+
+
+
+class HistLookup(object):
+    '''
+    Array copy of a 1-, 2- or 3-dimensional histogram.
+    '''
+    def __init__(self, hist=None, clamp=False, axes=None, values=None,
+                 errors=None):
+        '''
+        Copy hist, or (if hist is None) make a lookup from axes (a list of
+        (nBins, low, high, edges or None)) and flat arrays of values and
+        errors in ROOT's global bin order (including under- and overflow).
+        If clamp is True, coordinates outside the histogram get the values
+        of the first or last bin instead of the under- or overflow.
+        '''
+        if hist is not None:
+            axes = [hist.GetXaxis(), hist.GetYaxis(), hist.GetZaxis()][:hist.GetDimension()]
+            axes = [_axisInfo(a) for a in axes]
+            nCells = hist.GetNcells()
+            values = np.array([hist.GetBinContent(i) for i in xrange(nCells)])
+            errors = np.array([hist.GetBinError(i) for i in xrange(nCells)])
+
+        self.axes = axes
+        self.values = np.asarray(values, dtype=np.float64)
+        if errors is None:
+            errors = np.zeros_like(self.values)
+        self.errors = np.asarray(errors, dtype=np.float64)
+        self.clamp = clamp
+
+        # global bin = ix + (nx+2) * (iy + (ny+2) * iz)
+        self.strides = []
+        stride = 1
+        for n, lo, hi, edges in self.axes:
+            self.strides.append(stride)
+            stride *= n + 2
+        assert stride == len(self.values), "Histogram values don't match its axes"
+
+
+    def shifted(self, nSigma):
+        '''
+        Same lookup with every value moved by nSigma times its error (e.g. 1
+        or -1 for systematic variations).
+        '''
+        return HistLookup(None, self.clamp, self.axes,
+                          self.values + nSigma * self.errors, self.errors)
+
+
+    def globalBins(self, *x):
+        assert len(x) == len(self.axes), "Need {} coordinates, got {}".format(len(self.axes), len(x))
+
+        out = 0
+        for axis, stride, xi in zip(self.axes, self.strides, x):
+            bins = findBins(axis, xi)
+            if self.clamp:
+                bins = np.clip(bins, 1, axis[0])
+            out = out + stride * bins
+        return out
+
+
+    def __call__(self, *x):
+        '''
+        Value of the bin each set of coordinates falls in. Coordinates can be
+        numbers or arrays.
+        '''
+        return self.values[self.globalBins(*x)]
+
+
+    def error(self, *x):
+        return self.errors[self.globalBins(*x)]
+
+
+    def key(self):
+        '''
+        Hash of the contents, for caching things made with this lookup.
+        '''
+        h = hashlib.sha1(repr([(n, lo, hi, None if e is None else e.tolist())
+                               for n, lo, hi, e in self.axes]))
+        h.update(self.values.tobytes())
+        h.update(repr(self.clamp))
+        return h.hexdigest()
+
+
+
+_branchName = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+def checkColumnExpressions(columns, expressions):
+    '''
+    Raise a ValueError if any of expressions can't be looked up in columns.
+    A dict of arrays can have anything as a key, but a ColumnBlock only
+    reads plain branches, not TTree::Draw() formulas.
+    '''
+    if isinstance(columns, dict):
+        return
+    formulas = [e for e in expressions if not _branchName.match(e)]
+    if formulas:
+        raise ValueError(("Can't evaluate {} on arrays; only branch names can be, so "
+                          "pass a function of the columns instead (or fill through "
+                          "NtuplePlotter, which uses TTree::Draw())").format(
+                              ', '.join("'{}'".format(f) for f in formulas)))
+
+
+def _column(columns, var):
+    if callable(var):
+        return var(columns)
+    if isinstance(columns, dict):
+        return columns[var]
+    return getattr(columns, var)
+
+
+class ArrayWeight(object):
+    '''
+    Per-row weight: expression * cut * lookup1(vars1) * lookup2(vars2) ...
+    '''
+    def __init__(self, expression='', cut='', lookups=[]):
+        self.expression = expression
+        self.cut = cut
+        self.lookups = list(lookups)
+
+
+    def times(self, lookup, *variables):
+        '''
+        New weight with this one multiplied by lookup(*variables).
+        '''
+        return ArrayWeight(self.expression, self.cut,
+                           self.lookups + [(lookup, variables)])
+
+
+    def withCut(self, cut):
+        '''
+        New weight with rows that fail cut (a TTree::Draw() selection) given
+        a weight of 0 (or multiplied by cut, if it isn't just true/false).
+        '''
+        if self.cut and cut:
+            cut = '({0})*({1})'.format(self.cut, cut)
+        elif self.cut:
+            cut = self.cut
+        return ArrayWeight(self.expression, cut, self.lookups)
+
+
+    def expressions(self):
+        '''
+        All string expressions that have to be evaluated for each row.
+        '''
+        out = [e for e in [self.expression, self.cut] if e]
+        for lookup, variables in self.lookups:
+            out += [v for v in variables if isinstance(v, str)]
+        return out
+
+
+    def __call__(self, columns):
+        '''
+        Array of weights for the rows in columns (a ColumnBlock, or a dict
+        mapping expressions to arrays).
+        '''
+        checkColumnExpressions(columns, self.expressions())
+
+        w = None
+        for e in [self.expression, self.cut]:
+            if e:
+                w = _column(columns, e).astype(np.float64) if w is None else w * _column(columns, e)
+        for lookup, variables in self.lookups:
+            factor = lookup(*[_column(columns, v) for v in variables])
+            w = factor if w is None else w * factor
+
+        if w is None:
+            return np.ones(len(columns) if not isinstance(columns, dict) else
+                           len(columns.values()[0]))
+        return w
+
+
+    def key(self):
+        '''
+        Hash of everything that goes into the weight, for caching.
+        '''
+        h = hashlib.sha1(repr((self.expression, self.cut)))
+        for lookup, variables in self.lookups:
+            h.update(lookup.key())
+            h.update(repr([v if isinstance(v, str) else getattr(v, '__name__', repr(v))
+                           for v in variables]))
+        return h.hexdigest()
@@ -0,0 +1,76 @@
+'''
+
+Notice when worker processes of a multiprocessing.Pool die.
+
+A Python 2 pool replaces a worker that dies (e.g. when ROOT segfaults)
+without saying anything, and the result of whatever that worker was doing
+never comes back, so anything waiting for it waits forever. A PoolWatcher
+knows which worker is running each job and which workers have died, so
+the jobs they took down with them can be failed. Jobs have to be
+submitted through runWatched(), which records the worker's PID in a dict
+shared through a multiprocessing.Manager while the job runs:
+
+>>> watcher = PoolWatcher(pool)
+>>> pool.apply_async(runWatched, args=(watcher.started, jobID, fun) + args)
+>>> ...
+>>> for jobID, pid in watcher.lost():
+>>>     # give up on jobID
+
+Call shutdown() when done, to stop the manager process.
+
+Author: Nate Woods, U. Wisconsin
+
+'''
+
+import os
+import multiprocessing
+
+
+def runWatched(started, jobID, fun, *args):
+    '''
+    Run fun(*args) in a worker process, with started[jobID] set to this
+    process's PID while it runs.
+    '''
+    started[jobID] = os.getpid()
+    try:
+        return fun(*args)
+    finally:
+        del started[jobID]
+
+
+
+class PoolWatcher(object):
+    def __init__(self, pool):
+        self.pool = pool
+        self._manager = multiprocessing.Manager()
+        # {jobID : PID} for the jobs running right now
+        self.started = self._manager.dict()
+        self._workers = self._livePIDs()
+
+
+    def _livePIDs(self):
+        # The pool doesn't give any other way to see its workers. Dead ones
+        # are removed from this list (and replaced) by the pool's own thread
+        # soon after they exit.
+        return set(p.pid for p in self.pool._pool if p.exitcode is None)
+
+
+    def lost(self):
+        '''
+        List of (jobID, PID) for every job that was running in a worker
+        that has died since the last call. Their results will never come.
+        '''
+        live = self._livePIDs()
+        dead = self._workers - live
+        self._workers = live
+        if not dead:
+            return []
+
+        lost = [(jobID, pid) for jobID, pid in self.started.items() if pid in dead]
+        for jobID, pid in lost:
+            self.started.pop(jobID, None)
+        return lost
+
+
+    def shutdown(self):
+        self._manager.shutdown()
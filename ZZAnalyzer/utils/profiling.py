@@ -0,0 +1,143 @@
+'''
+
+Opt-in timing for the analysis loop.
+
+A Profiler keeps the total time and number of calls for each stage of the
+analysis (reading rows, doing the cuts, cleaning, saving) and for each cut,
+separately for each channel. Nothing is timed unless something is wrapped
+with a Profiler, so an analysis that doesn't use one runs exactly the same
+code as before.
+
+Reports are saved as JSON, so the reports from many jobs can be added up
+with mergeReports() (see AnalysisManager.writeProfileSummary()). The format
+is
+
+>>> {'total' : wall time between making the Profiler and writing the report,
+>>>  'stages' : {channel : {stage : {'time' : seconds, 'calls' : n}}},
+>>>  'cuts' : {channel : {cut : {'time' : seconds, 'calls' : n}}},
+>>>  'specialCuts' : {channel : {cut : {'time' : seconds, 'calls' : n}}},
+>>>  }
+
+where 'cuts' are the steps of the cut flow and 'specialCuts' are the cuts
+with logic 'other' they use (which are also counted in their step). Times
+for a stage include the times of anything inside it, e.g. 'cuts' includes
+all the cuts and 'cleaning' includes the cleaner's own reading of variables.
+
+Author: Nate Woods, U. Wisconsin
+
+'''
+
+import json
+from timeit import default_timer as _timer
+
+
+class Profiler(object):
+    '''
+    Keeps track of the time taken and the number of calls for every stage
+    and every cut, for the current channel (self.channel, which whatever is
+    being profiled should keep up to date).
+    '''
+    def __init__(self):
+        self.channel = 'all'
+        self.start = _timer()
+        self.tables = {'stages' : {}, 'cuts' : {}, 'specialCuts' : {}}
+
+
+    def add(self, table, name, dt, calls=1):
+        key = (self.channel, name)
+        entry = self.tables[table].get(key, None)
+        if entry is None:
+            self.tables[table][key] = [dt, calls]
+        else:
+            entry[0] += dt
+            entry[1] += calls
+
+
+    def timed(self, fun, table, name):
+        '''
+        Version of fun that adds its time to name in table each time it's
+        called.
+        '''
+        add = self.add
+        def timedFun(*args, **kwargs):
+            start = _timer()
+            try:
+                return fun(*args, **kwargs)
+            finally:
+                add(table, name, _timer() - start)
+        return timedFun
+
+
+    def timeStage(self, fun, stage):
+        return self.timed(fun, 'stages', stage)
+
+
+    def timeCut(self, fun, cut):
+        return self.timed(fun, 'cuts', cut)
+
+
+    def timeSpecialCut(self, fun, cut):
+        return self.timed(fun, 'specialCuts', cut)
+
+
+    def timeIter(self, iterable, stage):
+        '''
+        Generator of the items of iterable, adding the time taken to get each
+        one to stage.
+        '''
+        it = iter(iterable)
+        add = self.add
+        while True:
+            start = _timer()
+            try:
+                item = next(it)
+            except StopIteration:
+                add('stages', stage, _timer() - start, 0)
+                return
+            add('stages', stage, _timer() - start)
+            yield item
+
+
+    def report(self):
+        '''
+        Dictionary of everything recorded so far (format above).
+        '''
+        out = {'total' : _timer() - self.start}
+        for table, entries in self.tables.iteritems():
+            out[table] = {}
+            for (channel, name), (dt, calls) in entries.iteritems():
+                out[table].setdefault(channel, {})[name] = {'time' : dt,
+                                                            'calls' : calls}
+        return out
+
+
+    def write(self, fileName):
+        with open(fileName, 'w') as f:
+            json.dump(self.report(), f, indent=2, sort_keys=True)
+
+
+
+def mergeReports(reports):
+    '''
+    Add up a list of reports (dicts from Profiler.report(), or names of
+    JSON files with them).
+    '''
+    out = {'total' : 0.}
+    for report in reports:
+        if isinstance(report, basestring):
+            with open(report) as f:
+                report = json.load(f)
+
+        out['total'] += report.get('total', 0.)
+        for table, channels in report.iteritems():
+            if table == 'total':
+                continue
+            for channel, entries in channels.iteritems():
+                merged = out.setdefault(table, {}).setdefault(channel, {})
+                for name, entry in entries.iteritems():
+                    if name not in merged:
+                        merged[name] = {'time' : 0., 'calls' : 0}
+                    merged[name]['time'] += entry['time']
+                    merged[name]['calls'] += entry['calls']
+
+    return out
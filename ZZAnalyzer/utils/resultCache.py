@@ -0,0 +1,336 @@
+'''
+
+Cache of analysis results, so an analysis whose inputs and code haven't
+changed doesn't have to be run again.
+
+Each output file written by AnalysisManager (outDir/sample.root, with its
+cut flow outDir/sample.txt) gets an entry in outDir/.resultCache/sample.json
+once the job is done. The entry has a key made from
+    - the input file's size and modification time (and a checksum of its
+      contents, if asked for)
+    - the channels, cleaner, maxEvents and intLumi
+    - the names of all the classes in the cutter's MRO and the cleaner's MRO
+    - a hash of the source files of those classes and of the analyzer code
+      they're used by (everything in ZZAnalyzer that the analyzers, the
+      Cutter and RowCleanerBase import, directly or not)
+and the size and modification time of the outputs. If an analysis with the
+same key is asked for later and the outputs haven't been touched, the old
+outputs are used instead of running it again.
+
+To see what's in the cache for some result directories, or remove the
+entries that are out of date, do
+
+>>> python resultCache.py list dir1 [dir2 ...]
+>>> python resultCache.py evict dir1 [dir2 ...] [--all]
+
+Author: Nate Woods, U. Wisconsin
+
+'''
+
+import os
+import re
+import json
+import inspect
+import hashlib
+import time
+
+from ZZAnalyzer.utils.helpers import parseChannels
+from ZZAnalyzer.cuts import getCutClass
+from ZZAnalyzer.cleaning import getCleanerClass
+
+
+_zzaDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Things that can change the results without being part of a cutter or
+# cleaner, along with all ZZAnalyzer modules they import (see _codeFiles())
+_seedFiles = [
+    'analyzers/Analyzer.py',
+    'analyzers/MultiAnalyzer.py',
+    'cuts/Cutter.py',
+    'cleaning/RowCleanerBase.py',
+    ]
+
+_importRegex = re.compile(r'^\s*(?:from\s+([\w.]+)\s+import|import\s+([\w.]+))', re.MULTILINE)
+
+_allCodeFiles = None
+
+_cacheDirName = '.resultCache'
+
+
+def _hashFile(fileName, blockSize=1<<20):
+    h = hashlib.sha1()
+    with open(fileName, 'rb') as f:
+        while True:
+            block = f.read(blockSize)
+            if not block:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+
+def _moduleFile(module, fromDir):
+    '''
+    Source file of module (a dotted name, or a module next to fromDir,
+    Python 2 style), or None if it's not part of ZZAnalyzer.
+    '''
+    if module.startswith('ZZAnalyzer.'):
+        base = os.path.join(_zzaDir, *module.split('.')[1:])
+    elif '.' not in module:
+        base = os.path.join(fromDir, module)
+    else:
+        return None
+
+    for f in [base + '.py', os.path.join(base, '__init__.py')]:
+        if os.path.isfile(f):
+            return f
+    return None
+
+
+def _codeFiles():
+    '''
+    The seed files and every ZZAnalyzer source file they import, directly
+    or through other ZZAnalyzer modules (found by reading the import
+    statements, so it doesn't matter what this process has imported).
+    '''
+    global _allCodeFiles
+    if _allCodeFiles is None:
+        found = set()
+        toRead = [os.path.join(_zzaDir, f) for f in _seedFiles]
+        while toRead:
+            fileName = toRead.pop()
+            if fileName in found:
+                continue
+            found.add(fileName)
+            with open(fileName) as f:
+                source = f.read()
+            for m in _importRegex.finditer(source):
+                for module in (m.group(1) or m.group(2)).split(','):
+                    imported = _moduleFile(module.strip(), os.path.dirname(fileName))
+                    if imported is not None:
+                        toRead.append(imported)
+        _allCodeFiles = sorted(found)
+    return _allCodeFiles
+
+
+def _fileStamp(fileName):
+    st = os.stat(fileName)
+    return [st.st_size, st.st_mtime]
+
+
+def _classFiles(Class):
+    '''
+    Names and source files of all classes in Class's MRO (except object).
+    '''
+    out = []
+    for C in Class.__mro__:
+        if C is object:
+            continue
+        try:
+            source = inspect.getsourcefile(C)
+        except TypeError:
+            source = None
+        out.append(('.'.join([C.__module__, C.__name__]), source))
+    return out
+
+
+def outputFiles(params):
+    '''
+    The files an analysis with these parameters writes.
+    '''
+    outFile = os.path.join(params['outDir'], os.path.basename(params['inFile']))
+    return [outFile, outFile.replace('.root', '.txt')]
+
+
+def analysisKey(params, checksum=False):
+    '''
+    Hash of everything that goes into an analysis's results. params is a dict
+    with the arguments of AnalysisManager.runAnAnalyzer (inFile, channels,
+    baseCuts, cutModifiers, cleanRows, maxEvents, intLumi).
+    Raises OSError if the input file doesn't exist.
+    '''
+    classes = _classFiles(getCutClass(params['baseCuts'], *params['cutModifiers']))[1:] # first is made on the fly
+    if params['cleanRows']:
+        classes += _classFiles(getCleanerClass(params['cleanRows']))
+
+    sources = set(_codeFiles())
+    sources.update(s for c, s in classes if s is not None)
+
+    keyInfo = {
+        'input' : _fileStamp(params['inFile']),
+        'channels' : sorted(parseChannels(params['channels'])),
+        'classes' : [c for c, s in classes],
+        'cleanRows' : params['cleanRows'],
+        'maxEvents' : repr(float(params['maxEvents'])),
+        'intLumi' : repr(params['intLumi']),
+        'code' : sorted((os.path.relpath(s, _zzaDir), _hashFile(s)) for s in sources),
+        }
+    if checksum:
+        keyInfo['inputChecksum'] = _hashFile(params['inFile'])
+
+    return hashlib.sha1(json.dumps(keyInfo, sort_keys=True)).hexdigest()
+
+
+
+class ResultCache(object):
+    '''
+    The cache entries for one result directory.
+    '''
+    def __init__(self, outDir, checksum=False):
+        '''
+        If checksum is True, input files are identified by a hash of their
+        contents as well as their size and modification time. This is safer
+        but means reading every input file.
+        '''
+        self.outDir = outDir
+        self.cacheDir = os.path.join(outDir, _cacheDirName)
+        self.checksum = checksum
+
+
+    def entryFile(self, inFile):
+        return os.path.join(self.cacheDir,
+                            os.path.basename(inFile).replace('.root', '.json'))
+
+
+    def _params(self, params):
+        out = {k : params[k] for k in ['inFile', 'channels', 'baseCuts',
+                                       'cutModifiers', 'cleanRows',
+                                       'maxEvents', 'intLumi']}
+        out['outDir'] = self.outDir
+        out['cutModifiers'] = list(out['cutModifiers'])
+        out['maxEvents'] = repr(out['maxEvents']) # may be inf
+        return out
+
+
+    @staticmethod
+    def _unpackParams(stored):
+        params = stored.copy()
+        params['maxEvents'] = float(params['maxEvents'])
+        if isinstance(params['channels'], basestring):
+            params['channels'] = str(params['channels']) # JSON gives unicode
+        return params
+
+
+    def store(self, params):
+        '''
+        Record that the analysis with these parameters was just done.
+        '''
+        if not os.path.isdir(self.cacheDir):
+            try:
+                os.makedirs(self.cacheDir)
+            except OSError: # another job made it first
+                if not os.path.isdir(self.cacheDir):
+                    raise
+
+        entry = {
+            'key' : analysisKey(params, self.checksum),
+            'checksum' : self.checksum,
+            'params' : self._params(params),
+            'outputs' : {f : _fileStamp(f) for f in outputFiles(params)},
+            'created' : time.time(),
+            }
+
+        # write and rename, so nobody ever reads half an entry
+        fileName = self.entryFile(params['inFile'])
+        with open(fileName + '.tmp', 'w') as f:
+            json.dump(entry, f, indent=2, sort_keys=True)
+        os.rename(fileName + '.tmp', fileName)
+
+
+    def _load(self, fileName):
+        try:
+            with open(fileName) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return None
+
+
+    def status(self, entry):
+        '''
+        'valid' if an entry can be used, 'missing output' if the outputs were
+        removed or changed, or 'stale' if the input or the code changed.
+        '''
+        if entry is None:
+            return 'stale'
+        for f, stamp in entry['outputs'].iteritems():
+            if not os.path.exists(f) or _fileStamp(f) != stamp:
+                return 'missing output'
+        try:
+            key = analysisKey(self._unpackParams(entry['params']),
+                              entry.get('checksum', False))
+        except (OSError, IOError, ImportError):
+            return 'stale'
+        if key != entry['key']:
+            return 'stale'
+        return 'valid'
+
+
+    def lookup(self, params):
+        '''
+        True if the outputs of an earlier analysis with the same parameters,
+        input, and code can be used.
+        '''
+        entry = self._load(self.entryFile(params['inFile']))
+        if entry is None or self._params(params) != entry['params']:
+            return False
+        return self.status(entry) == 'valid'
+
+
+    def entries(self):
+        '''
+        List of (entry file, entry, status) for everything in the cache.
+        '''
+        if not os.path.isdir(self.cacheDir):
+            return []
+
+        out = []
+        for name in sorted(os.listdir(self.cacheDir)):
+            if not name.endswith('.json'):
+                continue
+            fileName = os.path.join(self.cacheDir, name)
+            entry = self._load(fileName)
+            out.append((fileName, entry, self.status(entry)))
+        return out
+
+
+    def evict(self, everything=False):
+        '''
+        Remove all entries that can't be used any more (or all entries if
+        everything is True). The outputs themselves are left alone. Returns
+        the names of the removed entry files.
+        '''
+        removed = []
+        for fileName, entry, status in self.entries():
+            if everything or status != 'valid':
+                os.remove(fileName)
+                removed.append(fileName)
+        return removed
+
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='List or remove cached analysis results.')
+    parser.add_argument('action', type=str, choices=['list', 'evict'],
+                        help='What to do with the cache entries.')
+    parser.add_argument('dirs', type=str, nargs='+',
+                        help='Result directories whose caches to look at.')
+    parser.add_argument('--all', action='store_true',
+                        help='When evicting, remove all entries, not just stale ones.')
+    args = parser.parse_args()
+
+    for d in args.dirs:
+        cache = ResultCache(d)
+        if args.action == 'list':
+            print d
+            for fileName, entry, status in cache.entries():
+                if entry is None:
+                    print "    {:40} {}".format(os.path.basename(fileName), 'unreadable')
+                    continue
+                print "    {:40} {:15} {} + [{}], made {}".format(os.path.basename(fileName), status,
+                                                                 entry['params']['baseCuts'],
+                                                                 ', '.join(entry['params']['cutModifiers']),
+                                                                 time.ctime(entry['created']))
+        else:
+            removed = cache.evict(args.all)
+            print "{}: removed {} entries".format(d, len(removed))
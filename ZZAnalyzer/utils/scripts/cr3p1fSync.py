@@ -2,7 +2,8 @@
 
 Dump candidate information in the approved HZZ4l sync format, for the 3 prompt 1 fake control region.
 
-Is most useful when sorted afterwards with a command like
+The events are sorted by run, then lumi, then event, the same as processing
+the same-but-unsorted output with the Unix command
 
 $ sort -t : -k 1n -k 2n -k 3n
 
@@ -14,42 +15,44 @@ Author: N. Woods, U. Wisconsin
 
 '''
 
-from ZZAnalyzer.utils.helpers import evVar
+from ZZAnalyzer.utils.syncDump import SyncDumper, atLeast
 from ZZAnalyzer.cuts import getCutClass
 
-from rootpy.io import root_open
 import argparse
 
-        
-def getObjects(channel):
-    nObj = {}
-    for letter in channel:
-        if letter not in nObj:
-            nObj[letter] = 1
-        else:
-            nObj[letter] += 1
-    out = []
-    for letter in nObj:
-        if nObj[letter] == 1:
-            out.append(letter)
-        else:
-            out += [letter+str(n+1) for n in range(nObj[letter])]
-    return out
-
-
-def getCandInfo(z1Var, z2Var, row):
-    run = evVar(row, 'run')
-    evt = evVar(row, 'evt')
-    lumi = evVar(row, 'lumi')
-    mass = evVar(row, 'MassFSR')
-    mZ1 = evVar(row, z1Var)
-    mZ2 = evVar(row, z2Var)
-
-    kd = evVar(row, 'D_bkg_kin')
-    nJets = evVar(row, 'nJets')
-    j1pt = max(-1.,evVar(row, 'jet1Pt'))
-    j2pt = max(-1.,evVar(row, 'jet2Pt'))
-    return ("%d:%d:%d:%.2f:%.2f:%.2f:%.3f:%d:%.2f:%.2f\n"%(run, lumi, evt, mass, mZ1, mZ2, kd, nJets, j1pt, j2pt))
+import numpy as np
+
+
+def getCandInfo(cutter, rows, channel, objects):
+    if cutter.needReorder(channel):
+        orders = cutter.orderLeptonsArray(rows, channel, objects)
+    else:
+        orders = [(None, objects)]
+
+    mZ1 = np.empty(len(rows))
+    mZ2 = np.empty(len(rows))
+    for mask, obs in orders:
+        if mask is None:
+            mask = slice(None)
+        mZ1[mask] = getattr(rows, "%s_%s_MassFSR"%(obs[0], obs[1]))[mask]
+        mZ2[mask] = getattr(rows, "%s_%s_MassFSR"%(obs[2], obs[3]))[mask]
+
+    return {
+        'run' : rows.run,
+        'lumi' : rows.lumi,
+        'event' : rows.evt,
+        'mass' : rows.MassFSR,
+        'mZ1' : mZ1,
+        'mZ2' : mZ2,
+        'kd' : rows.D_bkg_kin,
+        'nJets' : rows.nJets.astype(int),
+        'j1pt' : atLeast(rows.jet1Pt),
+        'j2pt' : atLeast(rows.jet2Pt),
+        }
+
+
+outTemp = ('{run:d}:{lumi:d}:{event:d}:{mass:.2f}:{mZ1:.2f}:{mZ2:.2f}:{kd:.3f}:'
+           '{nJets:d}:{j1pt:.2f}:{j2pt:.2f}\n')
 
 
 parser = argparse.ArgumentParser(description='Dump information about the 3P1F CR 4l candidates in an ntuple to a text file, for synchronization.')
@@ -62,37 +65,19 @@ parser.add_argument('channels', nargs='?', type=str, default='zz',
 #                     help='Maximum number of threads for simultaneous processing. If unspecified, python figures how many your machine can deal with automatically, to a maximum of 4.')
 
 args = parser.parse_args()
-        
+
 if args.channels == 'zz':
     channels = ['eeee', 'eemm', 'mmmm']
 else:
     channels = args.channels.split(',')
-        
-inFile = args.input[0]
-        
-cutter = getCutClass('BaseCuts2016', 'HZZ2016', 'ControlRegion_OS_3P1F')()
-
-with root_open(inFile) as fin:
-    with open(args.output, 'w') as fout:
-        for channel in channels:
-            print "\nChannel %s:"%channel
-            ntuple = fin.Get(channel+'/ntuple')
-            objects = getObjects(channel)
-            needReorder = cutter.needReorder(channel)
-        
-            for n, row in enumerate(ntuple):
-                if n % 500 == 0:
-                    print "Processing row %d"%n
-                obs = cutter.orderLeptons(row, channel, objects) if needReorder else objects
-                z1MassVar = "%s_%s_MassFSR"%(obs[0], obs[1])
-                z2MassVar = "%s_%s_MassFSR"%(obs[2], obs[3])
-                fout.write(getCandInfo(z1MassVar, z2MassVar, row))
-                    
-print "Done!"
-
-
-
 
+inFile = args.input[0]
 
+cutter = getCutClass('BaseCuts2016', 'HZZ2016', 'ControlRegion_OS_3P1F')()
 
+dumper = SyncDumper(outTemp,
+                    lambda rows, channel, objects: getCandInfo(cutter, rows, channel, objects),
+                    verbose=True)
+dumper.dump(inFile, channels, args.output)
 
+print "Done!"
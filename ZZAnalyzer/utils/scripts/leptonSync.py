@@ -3,7 +3,9 @@
 Dump lepton information in the approved HZZ4l sync format.
 Only does each lepton once regardless of number of rows. Sorts by pt.
 
-Is most useful when sorted afterwards with a command like
+The leptons are sorted by run, then lumi, then event, then pt (highest
+first), the same as processing the same-but-unsorted output with the Unix
+command
 
 $ sort -t : -k 1n -k 2n -k 3n -k5nr leptonSync.txt
 
@@ -11,84 +13,51 @@ Author: N. Woods, U. Wisconsin
 
 '''
 
-from ZZAnalyzer.utils.helpers import evVar, objVar
+from ZZAnalyzer.utils.syncDump import SyncDumper
 
-from rootpy.io import root_open
 import argparse
 
-
-class LeptonCollection(object):
-    class Lepton(object):
-        def __init__(self, name, row, pt=0):
-            if pt != 0:
-                self.pt = pt
-            else:
-                self.pt = objVar(row, 'Pt', name)
-            self.eta = objVar(row, 'Eta', name)
-            self.phi = objVar(row, 'Phi', name)
-            self.sip = objVar(row, 'SIP3D', name)
-            self.chHadIso = objVar(row, 'PFChargedIso', name)
-            self.neutHadIso = objVar(row, 'PFNeutralIso', name)
-            self.phoIso = objVar(row, 'PFPhotonIso', name)
-            self.puCorr = 0 # daughter class must define
-            self.combRelIso = -1 # Daughter class must define
-            self.bdt = 0 # daughter class must define (if electron)
-            self.pdgId = 0 # daughter class must define
-        def dumpInfo(self, run, lumi, evt):
-            return ("%d:%d:%d:%d:%.2f:%.2f:%.2f:%.2f:%.2f:%.2f:%.2f:%.2f:%.3f:%.3f\n"%(run, lumi, evt, self.pdgId, self.pt, self.eta, \
-                                                                               self.phi, self.sip, self.chHadIso, self.neutHadIso, \
-                                                                               self.phoIso, self.puCorr, self.combRelIso, self.bdt))
-    class Muon(Lepton):
-        def __init__(self, name, row, pt=0):
-            super(LeptonCollection.Muon, self).__init__(name, row, pt)
-            self.combRelIso = objVar(row, 'RelPFIsoDBDefault', name)
-            self.pdgId = -13 * objVar(row, "Charge", name)
-            self.puCorr = objVar(row, "PFPUChargedIso", name)
-
-    class Electron(Lepton):
-        def __init__(self, name, row, pt=0):
-            super(LeptonCollection.Electron, self).__init__(name, row, pt)
-            self.combRelIso = objVar(row, 'RelPFIsoRho', name)
-            self.bdt = objVar(row, 'MVANonTrigID', name)
-            self.pdgId = -11 * objVar(row, "Charge", name)
-            self.puCorr = objVar(row, 'Rho', name)
-                                                        
-                     
-    def __init__(self, run, lumi, evt):
-        self.leptons = {}
-        self.run = run
-        self.lumi = lumi
-        self.evt = evt
-
-    def addLepton(self, name, row):
-        pt = objVar(row, 'Pt', name)
-        if pt in self.leptons:
-            # Do nothing if we've already seen this one
-            return
+import numpy as np
+
+
+def getLeptonInfo(rows, channel, objects):
+    '''
+    One entry per lepton per row, for all leptons in rows.
+    '''
+    leptons = []
+    for name in objects:
+        lep = lambda var: getattr(rows, name+var)
+        info = {
+            'run' : rows.run,
+            'lumi' : rows.lumi,
+            'event' : rows.evt,
+            'pt' : lep('Pt'),
+            'eta' : lep('Eta'),
+            'phi' : lep('Phi'),
+            'sip' : lep('SIP3D'),
+            'chHadIso' : lep('PFChargedIso'),
+            'neutHadIso' : lep('PFNeutralIso'),
+            'phoIso' : lep('PFPhotonIso'),
+            }
         if name[0] == 'e':
-            self.leptons[pt] = LeptonCollection.Electron(name, row, pt)
-        else:
-            self.leptons[pt] = LeptonCollection.Muon(name, row, pt)
-
-    def writeAll(self, oFile):
-        for pt in sorted(self.leptons.keys(), reverse=True):
-            oFile.write(self.leptons[pt].dumpInfo(self.run, self.lumi, self.evt))
-
-        
-def getObjects(channel):
-    nObj = {}
-    for letter in channel:
-        if letter not in nObj:
-            nObj[letter] = 1
+            info['pdgId'] = (-11 * lep('Charge')).astype(int)
+            info['puCorr'] = lep('Rho')
+            info['combRelIso'] = lep('RelPFIsoRho')
+            info['bdt'] = lep('MVANonTrigID')
         else:
-            nObj[letter] += 1
-    out = []
-    for letter in nObj:
-        if nObj[letter] == 1:
-            out.append(letter)
-        else:
-            out += [letter+str(n+1) for n in range(nObj[letter])]
-    return out
+            info['pdgId'] = (-13 * lep('Charge')).astype(int)
+            info['puCorr'] = lep('PFPUChargedIso')
+            info['combRelIso'] = lep('RelPFIsoDBDefault')
+            info['bdt'] = np.zeros(len(rows))
+        leptons.append(info)
+
+    return {k : np.concatenate([info[k] for info in leptons]) for k in leptons[0]}
+
+
+outTemp = ('{run:d}:{lumi:d}:{event:d}:{pdgId:d}:{pt:.2f}:{eta:.2f}:{phi:.2f}:'
+           '{sip:.2f}:{chHadIso:.2f}:{neutHadIso:.2f}:{phoIso:.2f}:{puCorr:.2f}:'
+           '{combRelIso:.3f}:{bdt:.3f}\n')
+
 
 parser = argparse.ArgumentParser(description='Dump information about the leptons in an ntuple to a text file, for synchronization.')
 parser.add_argument('input', type=str, nargs=1, help='Input root file')
@@ -108,35 +77,12 @@ else:
 
 inFile = args.input[0]
 
-with root_open(inFile) as fin:
-    with open(args.output, 'w') as fout:
-        for channel in channels:
-            print "\nChannel %s:"%channel
-            ntuple = fin.Get(channel+'/ntuple')
-            objects = getObjects(channel)
-            evtLeps = LeptonCollection(-1,-1,-1)
-            
-            for n, row in enumerate(ntuple):
-                if n % 500 == 0:
-                    print "Processing row %d"%n
-                evt = evVar(row, 'evt')
-                lumi = evVar(row, 'lumi')
-                run = evVar(row, 'run')
-                if evt != evtLeps.evt or lumi != evtLeps.lumi or run != evtLeps.run:
-                    evtLeps.writeAll(fout)
-                    evtLeps = LeptonCollection(run, lumi, evt)
-                
-                for lep in objects:
-                    evtLeps.addLepton(lep, row)
-                    
-            # Make sure the last row gets written
-            evtLeps.writeAll(fout)
+# leptons are identified by their pt; each is written once per event in
+# each channel
+dumper = SyncDumper(outTemp, getLeptonInfo,
+                    unique=['run', 'lumi', 'event', 'pt'],
+                    sortBy=['run', 'lumi', 'event', ('pt', True)],
+                    verbose=True)
+dumper.dump(inFile, channels, args.output)
 
 print "Done!"
-
-
-
-
-
-
-
@@ -11,6 +11,9 @@ the same-but-unsorted output with the Unix command
 
 $ sort -t : -k 1n -k 2n -k 3n
 
+The ntuples are read and the fields computed a chunk of rows at a time
+(see ZZAnalyzer/utils/syncDump.py).
+
 Author: N. Woods, U. Wisconsin
 
 '''
@@ -19,155 +22,86 @@ import logging
 from rootpy import log as rlog; rlog = rlog['/smpSync']
 logging.basicConfig(level=logging.WARNING)
 rlog["/ROOT.TUnixSystem.SetDisplay"].setLevel(rlog.ERROR)
-rlog["/rootpy.tree.chain"].setLevel(rlog.WARNING)
 
-from ZZAnalyzer.utils.helpers import evVar, objVar, nObjVar, parseChannels, zMassDist
+from ZZAnalyzer.utils.helpers import parseChannels
+from ZZAnalyzer.utils.histLookup import HistLookup
+from ZZAnalyzer.utils.syncDump import SyncDumper, getObjects, jaggedLengths, \
+    jaggedAt, atLeast, orderedZMasses
 
 from rootpy import asrootpy
 from rootpy.io import root_open
-from rootpy.tree import TreeChain
 import argparse
 from glob import glob
 from os import environ
 from os.path import join
 
+import numpy as np
 
-def getObjects(channel):
-    nObj = {}
-    for letter in channel:
-        if letter not in nObj:
-            nObj[letter] = 1
-        else:
-            nObj[letter] += 1
-    out = []
-    for letter in nObj:
-        if nObj[letter] == 1:
-            out.append(letter)
-        else:
-            out += [letter+str(n+1) for n in range(nObj[letter])]
-    return sorted(out)
-
-
-def getEventInfo(row, *args):
-    return {
-        'run' : evVar(row, 'run'),
-        'event' : evVar(row, 'evt'),
-        'lumi' : evVar(row, 'lumi'),
-        }
-
-
-def getCandInfo(row, hPUWt, *objects):
-    numbers = {}
-    numbers['run'] = row.run
-    numbers['lumi'] = row.lumi
-    numbers['event'] = row.evt
-    numbers['m4l'] = evVar(row, 'Mass')
-    numbers['mZ1'] = nObjVar(row, 'Mass', objects[0], objects[1])
-    numbers['mZ2'] = nObjVar(row, 'Mass', objects[2], objects[3])
-
-    # eemm channel may have masses swapped
-    if zMassDist(numbers['mZ1']) > zMassDist(numbers['mZ2']):
-        temp = numbers['mZ2']
-        numbers['mZ2'] = numbers['mZ1']
-        numbers['mZ1'] = temp
-
-    jetPts = evVar(row, 'jetPt')
-    numbers['nJets'] = jetPts.size()
-    if jetPts.size():
-        numbers['jet1pt'] = jetPts.at(0)
-        if jetPts.size() > 1:
-            numbers['jet2pt'] = jetPts.at(1)
-        else:
-            numbers['jet2pt'] = -1.
-    else:
-        numbers['jet1pt'] = -1.
-        numbers['jet2pt'] = -1.
-
-    numbers['puWt'] = hPUWt.GetBinContent(hPUWt.FindBin(evVar(row, 'nTruePU')))
-    recoSF = 1.
-    selSF = 1.
-    for ob in objects:
-        if ob[0] == 'm':
-            selSF *= objVar(row, 'EffScaleFactor', ob)
-        else:
-            recoSF *= objVar(row, 'TrkRecoEffScaleFactor', ob)
-            selSF *= objVar(row, 'IDIsoEffScaleFactor', ob)
-
-    numbers['recoSF'] = recoSF
-    numbers['selSF'] = selSF
-
-    numbers['nPU'] = evVar(row, 'nTruePU')
 
-    numbers['mjj'] = max(-1.,evVar(row, 'mjj'))
+def objectsFor(channel):
+    objects = getObjects(channel, sort=True)
+    if channel == 'emm':
+        objects = objects[1:]+objects[:1]
+    return objects
 
-    return numbers
 
+def zMass(rows, ob1, ob2):
+    return getattr(rows, '{}_{}_Mass'.format(ob1, ob2))
 
-def getGenCandInfo(row, hPUWt, *objects):
-    numbers = {}
-    numbers['mZ1'] = nObjVar(row, 'Mass', objects[0], objects[1])
-    if numbers['mZ1'] < 60.:
-        return None
-    numbers['mZ2'] = nObjVar(row, 'Mass', objects[2], objects[3])
-    if numbers['mZ2'] < 60.:
-        return None
 
-    # eemm channel may have masses swapped
-    if zMassDist(numbers['mZ1']) > zMassDist(numbers['mZ2']):
-        temp = numbers['mZ2']
-        numbers['mZ2'] = numbers['mZ1']
-        numbers['mZ1'] = temp
+def zMasses(rows, objects):
+    return orderedZMasses(zMass(rows, *objects[:2]), zMass(rows, *objects[2:4]))
 
-    numbers['run'] = row.run
-    numbers['lumi'] = row.lumi
-    numbers['event'] = row.evt
-    numbers['m4l'] = evVar(row, 'Mass')
 
-    jetPts = evVar(row, 'jetPt')
-    numbers['nJets'] = jetPts.size()
-    if jetPts.size():
-        numbers['jet1pt'] = jetPts.at(0)
-        if jetPts.size() > 1:
-            numbers['jet2pt'] = jetPts.at(1)
+def scaleFactors(rows, objects):
+    '''
+    (reco scale factor, selection scale factor) for each row.
+    '''
+    recoSF = np.ones(len(rows))
+    selSF = np.ones(len(rows))
+    for ob in objects:
+        if ob[0] == 'm':
+            selSF *= getattr(rows, ob+'EffScaleFactor')
         else:
-            numbers['jet2pt'] = -1.
-    else:
-        numbers['jet1pt'] = -1.
-        numbers['jet2pt'] = -1.
+            recoSF *= getattr(rows, ob+'TrkRecoEffScaleFactor')
+            selSF *= getattr(rows, ob+'IDIsoEffScaleFactor')
+    return recoSF, selSF
 
-    numbers['mjj'] = max(-1.,evVar(row, 'mjj'))
 
-    return numbers
+def getGenFields():
+    return {
+        'm4l' : lambda rows, objects: rows.Mass,
+        'mZ1' : lambda rows, objects: zMasses(rows, objects)[0],
+        'mZ2' : lambda rows, objects: zMasses(rows, objects)[1],
+        'nJets' : lambda rows, objects: jaggedLengths(rows.jetPt),
+        'jet1pt' : lambda rows, objects: jaggedAt(rows.jetPt, 0),
+        'jet2pt' : lambda rows, objects: jaggedAt(rows.jetPt, 1),
+        'mjj' : lambda rows, objects: atLeast(rows.mjj),
+        }
 
 
-def getCandInfo3l(row, hPUWt, *objects):
-    numbers = {}
-    numbers['run'] = row.run
-    numbers['lumi'] = row.lumi
-    numbers['event'] = row.evt
-    numbers['m3l'] = evVar(row, 'Mass')
-    numbers['mZ'] = nObjVar(row, 'Mass', objects[0], objects[1])
-    numbers['ptL3'] = objVar(row, 'Pt', objects[2])
-    numbers['l3Tight'] = 1 if objVar(row, 'ZZTightID', objects[2]) and objVar(row, 'ZZIsoPass', objects[2]) else 0
+def getCandFields(puWt):
+    fields = getGenFields()
+    fields['puWt'] = lambda rows, objects: puWt(rows.nTruePU)
+    fields['recoSF'] = lambda rows, objects: scaleFactors(rows, objects)[0]
+    fields['selSF'] = lambda rows, objects: scaleFactors(rows, objects)[1]
+    fields['nPU'] = lambda rows, objects: rows.nTruePU
+    return fields
 
-    return numbers
 
+def getCandFields3l():
+    return {
+        'm3l' : lambda rows, objects: rows.Mass,
+        'mZ' : lambda rows, objects: zMass(rows, *objects[:2]),
+        'ptL3' : lambda rows, objects: getattr(rows, objects[2]+'Pt'),
+        'l3Tight' : lambda rows, objects: ((getattr(rows, objects[2]+'ZZTightID') != 0) &
+                                           (getattr(rows, objects[2]+'ZZIsoPass') != 0)).astype(int),
+        }
 
-def getAllInfo(channel, ntuple, fInfo, hPUWt):
-    found = set()
-    objects = getObjects(channel)
-    if channel == 'emm':
-        objects = objects[1:]+objects[:1]
 
-    for row in ntuple:
-        numbers = fInfo(row, hPUWt, *objects)
-        if numbers is None:
-            continue
-        evtID = (numbers['run'],numbers['lumi'],numbers['event'])
-        if evtID in found:
-            continue
-        found.add(evtID)
-        yield numbers
+def genSelection(rows, objects):
+    # NaN masses pass, as they always have
+    return ~(zMass(rows, *objects[:2]) < 60.) & ~(zMass(rows, *objects[2:4]) < 60.)
 
 
 if __name__ == '__main__':
@@ -201,58 +135,28 @@ if __name__ == '__main__':
 
     inFiles = glob(args.input[0])
 
-    outStrings = []
-    outStringsGen = []
-
     if args.listOnly:
         outTemp = '{run}:{lumi}:{event}:{channel}\n'
-        infoGetter = getEventInfo
+        fields = {}
     elif args.zPlusL:
         outTemp = ('{run}:{lumi}:{event}:{channel}:{m3l:.2f}:{mZ:.2f}:{ptL3:.2f}:'
                    '{l3Tight}\n')
-        infoGetter = getCandInfo3l
+        fields = getCandFields3l()
         args.doGen = False
 
     else:
         outTemp = ('{run}:{lumi}:{event}:{channel}:{m4l:.2f}:{mZ1:.2f}:{mZ2:.2f}:'
                    '{nJets}:{jet1pt:.2f}:{jet2pt:.2f}:{mjj:.2f}:{puWt:.4f}:{recoSF:.4f}:{selSF:.4f}:{nPU:.2f}\n')
-        infoGetter = getCandInfo
+        fields = getCandFields(HistLookup(hPUWt))
 
     outTempGen = ('{run}:{lumi}:{event}:{channel}:{m4l:.2f}:{mZ1:.2f}:{mZ2:.2f}:'
                   '{nJets}:{jet1pt:.2f}:{jet2pt:.2f}:{mjj:.2f}\n')
 
-    for channel in channels:
-        if channel == 'emm':
-            channelForStr = 'mme' # for sync with Torino
-        else:
-            channelForStr = channel
-
-        if len(inFiles) == 1:
-            with root_open(inFiles[0]) as fin:
-                n = fin.Get(channel+'/ntuple')
-                for numbers in getAllInfo(channel, n, infoGetter, hPUWt):
-                    outStrings.append(outTemp.format(channel=channelForStr,
-                                                     **numbers))
-                if args.doGen:
-                    n = fin.Get(channel+'Gen/ntuple')
-                    for numbers in getAllInfo(channel, n, getGenCandInfo, hPUWt):
-                        outStringsGen.append(outTempGen.format(channel=channelForStr,
-                                                               **numbers))
+    channelNames = {'emm' : 'mme'} # for sync with Torino
 
-        else:
-            n = TreeChain(channel+'/ntuple', inFiles)
-            for numbers in getAllInfo(channel, n, infoGetter, hPUWt):
-                outStrings.append(outTemp.format(channel=channelForStr,
-                                                     **numbers))
-            if args.doGen:
-                n = TreeChain(channel+'Gen/ntuple', inFiles)
-                for numbers in getAllInfo(channel, n, getGenCandInfo, hPUWt):
-                    outStringsGen.append(outTempGen.format(channel=channelForStr,
-                                                           **numbers))
-
-    with open(args.output, 'w') as fout:
-        for s in sorted(outStrings, key=lambda x: [int(y) for y in x.split(':')[:3]]):
-            fout.write(s)
+    # first row of each event in each channel
+    SyncDumper(outTemp, fields, objectsFor, unique=['run', 'lumi', 'event'],
+               channelNames=channelNames).dump(inFiles, channels, args.output)
 
     if args.doGen:
         if '.' in args.output:
@@ -260,7 +164,7 @@ if __name__ == '__main__':
         else:
             outputGen = args.output+'Gen'
 
-        with open(outputGen, 'w') as fout:
-            for s in sorted(outStringsGen, key=lambda x: [int(y) for y in x.split(':')[:3]]):
-                fout.write(s)
-
+        SyncDumper(outTempGen, getGenFields(), objectsFor, selection=genSelection,
+                   unique=['run', 'lumi', 'event'],
+                   channelNames=channelNames).dump(inFiles, channels, outputGen,
+                                                   '{channel}Gen/ntuple')
@@ -0,0 +1,249 @@
+'''
+
+Compare two sync files (from smpSync.py, finalSync.py, other groups...)
+event by event, and write the events that don't agree in the format
+SyncAnalyzer reads (run:lumi:event, one per line).
+
+Lines are matched by run:lumi:event, packed into one integer per line (see
+ZZAnalyzer/utils/eventIndex.py), so even files with millions of lines are
+compared with a few sorts and binary searches. Reported are
+    - events only in file A
+    - events only in file B
+    - events in both where any of the other fields differ, numbers by more
+          than the tolerance and anything else (e.g. the channel) at all
+If an event is in a file more than once, only its first line is used.
+
+Leading spaces, '<' and '>' (from diff output) and leading non-numeric
+fields (like the channel from finalSync.py --printChannel) are ignored.
+
+Author: N. Woods, U. Wisconsin
+
+'''
+
+from ZZAnalyzer.utils.eventIndex import EventIndex, unpackKeys
+
+import argparse
+import gc
+from itertools import izip
+
+import numpy as np
+
+
+def _dropPrefix(words):
+    '''
+    words without the non-numeric fields before run:lumi:event.
+    '''
+    for i, w in enumerate(words):
+        if w.isdigit():
+            return words[i:]
+    return []
+
+
+def _parseColumn(words, i, fileName):
+    '''
+    Array of the non-negative integers in field i of every line.
+    '''
+    # NumPy's text parser is much faster than int() on every line or
+    # converting an array of strings
+    out = np.fromstring(' '.join([w[i] for w in words]), dtype=np.uint64, sep=' ')
+    if len(out) != len(words):
+        raise ValueError("Field {} of some lines of {} is not a number".format(i + 1, fileName))
+    return out
+
+
+def readSyncFile(fileName):
+    '''
+    (EventIndex, fields, lines) for a sync file. fields is a 2D array of
+    strings with the fields after run:lumi:event of each line (shorter lines
+    padded with ''), lines is the cleaned-up lines themselves.
+    '''
+    # the garbage collector spends a lot of time looking at millions of
+    # new lists for no reason
+    gcWasOn = gc.isenabled()
+    gc.disable()
+    try:
+        with open(fileName) as f:
+            lines = [l.strip().lstrip('< >') for l in f]
+        lines = [l for l in lines if l]
+        words = [l.split(':') for l in lines]
+
+        if not words:
+            return EventIndex(np.zeros(0, dtype=np.uint64), (1, 1)), np.zeros((0, 0), dtype=str), lines
+
+        if any(not w[0].isdigit() for w in words):
+            words = [_dropPrefix(w) for w in words]
+        if any(len(w) < 3 for w in words):
+            raise ValueError("Some lines of {} have no run:lumi:event".format(fileName))
+
+        index = EventIndex.fromArrays(*[_parseColumn(words, i, fileName)
+                                        for i in range(3)])
+
+        nCols = max(len(w) for w in words)
+        if any(len(w) != nCols for w in words):
+            words = [w + [''] * (nCols - len(w)) for w in words]
+        fields = np.array(words)[:, 3:]
+    finally:
+        if gcWasOn:
+            gc.enable()
+
+    return index, fields, lines
+
+
+def _asNumbers(x):
+    '''
+    (values, isNumber) for an array of strings: the float value of each
+    (NaN if it isn't a number) and a boolean array saying which are.
+    '''
+    try:
+        return x.astype(np.float64), np.ones(len(x), dtype=bool)
+    except ValueError:
+        pass
+
+    # Only convert each distinct string once; columns with things that
+    # aren't numbers usually don't have many different values
+    unique, inverse = np.unique(x, return_inverse=True)
+    values = np.empty(len(unique))
+    isNumber = np.ones(len(unique), dtype=bool)
+    for i, u in enumerate(unique):
+        try:
+            values[i] = float(u)
+        except ValueError:
+            values[i] = np.nan
+            isNumber[i] = False
+
+    return values[inverse], isNumber[inverse]
+
+
+def fieldsDiffer(x, y, absTol=0., relTol=0.):
+    '''
+    Boolean array, True where x and y (arrays of strings) disagree. Where
+    both are numbers, they agree if they're within absTol + relTol * |y| of
+    each other (or both NaN). Anything else has to match exactly.
+    '''
+    xf, xIsNumber = _asNumbers(x)
+    yf, yIsNumber = _asNumbers(y)
+
+    differ = x != y
+
+    numbers = xIsNumber & yIsNumber
+    xf = xf[numbers]
+    yf = yf[numbers]
+    with np.errstate(invalid='ignore'):
+        agree = (xf == yf) | (np.abs(xf - yf) <= absTol + relTol * np.abs(yf))
+    agree |= np.isnan(xf) & np.isnan(yf)
+    differ[numbers] = ~agree
+
+    return differ
+
+
+def diffSync(indexA, fieldsA, indexB, fieldsB, absTol=0., relTol=0.):
+    '''
+    Compare the lines of two sync files (from readSyncFile()). Returns
+    (onlyA, onlyB, entriesA, entriesB, differs), where
+        onlyA, onlyB:          lines of each file whose events are not in
+                                   the other, sorted by event
+        entriesA, entriesB:    lines of the events in both, in pairs,
+                                   sorted by event
+        differs:               boolean array with one row for each pair and
+                                   one column for each field compared,
+                                   True where the field differs
+    '''
+    firstA = indexA.firstRows('first')
+    firstB = indexB.firstRows('first')
+
+    onlyA = indexA.order[(firstA & ~indexB.contains(indexA))[indexA.order]]
+    onlyB = indexB.order[(firstB & ~indexA.contains(indexB))[indexB.order]]
+
+    entriesA, entriesB = indexA.join(indexB)
+    first = firstA[entriesA] & firstB[entriesB]
+    entriesA = entriesA[first]
+    entriesB = entriesB[first]
+
+    nFields = min(fieldsA.shape[1], fieldsB.shape[1])
+    differs = np.zeros((len(entriesA), nFields), dtype=bool)
+    for i in xrange(nFields):
+        differs[:, i] = fieldsDiffer(fieldsA[entriesA, i], fieldsB[entriesB, i],
+                                     absTol, relTol)
+
+    return onlyA, onlyB, entriesA, entriesB, differs
+
+
+def eventArrays(index, entries):
+    '''
+    (run, lumi, evt) arrays for entries of index.
+    '''
+    return unpackKeys(index.keys[entries], index.layout)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare two sync files event by event.')
+    parser.add_argument('fileA', type=str, help='First sync file')
+    parser.add_argument('fileB', type=str, help='Second sync file')
+    parser.add_argument('--eventFile', type=str, default='',
+                        help='Write the events that disagree here, in the format SyncAnalyzer reads.')
+    parser.add_argument('--write', type=str, default='onlyA,onlyB,diff',
+                        help=('Comma separated (no spaces) list of which events to write to '
+                              'the event file: onlyA, onlyB, and/or diff (in both, with '
+                              'different fields).'))
+    parser.add_argument('--absTol', type=float, default=0.,
+                        help='Numbers agree if they differ by no more than absTol + relTol * |number from fileB|.')
+    parser.add_argument('--relTol', type=float, default=0.,
+                        help='Numbers agree if they differ by no more than absTol + relTol * |number from fileB|.')
+    parser.add_argument('--nShow', type=int, default=10,
+                        help='Number of examples to print of each kind of disagreement.')
+
+    args = parser.parse_args()
+
+    indexA, fieldsA, linesA = readSyncFile(args.fileA)
+    indexB, fieldsB, linesB = readSyncFile(args.fileB)
+
+    onlyA, onlyB, entriesA, entriesB, differs = diffSync(indexA, fieldsA, indexB, fieldsB,
+                                                         args.absTol, args.relTol)
+    anyDiffers = differs.any(axis=1)
+
+    print "%d lines (%d events) in %s"%(len(indexA), indexA.firstRows().sum(), args.fileA)
+    print "%d lines (%d events) in %s"%(len(indexB), indexB.firstRows().sum(), args.fileB)
+    print "%d events in both, %d of them with differences"%(len(entriesA), anyDiffers.sum())
+
+    print "\n%d events only in %s:"%(len(onlyA), args.fileA)
+    for i in onlyA[:args.nShow]:
+        print "    < %s"%linesA[i]
+    print "\n%d events only in %s:"%(len(onlyB), args.fileB)
+    for i in onlyB[:args.nShow]:
+        print "    > %s"%linesB[i]
+
+    if fieldsA.shape[1] != fieldsB.shape[1]:
+        print "\nWarning: lines have %d fields in %s and %d in %s; only the first %d are compared."%(
+            fieldsA.shape[1] + 3, args.fileA, fieldsB.shape[1] + 3, args.fileB,
+            differs.shape[1] + 3)
+
+    # fields numbered from 1, like cut -f
+    for i, nDiff in enumerate(differs.sum(axis=0)):
+        if not nDiff:
+            continue
+        print "\nField %d differs in %d events:"%(i + 4, nDiff)
+        for iA, iB in zip(entriesA[differs[:, i]][:args.nShow], entriesB[differs[:, i]][:args.nShow]):
+            print "    < %s\n    > %s"%(linesA[iA], linesB[iB])
+
+    if args.eventFile:
+        toWrite = args.write.split(',')
+        for w in toWrite:
+            assert w in ['onlyA', 'onlyB', 'diff'], "Unknown event category {}".format(w)
+
+        events = []
+        if 'onlyA' in toWrite:
+            events.append(eventArrays(indexA, onlyA))
+        if 'onlyB' in toWrite:
+            events.append(eventArrays(indexB, onlyB))
+        if 'diff' in toWrite:
+            events.append(eventArrays(indexA, entriesA[anyDiffers]))
+        run, lumi, evt = [np.concatenate([e[i] for e in events]) if events else np.zeros(0)
+                          for i in range(3)]
+        order = np.lexsort((evt, lumi, run))
+
+        with open(args.eventFile, 'w') as fout:
+            fout.writelines('%d:%d:%d\n'%e for e in izip(run[order].tolist(),
+                                                          lumi[order].tolist(),
+                                                          evt[order].tolist()))
+
+        print "\nWrote %d events to %s"%(len(order), args.eventFile)
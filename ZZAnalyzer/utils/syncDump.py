@@ -0,0 +1,296 @@
+'''
+
+Shared engine for the sync dumps in utils/scripts (smpSync.py,
+finalSync.py, leptonSync.py and the control region versions).
+
+A script describes its output with
+    - a line template, a str.format() string with named fields, e.g.
+          '{run}:{lumi}:{event}:{m4l:.2f}:{mZ1:.2f}\n'
+    - the fields, each a function of (ColumnBlock, objects) returning an
+          array with one value per row (run, lumi and event default to the
+          run, lumi and evt branches, channel to the channel name), or a
+          single function of (ColumnBlock, channel, objects) returning all
+          the columns at once (for dumps with more than one line per row)
+and a SyncDumper reads each channel's ntuple(s) a chunk at a time,
+computes every field for every row as arrays, optionally keeps one row
+per event (or per any set of fields), sorts everything with a
+lexicographic sort on the sort fields (by default run, then lumi, then
+event, the same as sort -t : -k 1n -k 2n -k 3n), and writes the lines a
+chunk at a time.
+
+Author: Nate Woods, U. Wisconsin
+
+'''
+
+import string
+from itertools import izip
+
+import numpy as np
+
+from ZZAnalyzer.utils.columnar import ColumnReader
+from ZZAnalyzer.utils.helpers import zMassDist
+
+
+_eventFields = ['run', 'lumi', 'event']
+
+
+def getObjects(channel, sort=False):
+    '''
+    Names of the objects in channel, e.g. ['e1', 'e2', 'm1', 'm2'] for eemm
+    (or 'e' for the only electron in emm).
+    '''
+    nObj = {}
+    for letter in channel:
+        if letter not in nObj:
+            nObj[letter] = 1
+        else:
+            nObj[letter] += 1
+    out = []
+    for letter in nObj:
+        if nObj[letter] == 1:
+            out.append(letter)
+        else:
+            out += [letter+str(n+1) for n in range(nObj[letter])]
+    if sort:
+        return sorted(out)
+    return out
+
+
+def compileTemplate(template):
+    '''
+    Turn a str.format() template with named fields into one with numbered
+    fields, so lines can be formatted from tuples of values. Returns the
+    new template and the field names, in order.
+    '''
+    out = []
+    names = []
+    for literal, name, spec, conversion in string.Formatter().parse(template):
+        out.append(literal.replace('{', '{{').replace('}', '}}'))
+        if name is not None:
+            out.append('{' + str(len(names)) +
+                       ('!' + conversion if conversion else '') +
+                       (':' + spec if spec else '') + '}')
+            names.append(name)
+    return ''.join(out), names
+
+
+def jaggedLengths(col):
+    '''
+    Length of each row's entry of a vector branch (an array of arrays).
+    '''
+    return np.fromiter((len(v) for v in col), dtype=np.int64, count=len(col))
+
+
+def jaggedAt(col, i, default=-1.):
+    '''
+    Item i of each row's entry of a vector branch, or default for rows with
+    fewer than i+1 items.
+    '''
+    lengths = jaggedLengths(col)
+    out = np.full(len(col), default, dtype=np.float64)
+    has = lengths > i
+    if has.any():
+        flat = np.concatenate([np.asarray(v, dtype=np.float64) for v in col[has]])
+        starts = np.cumsum(lengths[has]) - lengths[has]
+        out[has] = flat[starts + i]
+    return out
+
+
+def atLeast(x, lo=-1.):
+    '''
+    max(lo, x) for every item of x.
+    '''
+    return np.where(x > lo, x, lo)
+
+
+def orderedZMasses(mZ1, mZ2):
+    '''
+    Z masses swapped where the second is closer to the nominal Z mass (the
+    eemm channel may have them in the wrong order).
+    '''
+    swap = zMassDist(mZ1) > zMassDist(mZ2)
+    return np.where(swap, mZ2, mZ1), np.where(swap, mZ1, mZ2)
+
+
+def uniqueRows(keys, keep='first'):
+    '''
+    Entries of one row for each distinct combination of keys (a list of
+    arrays, e.g. run, lumi and event), the first or last one in row order
+    depending on keep. The entries are returned in row order.
+    '''
+    if not len(keys[0]):
+        return np.arange(0)
+
+    # lexsort is stable, so rows with the same keys stay in row order
+    order = np.lexsort(keys[::-1])
+    same = np.ones(len(order) - 1, dtype=bool)
+    for k in keys:
+        k = k[order]
+        same &= k[1:] == k[:-1]
+
+    chosen = np.ones(len(order), dtype=bool)
+    if keep == 'first':
+        chosen[1:] = ~same
+    elif keep == 'last':
+        chosen[:-1] = ~same
+    else:
+        raise ValueError("keep must be 'first' or 'last', not {}".format(keep))
+
+    return np.sort(order[chosen])
+
+
+def _concat(pieces):
+    '''
+    Concatenate a list of dicts of arrays, column by column.
+    '''
+    if not pieces:
+        return {}
+    return {name : np.concatenate([p[name] for p in pieces]) for name in pieces[0]}
+
+
+def _take(columns, idx):
+    return {name : col[idx] for name, col in columns.iteritems()}
+
+
+
+class SyncDumper(object):
+    def __init__(self, template, fields, objects=getObjects, selection=None,
+                 unique=None, keep='first', uniquePerChannel=True,
+                 sortBy=_eventFields, channelNames={}, branches=None,
+                 chunkSize=100000, verbose=False):
+        '''
+        template:          line template (see compileTemplate())
+        fields:            {name : function of (block, objects)}, or one
+                               function of (block, channel, objects)
+                               returning {name : array}
+        objects:           function giving the objects for a channel
+        selection:         optional function of (block, objects) giving
+                               a boolean array of rows to dump
+        unique:            optional list of fields; if given, only one row
+                               is dumped for each distinct set of values of
+                               them (the first or last, according to keep),
+                               within each channel if uniquePerChannel is
+                               True or across all channels if not
+        sortBy:            fields to sort by, in order of importance; a
+                               (name, True) pair sorts descending. If None,
+                               lines are written in the order they're read.
+        channelNames:      what to write for {channel} for each channel
+                               (default: the channel itself)
+        branches:          optional function of (channel, objects) giving
+                               branches to read up front (anything else is
+                               read when it's first used)
+        '''
+        self.template = template
+        self.fields = fields
+        self.objects = objects
+        self.selection = selection
+        self.unique = unique
+        self.keep = keep
+        self.uniquePerChannel = uniquePerChannel
+        self.sortBy = sortBy
+        self.channelNames = channelNames
+        self.branches = branches
+        self.chunkSize = chunkSize
+        self.verbose = verbose
+
+
+    def blockColumns(self, block, channel, objects):
+        '''
+        {field : array} for one block of rows.
+        '''
+        if self.selection is not None:
+            block = block.take(np.asarray(self.selection(block, objects), dtype=bool))
+
+        if callable(self.fields):
+            out = dict(self.fields(block, channel, objects))
+        else:
+            out = {name : f(block, objects) for name, f in self.fields.iteritems()}
+            out.setdefault('run', block.run)
+            out.setdefault('lumi', block.lumi)
+            out.setdefault('event', block.evt)
+
+        nRows = len(out['run'])
+        out = {name : np.asarray(col) if np.ndim(col) else np.full(nRows, col)
+               for name, col in out.iteritems()}
+        out['channel'] = np.full(nRows, self.channelNames.get(channel, channel),
+                                 dtype=object)
+
+        return out
+
+
+    def channelColumns(self, files, channel, treePath):
+        '''
+        {field : array} for every row of channel in files (after the
+        selection, and the duplicate removal if it's per channel).
+        '''
+        objects = self.objects(channel)
+        branches = self.branches(channel, objects) if self.branches is not None else []
+
+        pieces = []
+        for fileName in files:
+            reader = ColumnReader(fileName, treePath.format(channel=channel))
+            try:
+                for block in reader.blocks(branches, self.chunkSize):
+                    if self.verbose:
+                        print "Processing row %d"%block.entries[0]
+                    pieces.append(self.blockColumns(block, channel, objects))
+            finally:
+                reader.close()
+
+        columns = _concat(pieces)
+        if columns and self.unique and self.uniquePerChannel:
+            columns = _take(columns, uniqueRows([columns[u] for u in self.unique],
+                                                self.keep))
+        return columns
+
+
+    def collect(self, files, channels, treePath='{channel}/ntuple'):
+        '''
+        {field : array} for all lines to write, in order.
+        '''
+        if isinstance(files, str):
+            files = [files]
+
+        pieces = []
+        for channel in channels:
+            if self.verbose:
+                print "\nChannel %s:"%channel
+            columns = self.channelColumns(files, channel, treePath)
+            if columns:
+                pieces.append(columns)
+
+        columns = _concat(pieces)
+        if not columns:
+            return columns
+
+        if self.unique and not self.uniquePerChannel:
+            columns = _take(columns, uniqueRows([columns[u] for u in self.unique],
+                                                self.keep))
+
+        if self.sortBy:
+            keys = []
+            for s in self.sortBy:
+                name, descending = (s, False) if isinstance(s, str) else s
+                keys.append(-columns[name] if descending else columns[name])
+            columns = _take(columns, np.lexsort(keys[::-1]))
+
+        return columns
+
+
+    def dump(self, files, channels, outFile, treePath='{channel}/ntuple'):
+        '''
+        Write the sync file for channels of files (a file name or list of
+        them; rows from all of them are dumped as if they were one ntuple)
+        to outFile. Returns the number of lines written.
+        '''
+        columns = self.collect(files, channels, treePath)
+        nLines = len(columns['run']) if columns else 0
+
+        template, names = compileTemplate(self.template)
+        with open(outFile, 'w') as fout:
+            for start in xrange(0, nLines, self.chunkSize):
+                stop = min(start + self.chunkSize, nLines)
+                values = [columns[name][start:stop].tolist() for name in names]
+                fout.writelines(template.format(*v) for v in izip(*values))
+
+        return nLines
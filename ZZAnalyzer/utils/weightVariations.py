@@ -0,0 +1,175 @@
+'''
+
+A nominal event weight and any number of named variations of it (scale
+factors up and down, pileup weights up and down, shifted fake rates...),
+so everything needed for the systematics can be filled in one pass over
+the ntuples instead of one pass per variation.
+
+Each weight may be a TTree::Draw() expression, an ArrayWeight (see
+histLookup), or (when evaluating directly on arrays only) any function of
+a ColumnBlock or dict of arrays. When evaluating directly on a ColumnBlock,
+string expressions can only be branch names:
+
+>>> w = WeightVariations('GenWeight*' + puNominal)
+>>> w = w.add('PUup', 'GenWeight*' + puUp).add('PUdown', 'GenWeight*' + puDown)
+
+The nominal weight is named '' (like the scale arguments elsewhere).
+NtuplePlotter.makeHistVariations() takes one in place of a weight and
+returns a histogram for each variation, all filled from the same read of
+the ntuple (all expressions are evaluated together, see
+NtuplePlotter.fillFromTree()). In a columnar analysis, matrix() gives an
+array of weights with one row per variation, and binnedYields() turns
+that into yields and errors per bin for every variation at once.
+
+Author: Nate Woods, U. Wisconsin
+
+'''
+
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+from ZZAnalyzer.utils.histLookup import ArrayWeight, findBins, checkColumnExpressions
+
+
+def _weightKey(w):
+    if isinstance(w, str):
+        return w
+    if isinstance(w, ArrayWeight):
+        return w.key()
+    return getattr(w, '__name__', repr(w))
+
+
+
+class WeightVariations(object):
+    def __init__(self, nominal, variations=None):
+        '''
+        nominal:     the nominal weight
+        variations:  list of (name, weight), or an OrderedDict of them
+        '''
+        self.weights = OrderedDict([('', nominal)])
+        if variations is not None:
+            if isinstance(variations, dict):
+                variations = variations.items()
+            for name, w in variations:
+                assert name and name not in self.weights, "Variation names must be unique and nonempty"
+                self.weights[name] = w
+
+
+    @property
+    def names(self):
+        '''
+        Names of all weights, starting with '' for the nominal.
+        '''
+        return self.weights.keys()
+
+
+    def weight(self, name=''):
+        return self.weights[name]
+
+
+    def add(self, name, weight):
+        '''
+        New WeightVariations with one more variation.
+        '''
+        return WeightVariations(self.weights[''],
+                                self.weights.items()[1:] + [(name, weight)])
+
+
+    def times(self, factor):
+        '''
+        New WeightVariations with every weight multiplied by factor (a
+        TTree::Draw() expression), e.g. a control region weight that's the
+        same for all variations.
+        '''
+        def mult(w):
+            if isinstance(w, str):
+                return '({0})*({1})'.format(w, factor) if w else factor
+            if isinstance(w, ArrayWeight):
+                expr = '({0})*({1})'.format(w.expression, factor) if w.expression else factor
+                return ArrayWeight(expr, w.cut, w.lookups)
+            raise TypeError("Can only multiply string and ArrayWeight weights by an expression")
+
+        out = [(name, mult(w)) for name, w in self.weights.iteritems()]
+        return WeightVariations(out[0][1], out[1:])
+
+
+    def expressions(self):
+        '''
+        All string expressions that have to be evaluated for each row.
+        '''
+        out = []
+        for w in self.weights.values():
+            if isinstance(w, str):
+                needed = [w] if w else []
+            elif isinstance(w, ArrayWeight):
+                needed = w.expressions()
+            else:
+                continue
+            out += [e for e in needed if e not in out]
+        return out
+
+
+    def matrix(self, columns):
+        '''
+        Array of weights with shape (number of weights, number of rows), in
+        the order of names, for the rows in columns (a ColumnBlock, or a dict
+        mapping expressions to arrays). Expressions shared between weights
+        are looked up once. On a ColumnBlock, string weights must be branch
+        names (formulas raise a ValueError before anything is evaluated).
+        '''
+        checkColumnExpressions(columns, self.expressions())
+
+        nRows = len(columns) if not isinstance(columns, dict) else len(columns.values()[0])
+
+        out = np.empty((len(self.weights), nRows))
+        for i, w in enumerate(self.weights.values()):
+            if isinstance(w, str):
+                if not w:
+                    out[i] = 1.
+                elif isinstance(columns, dict):
+                    out[i] = columns[w]
+                else:
+                    out[i] = getattr(columns, w)
+            else:
+                out[i] = w(columns)
+
+        return out
+
+
+    def key(self):
+        '''
+        Hash of all weights and their names, for caching.
+        '''
+        h = hashlib.sha1()
+        for name, w in self.weights.iteritems():
+            h.update(repr((name, _weightKey(w))))
+        return h.hexdigest()
+
+
+
+def binnedYields(axisInfo, x, weights):
+    '''
+    Sums of weights and of squared weights in every bin (including under-
+    and overflow) for values x, for every row of weights (a matrix from
+    WeightVariations.matrix(), or a single array of weights).
+    axisInfo is (nBins, low, high, edges or None), as from
+    histLookup.binAxis(). Returns two arrays of shape
+    (number of weights, nBins + 2), to be added up across chunks; the
+    errors are the square root of the second.
+    '''
+    weights = np.atleast_2d(weights)
+    nCells = axisInfo[0] + 2
+
+    bins = findBins(axisInfo, x)
+    # offset each weight's bins so one bincount does every variation
+    flatBins = (bins[np.newaxis, :] +
+                nCells * np.arange(weights.shape[0])[:, np.newaxis]).ravel()
+
+    sumW = np.bincount(flatBins, weights.ravel(),
+                       nCells * weights.shape[0]).reshape(weights.shape[0], nCells)
+    sumW2 = np.bincount(flatBins, (weights * weights).ravel(),
+                        nCells * weights.shape[0]).reshape(weights.shape[0], nCells)
+
+    return sumW, sumW2
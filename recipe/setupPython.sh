@@ -17,4 +17,7 @@ source "$vpython"/bin/activate
 
 pip install -U pip
 pip install -U rootpy
+pip install -U numpy
+# for columnar mode and the array-based tools
+pip install -U root_numpy
 